@@ -1,17 +1,39 @@
+import asyncio
+import hashlib
+import json
 import logging
+import time
 
 from datetime import datetime
 
 import pydantic
 import httpx
+import redis.asyncio as redis
+from opentelemetry import trace
 from pydantic import root_validator
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
+from app import settings
+from app.services.errors import CircuitBreakerOpen
+from app.services.logs import log_payload
+from app.services.metrics import DIGITANIMAL_REQUEST_DURATION
+from app.services.tracing import traced
 from app.services.state import IntegrationStateManager
+from app.services.throttling import TokenBucketRateLimiter, CircuitBreaker
+from app.services.utils import LazyInstance, timed_stage
 from app.actions.configurations import AuthenticateConfig
 
 
-state_manager = IntegrationStateManager()
+state_manager = LazyInstance(IntegrationStateManager)
+rate_limiter = TokenBucketRateLimiter(
+    rate=settings.DIGITANIMAL_RATE_LIMIT_PER_SECOND,
+    capacity=settings.DIGITANIMAL_RATE_LIMIT_BURST
+)
+circuit_breaker = CircuitBreaker(
+    failure_threshold=settings.DIGITANIMAL_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    recovery_timeout=settings.DIGITANIMAL_CIRCUIT_BREAKER_RECOVERY_TIMEOUT,
+    db_client=LazyInstance(getattr, state_manager, "db_client")  # Shares the state manager's Redis client, on first use
+)
 logger = logging.getLogger(__name__)
 
 
@@ -72,6 +94,106 @@ class DigitAnimalResponse(pydantic.BaseModel):
     data: DigitAnimalData
 
 
+# Response data (JSON) shared by integrations pointing at the same DigitAnimal account.
+# Each caller parses its own DigitAnimalResponse from it.
+_response_cache: Dict[str, Tuple[float, dict]] = {}
+_inflight_requests: Dict[str, asyncio.Future] = {}
+
+
+def _get_response_cache_key(url: str, auth: dict, params: dict = None) -> str:
+    # The password is part of the key so bad credentials never get a response fetched with valid ones
+    raw_key = json.dumps([url, auth["username"], auth["password"], params], sort_keys=True, default=str)
+    return f"digitanimal_response.{hashlib.sha256(raw_key.encode('utf-8')).hexdigest()}"
+
+
+def clear_response_cache():
+    _response_cache.clear()
+
+
+async def _get_cached_response(cache_key: str) -> Optional[dict]:
+    if (cached := _response_cache.get(cache_key)) is not None:
+        expires_at, response = cached
+        if expires_at > time.monotonic():
+            return response
+        _response_cache.pop(cache_key, None)
+    if settings.DIGITANIMAL_RESPONSE_CACHE_USE_REDIS:
+        try:
+            cached_json = await state_manager.db_client.get(cache_key)
+        except redis.RedisError as e:
+            logger.warning(f"Error reading cached DigitAnimal response from Redis: {e}")
+        else:
+            if cached_json:
+                data = json.loads(cached_json)
+                _response_cache[cache_key] = (time.monotonic() + settings.DIGITANIMAL_RESPONSE_CACHE_TTL, data)
+                return data
+    return None
+
+
+async def _set_cached_response(cache_key: str, data: dict):
+    now = time.monotonic()
+    if len(_response_cache) >= settings.DIGITANIMAL_RESPONSE_CACHE_MAX_ENTRIES:
+        # Drop expired entries first, then the oldest ones
+        for key in [k for k, (expires_at, _) in _response_cache.items() if expires_at <= now]:
+            _response_cache.pop(key, None)
+        while len(_response_cache) >= settings.DIGITANIMAL_RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.pop(next(iter(_response_cache)))
+    _response_cache[cache_key] = (now + settings.DIGITANIMAL_RESPONSE_CACHE_TTL, data)
+    if settings.DIGITANIMAL_RESPONSE_CACHE_USE_REDIS:
+        try:
+            await state_manager.db_client.setex(cache_key, settings.DIGITANIMAL_RESPONSE_CACHE_TTL, json.dumps(data))
+        except redis.RedisError as e:
+            logger.warning(f"Error saving DigitAnimal response in Redis: {e}")
+
+
+def _is_upstream_failure(error: Exception) -> bool:
+    # Only errors that indicate an unhealthy upstream count for the circuit breaker (not bad credentials)
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, httpx.TransportError)
+
+
+async def _fetch_devices_observations(url: str, auth: dict, params: dict = None) -> dict:
+    account = f"digitanimal.{url}.{auth['username']}"
+    if settings.DIGITANIMAL_CIRCUIT_BREAKER_ENABLED:
+        await circuit_breaker.before_request(account)  # Fails fast with CircuitBreakerOpen
+    await rate_limiter.acquire(account)
+    start = time.perf_counter()
+    try:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(connect=10.0, read=30.0, write=15.0, pool=5.0)) as session:
+            response = await session.get(
+                url=url,
+                params=params,
+                auth=(auth['username'], auth['password']),
+            )
+            DIGITANIMAL_REQUEST_DURATION.labels(status=response.status_code).observe(time.perf_counter() - start)
+            response.raise_for_status()
+    except Exception as e:
+        if isinstance(e, httpx.TransportError):
+            DIGITANIMAL_REQUEST_DURATION.labels(status="error").observe(time.perf_counter() - start)
+        if settings.DIGITANIMAL_CIRCUIT_BREAKER_ENABLED:
+            if _is_upstream_failure(e):
+                await circuit_breaker.record_failure(account)
+            elif isinstance(e, httpx.HTTPStatusError):  # The upstream is healthy, e.g. bad credentials (4xx)
+                await circuit_breaker.record_success(account)
+            else:  # Not an upstream failure, the trial request (if it was one) is released
+                await circuit_breaker.release_trial(account)
+        raise
+    else:
+        if settings.DIGITANIMAL_CIRCUIT_BREAKER_ENABLED:
+            await circuit_breaker.record_success(account)
+
+    logger.info(f"Got devices observations for username: '{auth['username']}'")
+    log_payload(logger, "Response", response.content, path="get_device_info.php")
+    return response.json()
+
+
+def _parse_devices_observations(data: dict) -> DigitAnimalResponse:
+    # Runs in the caller's context, so each action records its own parse stage
+    with timed_stage("parse"):
+        return DigitAnimalResponse.parse_obj(data)
+
+
+@traced("digitanimal.get_devices_observations")
 async def get_devices_observations(
         integration_id: str,
         base_url: str,
@@ -80,6 +202,7 @@ async def get_devices_observations(
 ):
     """
         Call the client's 'get_device_info.php' endpoint (with dates range)
+        Identical requests made within DIGITANIMAL_RESPONSE_CACHE_TTL seconds share a single upstream call
 
     :param: integration_id: The integration ID
     :param: base_url: The base URL of the DigitAnimal API
@@ -89,23 +212,32 @@ async def get_devices_observations(
     """
 
     logger.info(f"Getting devices observations for integration: '{integration_id}' Username: '{auth['username']}'")
+    trace.get_current_span().set_attribute("integration_id", str(integration_id))
 
     url = f"{base_url}get_device_info.php"
 
     if params:
         params = DigitAnimalHistoricalRequestParams(**params).dict()
 
-    async with httpx.AsyncClient(timeout=httpx.Timeout(connect=10.0, read=30.0, write=15.0, pool=5.0)) as session:
-        response = await session.get(
-            url=url,
-            params=params,
-            auth=(auth['username'], auth['password']),
-        )
-        response.raise_for_status()
-
-    response_json = response.json()
-
-    logger.info(f"Got devices observations for username: '{auth['username']}'")
-    logger.debug(f"Response: {response_json}")
-
-    return DigitAnimalResponse.parse_obj(response_json)
+    if settings.DIGITANIMAL_RESPONSE_CACHE_TTL <= 0:
+        return _parse_devices_observations(await _fetch_devices_observations(url, auth, params))
+
+    cache_key = _get_response_cache_key(url, auth, params)
+    # Handlers modify the devices in place, so each caller parses its own response from the shared data
+    if (data := await _get_cached_response(cache_key)) is not None:
+        logger.info(f"Using cached devices observations for username: '{auth['username']}'")
+        return _parse_devices_observations(data)
+
+    # Single-flight: concurrent callers with the same key await the same upstream request
+    if (request := _inflight_requests.get(cache_key)) is None:
+        request = asyncio.ensure_future(_fetch_devices_observations(url, auth, params))
+        _inflight_requests[cache_key] = request
+        request.add_done_callback(lambda _: _inflight_requests.pop(cache_key, None))
+        is_owner = True
+    else:
+        is_owner = False
+    data = await asyncio.shield(request)
+    response = _parse_devices_observations(data)
+    if is_owner:  # Cached once it's known to be valid
+        await _set_cached_response(cache_key, data)
+    return response
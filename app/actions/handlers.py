@@ -11,11 +11,12 @@ from app.actions.configurations import (
 )
 from app.services.activity_logger import activity_logger
 from app.services.gundi import send_observations_to_gundi
+from app.services.metrics import OBSERVATIONS
 from app.services.state import IntegrationStateManager
-from app.services.utils import generate_batches
+from app.services.utils import generate_batches, LazyInstance, StageTimings
 
 logger = logging.getLogger(__name__)
-state_manager = IntegrationStateManager()
+state_manager = LazyInstance(IntegrationStateManager)
 
 
 DIGITANIMAL_BASE_URL = "https://digitanimalapp.com/api/"
@@ -77,60 +78,68 @@ async def action_pull_observations(integration, action_config: PullObservationsC
         "password": auth_config.password.get_secret_value(),
     }
 
+    timings = StageTimings.start()  # Returned in the result, so they are logged in the activity logs too
     try:
-        devices_response = await client.get_devices_observations(integration.id, base_url, auth)
+        with timings.stage("fetch"):
+            devices_response = await client.get_devices_observations(integration.id, base_url, auth)
         # Check if there are devices associated with the account (auth was successful and the account is active)
         devices = devices_response.data.devices
         if devices:
             observations = []
             observations_extracted = 0
             logger.info(f"Found {len(devices)} devices for integration {integration.id} Account: {auth_config.username}")
-            for device in devices:
+            OBSERVATIONS.labels(action_id="pull_observations", stage="fetched").inc(len(devices))
+            # Read the state of all the devices at once
+            with timings.stage("state_read"):
+                devices_state = await state_manager.get_states(
+                    integration_id=integration.id,
+                    action_id="pull_observations",
+                    source_ids=[device.DEVICE_COLLAR for device in devices]
+                )
+            with timings.stage("transform"):
                 # fix device.DEVICE_TIME timezone
-                recorded_at = device.DEVICE_TIME
                 time_delta = timedelta(hours=action_config.gmt_offset)
                 timezone_object = timezone(time_delta)
-
-                device.DEVICE_TIME = recorded_at.replace(tzinfo=timezone_object)
-
-                if device_state := await state_manager.get_state(
-                    integration_id=integration.id,
-                    action_id="pull_observations",
-                    source_id=device.DEVICE_COLLAR
-                ):
-                    # Check if the device has new observations since the last pull
-                    latest_device_datetime = datetime.fromisoformat(device_state["latest_device_datetime"])
-                    if device.DEVICE_TIME > latest_device_datetime:
-                        observations.append(transform(device))
+                for device in devices:
+                    recorded_at = device.DEVICE_TIME
+                    device.DEVICE_TIME = recorded_at.replace(tzinfo=timezone_object)
+
+                    if device_state := devices_state.get(device.DEVICE_COLLAR):
+                        # Check if the device has new observations since the last pull
+                        latest_device_datetime = datetime.fromisoformat(device_state["latest_device_datetime"])
+                        if device.DEVICE_TIME > latest_device_datetime:
+                            observations.append(transform(device))
+                        else:
+                            logger.info(f"Filtering observation {device.DEVICE_TIME} for device {device.DEVICE_COLLAR}")
                     else:
-                        logger.info(f"Filtering observation {device.DEVICE_TIME} for device {device.DEVICE_COLLAR}")
-                else:
-                    # new observation
-                    observations.append(transform(device))
-
+                        # new observation
+                        observations.append(transform(device))
+            OBSERVATIONS.labels(action_id="pull_observations", stage="filtered").inc(len(devices) - len(observations))
 
             if observations:
                 logger.info(f"Sending {len(observations)} observations to Gundi")
-                for i, batch in enumerate(generate_batches(observations, 200)):
-                    logger.info(f'Sending observations batch #{i}: {len(batch)} observations. Username: {auth_config.username}')
-                    response = await send_observations_to_gundi(observations=batch, integration_id=integration.id)
-                    observations_extracted += len(response)
+                with timings.stage("send"):
+                    for i, batch in enumerate(generate_batches(observations, 200)):
+                        logger.info(f'Sending observations batch #{i}: {len(batch)} observations. Username: {auth_config.username}')
+                        response = await send_observations_to_gundi(observations=batch, integration_id=integration.id)
+                        observations_extracted += len(response)
+                OBSERVATIONS.labels(action_id="pull_observations", stage="sent").inc(observations_extracted)
 
                 # Save latest device updated_at
-                for obs in observations:
-                    await state_manager.set_state(
+                with timings.stage("state_write"):
+                    await state_manager.set_states(
                         integration_id=integration.id,
                         action_id="pull_observations",
-                        source_id=obs["source"],
-                        state={
-                            "latest_device_datetime": obs["recorded_at"].isoformat()
+                        states={
+                            obs["source"]: {"latest_device_datetime": obs["recorded_at"].isoformat()}
+                            for obs in observations
                         }
                     )
 
-            return {"observations_extracted": observations_extracted}
+            return {"observations_extracted": observations_extracted, "timings": timings.as_dict()}
         else:
             logger.warning(f"No devices found for integration {integration.id} Account: {auth_config.username}")
-            return {"devices_triggered": 0}
+            return {"devices_triggered": 0, "timings": timings.as_dict()}
     except Exception as e:
         message = f"Error while pulling observations for integration {integration.id} using {auth_config}. Exception: {e}"
         logger.exception(message)
@@ -152,32 +161,38 @@ async def action_pull_historical_observations(integration, action_config: PullHi
         "end_date": action_config.end_date
     }
 
+    timings = StageTimings.start()
     try:
-        devices_response = await client.get_devices_observations(
-            integration.id,
-            base_url,
-            auth,
-            params
-        )
+        with timings.stage("fetch"):
+            devices_response = await client.get_devices_observations(
+                integration.id,
+                base_url,
+                auth,
+                params
+            )
         # Check if there are devices associated with the account (auth was successful and the account is active)
         devices_historical = devices_response.data.history
         if devices_historical:
             observations = []
             observations_extracted = 0
             logger.info(f"Found {len(devices_historical)} devices for integration {integration.id} Account: {auth_config.username}")
+            OBSERVATIONS.labels(action_id="pull_historical_observations", stage="fetched").inc(len(devices_historical))
 
-            observations.extend(transform(device) for device in devices_historical)
+            with timings.stage("transform"):
+                observations.extend(transform(device) for device in devices_historical)
 
             if observations:
                 logger.info(f"Sending {len(observations)} observations to Gundi")
-                for i, batch in enumerate(generate_batches(observations, 200)):
-                    logger.info(f'Sending observations batch #{i}: {len(batch)} observations. Username: {auth_config.username}')
-                    response = await send_observations_to_gundi(observations=batch, integration_id=integration.id)
-                    observations_extracted += len(response)
-            return {"observations_extracted": observations_extracted}
+                with timings.stage("send"):
+                    for i, batch in enumerate(generate_batches(observations, 200)):
+                        logger.info(f'Sending observations batch #{i}: {len(batch)} observations. Username: {auth_config.username}')
+                        response = await send_observations_to_gundi(observations=batch, integration_id=integration.id)
+                        observations_extracted += len(response)
+                OBSERVATIONS.labels(action_id="pull_historical_observations", stage="sent").inc(observations_extracted)
+            return {"observations_extracted": observations_extracted, "timings": timings.as_dict()}
         else:
             logger.warning(f"No devices found for integration {integration.id} Account: {auth_config.username}")
-            return {"devices_triggered": 0}
+            return {"devices_triggered": 0, "timings": timings.as_dict()}
     except Exception as e:
         message = f"Error while pulling observations for integration {integration.id} using {auth_config}. Exception: {e}"
         logger.exception(message)
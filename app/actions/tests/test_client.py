@@ -1,7 +1,38 @@
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 
+import asyncio
+
 import app.actions.client as client
+from app.services.utils import StageTimings
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache(mocker):
+    mocker.patch("app.settings.DIGITANIMAL_CIRCUIT_BREAKER_ENABLED", False)
+    mocker.patch.object(client, "rate_limiter", client.TokenBucketRateLimiter(rate=0, capacity=0))
+    client.clear_response_cache()
+    yield
+    client.clear_response_cache()
+
+
+def _devices_response(collar="collar1"):
+    return {
+        "success": True,
+        "message": "ok",
+        "data": {
+            "devices": [
+                {
+                    "DEVICE_COLLAR": collar,
+                    "LAT": 10.0,
+                    "LNG": 20.0,
+                    "DEVICE_TIME": "2024-01-01T00:00:00Z"
+                }
+            ],
+            "history": []
+        }
+    }
+
 
 @pytest.mark.asyncio
 async def test_get_devices_observations_success():
@@ -59,3 +90,128 @@ async def test_get_devices_observations_invalid_response():
         with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=AsyncMock()))):
             with pytest.raises(Exception):
                 await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_coalesces_concurrent_requests():
+    async def slow_get(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return MagicMock(json=MagicMock(return_value=_devices_response()), status_code=200)
+
+    mock_get = AsyncMock(side_effect=slow_get)
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        results = await asyncio.gather(*[
+            client.get_devices_observations(f"id-{i}", "url", {"username": "u", "password": "p"})
+            for i in range(5)
+        ])
+        # A request made right after is served from the cache
+        results.append(await client.get_devices_observations("id-6", "url", {"username": "u", "password": "p"}))
+
+    assert mock_get.await_count == 1
+    assert all(r.data.devices[0].DEVICE_COLLAR == "collar1" for r in results)
+    # Each caller gets its own copy of the response
+    assert len({id(r.data.devices[0]) for r in results}) == len(results)
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_records_the_parse_stage_of_each_caller():
+    async def slow_get(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return MagicMock(json=MagicMock(return_value=_devices_response()), status_code=200)
+
+    async def run_action(i):
+        timings = StageTimings.start()  # Each action runs in its own task and context
+        await client.get_devices_observations(f"id-{i}", "url", {"username": "u", "password": "p"})
+        return timings.as_dict()
+
+    mock_get = AsyncMock(side_effect=slow_get)
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        all_timings = await asyncio.gather(*[run_action(i) for i in range(3)])
+        all_timings.append(await run_action(3))  # Served from the cache
+
+    assert mock_get.await_count == 1
+    assert all("parse" in timings for timings in all_timings)
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_invalid_responses_are_not_cached():
+    mock_get = AsyncMock(side_effect=[
+        MagicMock(json=MagicMock(return_value={}), status_code=200),
+        MagicMock(json=MagicMock(return_value=_devices_response()), status_code=200)
+    ])
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        with pytest.raises(client.pydantic.ValidationError):
+            await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+        result = await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+
+    assert mock_get.await_count == 2
+    assert result.data.devices
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_does_not_share_responses_across_credentials():
+    mock_get = AsyncMock(return_value=MagicMock(json=MagicMock(return_value=_devices_response()), status_code=200))
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+        await client.get_devices_observations("id", "url", {"username": "u", "password": "wrong"})
+        await client.get_devices_observations("id", "url", {"username": "other", "password": "p"})
+
+    assert mock_get.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_errors_are_not_cached():
+    mock_get = AsyncMock(side_effect=[
+        Exception("HTTP error"),
+        MagicMock(json=MagicMock(return_value=_devices_response()), status_code=200)
+    ])
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        with pytest.raises(Exception):
+            await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+        result = await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+
+    assert mock_get.await_count == 2
+    assert result.data.devices
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_fails_fast_when_circuit_is_open(mocker):
+    mocker.patch("app.settings.DIGITANIMAL_CIRCUIT_BREAKER_ENABLED", True)
+    mocker.patch.object(client.circuit_breaker, "before_request", AsyncMock(side_effect=client.CircuitBreakerOpen("open")))
+    mock_get = AsyncMock()
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        with pytest.raises(client.CircuitBreakerOpen):
+            await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+
+    assert not mock_get.called
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_records_upstream_failures(mocker):
+    mocker.patch("app.settings.DIGITANIMAL_CIRCUIT_BREAKER_ENABLED", True)
+    mocker.patch.object(client.circuit_breaker, "before_request", AsyncMock())
+    mock_record_failure = mocker.patch.object(client.circuit_breaker, "record_failure", AsyncMock())
+    mock_get = AsyncMock(side_effect=client.httpx.ReadTimeout("timeout"))
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        with pytest.raises(client.httpx.ReadTimeout):
+            await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+
+    mock_record_failure.assert_awaited_once_with("digitanimal.urlget_device_info.php.u")
+
+
+@pytest.mark.asyncio
+async def test_get_devices_observations_client_errors_close_the_circuit(mocker):
+    mocker.patch("app.settings.DIGITANIMAL_CIRCUIT_BREAKER_ENABLED", True)
+    mocker.patch.object(client.circuit_breaker, "before_request", AsyncMock())
+    mock_record_failure = mocker.patch.object(client.circuit_breaker, "record_failure", AsyncMock())
+    mock_record_success = mocker.patch.object(client.circuit_breaker, "record_success", AsyncMock())
+    request = client.httpx.Request("GET", "urlget_device_info.php")
+    response = client.httpx.Response(401, request=request)
+    mock_get = AsyncMock(return_value=response)
+    with patch("httpx.AsyncClient.__aenter__", new=AsyncMock(return_value=MagicMock(get=mock_get))):
+        with pytest.raises(client.httpx.HTTPStatusError):
+            await client.get_devices_observations("id", "url", {"username": "u", "password": "p"})
+
+    # The upstream answered, so a trial request (if it was one) closes the circuit
+    assert not mock_record_failure.called
+    mock_record_success.assert_awaited_once_with("digitanimal.urlget_device_info.php.u")
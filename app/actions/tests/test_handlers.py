@@ -1,10 +1,18 @@
 import pytest
 import pytest_asyncio
 from unittest.mock import AsyncMock, patch, MagicMock
+from prometheus_client import REGISTRY
 
 import app.actions.handlers as handlers
 from app import settings
 
+def get_observations_counts():
+    return {
+        stage: REGISTRY.get_sample_value("observations_total", {"action_id": "pull_observations", "stage": stage}) or 0
+        for stage in ["fetched", "filtered", "sent"]
+    }
+
+
 @pytest_asyncio.fixture
 def auth_config():
     class AuthConfig:
@@ -39,8 +47,8 @@ async def test_action_pull_observations_success(mocker, mock_publish_event, inte
     # Modify auth config
     integration.configurations[2].data = {"username": "user", "password": "pass"}
 
-    mocker.patch("app.services.state.IntegrationStateManager.get_state", return_value=None)
-    mocker.patch("app.services.state.IntegrationStateManager.set_state", return_value=None)
+    mocker.patch("app.services.state.IntegrationStateManager.get_states", return_value={})
+    mocker.patch("app.services.state.IntegrationStateManager.set_states", return_value=None)
     mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
     mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
     mocker.patch("app.services.action_scheduler.trigger_action", return_value=None)
@@ -60,6 +68,50 @@ async def test_action_pull_observations_success(mocker, mock_publish_event, inte
 
     result = await handlers.action_pull_observations(integration, MagicMock(gmt_offset=0))
     assert result["observations_extracted"] == 1
+    assert set(result["timings"]) == {"fetch", "state_read", "transform", "send", "state_write", "total"}
+    assert all(duration >= 0 for duration in result["timings"].values())
+
+@pytest.mark.asyncio
+async def test_action_pull_observations_filters_devices_without_new_observations(
+        mocker, mock_publish_event, integration_v2, auth_config
+):
+    integration = integration_v2
+    # Modify auth config
+    integration.configurations[2].data = {"username": "user", "password": "pass"}
+
+    latest_device_time = handlers.datetime(2024, 1, 1, tzinfo=handlers.timezone.utc)
+    mock_get_states = AsyncMock(return_value={
+        "collar-old": {"latest_device_datetime": latest_device_time.isoformat()}
+    })
+    mocker.patch.object(handlers.state_manager, "get_states", mock_get_states)
+    mock_set_states = mocker.patch.object(handlers.state_manager, "set_states", AsyncMock())
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+
+    devices = []
+    for collar, device_time in [("collar-old", latest_device_time), ("collar-new", handlers.datetime(2024, 1, 2))]:
+        device = MagicMock()
+        device.DEVICE_COLLAR = collar
+        device.DEVICE_TIME = device_time
+        device.LAT = 1.0
+        device.LNG = 2.0
+        device.dict.return_value = {}
+        devices.append(device)
+    devices_response = MagicMock(data=MagicMock(devices=devices))
+
+    mocker.patch("app.actions.client.get_devices_observations", new=AsyncMock(return_value=devices_response))
+    mock_send = mocker.patch("app.actions.handlers.send_observations_to_gundi", new=AsyncMock(return_value=[1]))
+    counts_before = get_observations_counts()
+
+    result = await handlers.action_pull_observations(integration, MagicMock(gmt_offset=0))
+
+    assert result["observations_extracted"] == 1
+    counts = get_observations_counts()
+    assert {stage: counts[stage] - counts_before[stage] for stage in counts} == {"fetched": 2, "filtered": 1, "sent": 1}
+    mock_get_states.assert_awaited_once_with(
+        integration_id=integration.id, action_id="pull_observations", source_ids=["collar-old", "collar-new"]
+    )
+    assert [obs["source"] for obs in mock_send.call_args.kwargs["observations"]] == ["collar-new"]
+    assert list(mock_set_states.call_args.kwargs["states"].keys()) == ["collar-new"]
 
 @pytest.mark.asyncio
 async def test_action_pull_observations_no_devices(mocker, mock_publish_event, integration_v2, auth_config):
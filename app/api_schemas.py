@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -6,4 +7,11 @@ class ActionRequest(BaseModel):
     action_id: str
     run_in_background: bool = False
     config_overrides: dict = None
+    profile: bool = False  # Run the handler under a profiler and return the profile in the result
 
+
+class BulkActionRequest(BaseModel):
+    action_id: str
+    integration_ids: Optional[List[str]] = None  # All the integrations of this type when not set
+    run_in_background: bool = False
+    config_overrides: dict = None
@@ -8,6 +8,9 @@ import pytest
 from unittest.mock import MagicMock
 from app import settings
 from gcloud.aio import pubsub
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
 from gundi_core.schemas.v2 import Integration, IntegrationSummary
 from gundi_core.events import (
     IntegrationActionCustomLog,
@@ -54,6 +57,15 @@ def async_return(result):
     return f
 
 
+@pytest.fixture(autouse=True)
+def reset_error_events():
+    # Error events are rate limited per integration and action, tests must not see the errors of other tests
+    from app.services.action_runner import _error_events
+    _error_events.clear()
+    yield
+    _error_events.clear()
+
+
 @pytest.fixture
 def mock_integration_state():
     return {"last_execution": "2024-01-29T11:20:00+0200"}
@@ -773,6 +785,20 @@ def mock_gundi_client_v2_for_webhooks_generic(
     return mock_client
 
 
+@pytest.fixture
+def mock_config_manager_for_webhooks(mocker, integration_v2_with_webhook):
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.return_value = async_return(integration_v2_with_webhook)
+    return mock_config_manager
+
+
+@pytest.fixture
+def mock_config_manager_for_webhooks_generic(mocker, integration_v2_with_webhook_generic):
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.return_value = async_return(integration_v2_with_webhook_generic)
+    return mock_config_manager
+
+
 @pytest.fixture
 def mock_gundi_client_v2_class(mocker, mock_gundi_client_v2):
     mock_gundi_client_v2_class = mocker.MagicMock()
@@ -872,6 +898,10 @@ def mock_config_manager(mocker, integration_v2):
     mock_config_manager.set_action_configuration.return_value = async_return(None)
     mock_config_manager.delete_integration.return_value = async_return(None)
     mock_config_manager.delete_action_configuration.return_value = async_return(None)
+    mock_config_manager.get_processed_events.return_value = async_return(set())
+    mock_config_manager.get_config_versions.return_value = async_return({})
+    mock_config_manager.get_cached_configurations.return_value = async_return(({}, {}))
+    mock_config_manager.set_events_processed.return_value = async_return(None)
     return mock_config_manager
 
 
@@ -897,6 +927,19 @@ def integration_event_pubsub_message():
     )
 
 
+@pytest.fixture
+def span_exporter(mocker):
+    # Spans are exported in memory, without touching the global tracer provider
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer("tests")
+    mocker.patch("app.services.tracing.tracer", tracer)
+    mocker.patch("app.services.action_runner.tracer", tracer)
+    mocker.patch("app.services.activity_logger.tracer", tracer)
+    return exporter
+
+
 @pytest.fixture
 def gcp_pubsub_publish_response():
     return {"messageIds": ["7061707768812258"]}
@@ -3,16 +3,22 @@ import json
 import logging
 import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, status, BackgroundTasks
+from fastapi import FastAPI, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from app.routers import actions, webhooks, config_events
 import app.settings as settings
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.services.action_runner import execute_action, _portal
+from app.services.action_runner import action_pools, PRIORITY_NORMAL, _portal, flush_error_events
+from app.services.errors import ActionQueueFull, ActionQueueClosed
 from app.services.self_registration import register_integration_in_gundi
+from app.services.logs import log_payload
+from app.services.tracing import configure_tracing, shutdown_tracing
+from app.services.webhooks import webhook_batcher, webhook_worker_pool
+from app.webhooks.core import get_webhook_handler
 
 
 # For running behind a proxy, we'll want to configure the root path for OpenAPI browser.
@@ -22,12 +28,22 @@ root_path = os.environ.get("ROOT_PATH", "")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup Hook
+    configure_tracing()
+    # Resolve the webhook handler once, so errors in the handlers module fail at boot
+    if get_webhook_handler() is None:
+        logger.info("Webhook handler not found. Webhooks are disabled.")
     if settings.REGISTER_ON_START:
         await register_integration_in_gundi(gundi_client=_portal)
         # ToDo: set env var to false in GCP after registration
     yield
     # Shotdown Hook
-    await _portal.close()
+    await action_pools.stop()  # Let the queued actions finish
+    await webhook_worker_pool.stop()
+    await webhook_batcher.flush_all()  # Don't lose batched webhook payloads
+    await flush_error_events()
+    if _portal.created:  # The Gundi client is created on first use
+        await _portal.close()
+    shutdown_tracing()  # Export the pending spans
 
 
 app = FastAPI(
@@ -64,35 +80,48 @@ def read_root(
     return {"status": "healthy"}
 
 
+@app.get(
+    "/metrics",
+    tags=["health-check"],
+    summary="Prometheus metrics",
+    description="Latency histograms and throughput counters of actions, DigitAnimal, Gundi, Redis and PubSub, in the Prometheus text format.",
+)
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post(
     "/",
     summary="Execute an action from GCP PubSub",
 )
 async def execute(
     request: Request,
-    background_tasks: BackgroundTasks
 ):
-    body = await request.body()
-    print(f"Message Received. RAW body: {body}")
     json_data = await request.json()
-    print(f"JSON: {json_data}")
+    log_payload(logger, "Message received", json_data, path="/")
     payload = base64.b64decode(json_data["message"]["data"]).decode("utf-8").strip()
-    print(f"Payload: {payload}")
     json_payload = json.loads(payload)
-    print(f"JSON Payload: {json_payload}")
-    if settings.PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND:
-        background_tasks.add_task(
-            execute_action,
-            integration_id=json_payload.get("integration_id"),
-            action_id=json_payload.get("action_id"),
-            config_overrides=json_payload.get("config_overrides"),
-        )
-    else:
-        await execute_action(
-            integration_id=json_payload.get("integration_id"),
-            action_id=json_payload.get("action_id"),
-            config_overrides=json_payload.get("config_overrides"),
-        )
+    logger.info(
+        "Action command received: %s",
+        json_payload.get("action_id"),
+        extra={"integration_id": json_payload.get("integration_id"), "action_id": json_payload.get("action_id")}
+    )
+    action_kwargs = {
+        "integration_id": json_payload.get("integration_id"),
+        "action_id": json_payload.get("action_id"),
+        "config_overrides": json_payload.get("config_overrides"),
+        "trace_context": json_data["message"].get("attributes"),
+    }
+    try:  # Actions run in bounded pools. Rejected messages are redelivered by PubSub later
+        if settings.PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND:
+            action_pools.submit(priority=PRIORITY_NORMAL, **action_kwargs)
+        else:
+            await action_pools.run(priority=PRIORITY_NORMAL, **action_kwargs)
+    except ActionQueueFull as e:
+        logger.warning(f"Action command rejected: {e}")
+        return JSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, content={"detail": str(e)})
+    except ActionQueueClosed as e:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(e)})
     return {}
 
 
@@ -1,10 +1,14 @@
 import logging
 from typing import List
 import app.settings
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
 from app.actions import get_actions
-from app.services.action_runner import execute_action
-from app.api_schemas import ActionRequest
+from app.services.action_runner import (
+    execute_action_for_integrations, submit_action_for_integrations, action_pools, PRIORITY_HIGH
+)
+from app.services.errors import ActionQueueFull, ActionQueueClosed
+from app.api_schemas import ActionRequest, BulkActionRequest
 
 logger = logging.getLogger(__name__)
 
@@ -19,25 +23,69 @@ router = APIRouter()
 async def list_actions():
     return get_actions()
 
+
+def _queue_error_response(error: Exception) -> JSONResponse:
+    if isinstance(error, ActionQueueFull):
+        logger.warning(f"Action rejected: {error}")
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": str(error)},
+            headers={"Retry-After": "10"},
+        )
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(error)})
+
+
 @router.post(
     "/execute",
     summary="Execute an action with given settings",
 )
 async def execute(
     request: ActionRequest,
-    background_tasks: BackgroundTasks
 ):
-    if request.run_in_background:
-        background_tasks.add_task(
-            execute_action,
-            integration_id=request.integration_id,
-            action_id=request.action_id,
-            config_overrides=request.config_overrides
-        )
-        return {"message": "Action execution started in background"}
-    else:
-        return await execute_action(
-            integration_id=request.integration_id,
-            action_id=request.action_id,
-            config_overrides=request.config_overrides
-        )
+    # Actions run in bounded pools, requests from users go before the scheduled ones
+    try:
+        if request.run_in_background:
+            action_pools.submit(
+                priority=PRIORITY_HIGH,
+                integration_id=request.integration_id,
+                action_id=request.action_id,
+                config_overrides=request.config_overrides,
+                profile=request.profile
+            )
+            return {"message": "Action execution started in background"}
+        else:
+            return await action_pools.run(
+                priority=PRIORITY_HIGH,
+                integration_id=request.integration_id,
+                action_id=request.action_id,
+                config_overrides=request.config_overrides,
+                profile=request.profile
+            )
+    except (ActionQueueFull, ActionQueueClosed) as e:
+        return _queue_error_response(e)
+
+
+@router.post(
+    "/execute-bulk",
+    summary="Execute an action for many integrations",
+)
+async def execute_bulk(
+    request: BulkActionRequest,
+):
+    # Bulk runs go through the same pools as other actions, after the scheduled ones
+    try:
+        if request.run_in_background:
+            await submit_action_for_integrations(
+                action_id=request.action_id,
+                integration_ids=request.integration_ids,
+                config_overrides=request.config_overrides,
+            )
+            return {"message": "Action execution started in background"}
+        else:
+            return await execute_action_for_integrations(
+                action_id=request.action_id,
+                integration_ids=request.integration_ids,
+                config_overrides=request.config_overrides,
+            )
+    except (ActionQueueFull, ActionQueueClosed) as e:
+        return _queue_error_response(e)
@@ -2,7 +2,7 @@ import base64
 import json
 import logging
 from fastapi import APIRouter, BackgroundTasks, Request
-from app.services.config_events_consumer import process_config_event
+from app.services.config_events_consumer import process_config_event, process_config_events
 
 
 logger = logging.getLogger(__name__)
@@ -19,11 +19,28 @@ async def process_request(
 ):
     # Parse PubSub message
     json_data = await request.json()
-    pubsub_message = json_data["message"]
+    event_data, attributes = parse_pubsub_message(json_data["message"])
+    return await process_config_event(event_data, attributes)
+
+
+@router.post(
+    "/batch",
+    summary="Process many configuration events at once, saving only the latest changes per integration and action",
+)
+async def process_batch_request(
+    request: Request,
+):
+    # Expects a list of PubSub messages, in order: {"messages": [{"data": ..., "attributes": ...}, ...]}
+    json_data = await request.json()
+    events = [parse_pubsub_message(message) for message in json_data.get("messages", [])]
+    return await process_config_events(events)
+
+
+def parse_pubsub_message(pubsub_message: dict):
     message_data = pubsub_message.get("data", "")
     decoded_data = base64.b64decode(message_data.encode("utf-8"))
     event_data = json.loads(decoded_data) if decoded_data else {}
     attributes = pubsub_message.get("attributes")
-    return await process_config_event(event_data, attributes)
+    return event_data, attributes
 
 
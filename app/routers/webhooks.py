@@ -1,6 +1,9 @@
 import logging
-from fastapi import APIRouter, BackgroundTasks, Request
-from app.services.webhooks import process_webhook
+from fastapi import APIRouter, Request, status
+from fastapi.responses import JSONResponse
+from app.services.errors import WebhookQueueFull, WebhookQueueClosed
+from app.services.webhooks import process_webhook, webhook_worker_pool
+from app.services.logs import log_payload
 from app import settings
 
 logger = logging.getLogger(__name__)
@@ -14,19 +17,24 @@ router = APIRouter()
 )
 async def webhooks(
     request: Request,
-    background_tasks: BackgroundTasks
 ):
     body = await request.body()
-    print(f"Message Received through Webhooks. RAW body: {body}")
-    headers = dict(request.headers)
-    print(f"Headers: {headers}")
+    log_payload(logger, "Message received through webhooks", body, path="/webhooks", headers=request.headers)
     if settings.PROCESS_WEBHOOKS_IN_BACKGROUND:
-        background_tasks.add_task(
-            process_webhook,
-            request=request,
-        )
+        try:  # Workers get the body already read, as the request stream is closed after responding
+            webhook_worker_pool.submit(process_webhook, request=request, body=body)
+        except WebhookQueueFull as e:
+            logger.warning(f"Webhook rejected: {e}")
+            return JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"detail": str(e)},
+                headers={"Retry-After": "1"},
+            )
+        except WebhookQueueClosed as e:
+            return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(e)})
         return {}
     else:
         return await process_webhook(
             request=request,
+            body=body,
         )
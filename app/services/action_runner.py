@@ -1,4 +1,6 @@
 import asyncio
+import itertools
+import json
 import logging
 import time
 import traceback
@@ -9,20 +11,107 @@ import stamina
 from gundi_client_v2 import GundiClient
 
 from app.actions import action_handlers
+from app.actions.core import AuthActionConfiguration
 from app import settings
+from typing import Dict, List, Tuple
 from fastapi import status
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from gundi_core.events import IntegrationActionFailed, ActionExecutionFailed
+from opentelemetry.trace import Status, StatusCode
 
 from .config_manager import IntegrationConfigurationManager
-from .utils import find_config_for_action
+from .utils import find_config_for_action, LazyInstance
 from .activity_logger import publish_event
+from .errors import ActionQueueFull, ActionQueueClosed
+from .logs import TruncatedPayload
+from .metrics import ACTION_DURATION, ACTION_QUEUE_DEPTH, ACTION_QUEUE_WAIT
+from .profiling import run_with_profiler
+from .throttling import ActionLease
+from .tracing import tracer, extract_trace_context
 
-_portal = GundiClient()
-config_manager = IntegrationConfigurationManager()
+_portal = LazyInstance(GundiClient)  # Created on first use, see LazyInstance
+config_manager = LazyInstance(IntegrationConfigurationManager)
+action_lease = ActionLease(ttl=settings.ACTION_LEASE_TTL)
 logger = logging.getLogger(__name__)
 
+PRIORITY_HIGH = 0  # Requests from users through the API
+PRIORITY_NORMAL = 10  # Commands from the scheduler and other services
+PRIORITY_LOW = 20  # Bulk runs for many integrations
+
+
+SECRET_FIELD_NAMES = ("password", "secret", "token", "api_key", "apikey", "credential", "private_key")
+_error_events = {}  # (integration, action, error type, status) -> (last time published, errors not published since)
+_error_event_tasks = set()  # Keeps a reference to the error events being published in the background
+
+
+def _truncate(value, max_length: int = None) -> str:
+    return str(TruncatedPayload(str(value), max_length=max_length or settings.ACTION_ERROR_DETAILS_MAX_LENGTH))
+
+
+def _redact_config_data(data):
+    # Secrets are masked and long values truncated, so config data is safe and small enough for the activity logs
+    if isinstance(data, dict):
+        return {
+            key: "**********" if any(name in str(key).lower() for name in SECRET_FIELD_NAMES) else _redact_config_data(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [_redact_config_data(value) for value in data[:10]]
+    if isinstance(data, (pydantic.SecretStr, pydantic.SecretBytes)):
+        return "**********"
+    if isinstance(data, str) and len(data) > 200:
+        return _truncate(data, max_length=200)
+    return data
+
+
+def _summarize_configurations(configurations) -> list:
+    return [
+        {"action": config.action.value, "data": _redact_config_data(config.data)}
+        for config in configurations or []
+    ]
+
+
+def _should_publish_error_event(key: tuple) -> Tuple[bool, int]:
+    """
+    Rate limits error events that repeat for the same integration and action, e.g. during vendor outages.
+    Returns whether to publish the event and how many similar events were not published since the last one.
+    """
+    interval = settings.ACTION_ERROR_EVENTS_INTERVAL
+    if interval <= 0:
+        return True, 0
+    now = time.monotonic()
+    last_published_at, suppressed = _error_events.get(key, (0.0, 0))
+    if now - last_published_at < interval:
+        _error_events[key] = (last_published_at, suppressed + 1)
+        return False, suppressed + 1
+    if len(_error_events) >= 10000:  # Forget errors that stopped happening
+        for stale_key in [k for k, (published_at, _) in _error_events.items() if now - published_at >= interval]:
+            del _error_events[stale_key]
+    _error_events[key] = (now, 0)
+    return True, suppressed
+
+
+def _publish_error_event_in_background(event: IntegrationActionFailed):
+    # The error response doesn't wait for PubSub (publish_event retries with backoff)
+    async def _publish():
+        try:
+            await publish_event(event=event, topic_name=settings.INTEGRATION_EVENTS_TOPIC)
+        except Exception as e:
+            logger.warning(f"Error publishing action failed event: {type(e).__name__}: {e}")
+
+    task = asyncio.create_task(_publish())
+    _error_event_tasks.add(task)
+    task.add_done_callback(_error_event_tasks.discard)
+
+
+async def flush_error_events(timeout: float = 10):
+    """
+    Waits for the error events being published in the background, e.g. before shutting down.
+    """
+    if _error_event_tasks:
+        await asyncio.wait(list(_error_event_tasks), timeout=timeout)
+
 
 async def _handle_error(
         exc: Exception, integration_id: str, action_id: str,
@@ -30,40 +119,50 @@ async def _handle_error(
 ):
     """
     Handles errors by logging, extracting details as available, and publishing events for activity logs.
+    Error details are truncated and secrets are removed from the configurations. Repeated errors are published
+    at most once per ACTION_ERROR_EVENTS_INTERVAL seconds per integration and action.
     Returns a JSON response with error details too.
     """
+    message = _truncate(f"Error in action '{action_id}' for integration '{integration_id}': {type(exc).__name__}: {exc}")
+    response = getattr(exc, "response", None)
+    response_status = getattr(response, "status_code", None) if response is not None else None
+    publish, suppressed = _should_publish_error_event((integration_id, action_id, type(exc).__name__, response_status))
+    if publish:
+        logger.exception(message)
+    else:  # The traceback was logged with the first error
+        logger.warning(message)
 
-    message = f"Error in action '{action_id}' for integration '{integration_id}': {type(exc).__name__}: {exc}"
-    logger.exception(message)
-
+    error_traceback = traceback.format_exception(
+        type(exc), exc, exc.__traceback__, limit=-settings.ACTION_ERROR_TRACEBACK_FRAMES
+    )
     error_details = {
         "integration_id": integration_id,
         "action_id": action_id,
-        "config_data": config_data or {},
+        "config_data": _redact_config_data(config_data or {}),
         "error": message,
-        "error_traceback": traceback.format_exc()
+        "error_traceback": _truncate("".join(error_traceback))
     }
 
     # Extract additional request/response details if available
     if (request := getattr(exc, "request", None)) is not None:
         error_details.update({
             "request_verb": str(request.method),
-            "request_url": str(request.url),
-            "request_data": str(getattr(request, "content", getattr(request, "body", None)) or "")
+            "request_url": _truncate(request.url),
+            "request_data": _truncate(getattr(request, "content", getattr(request, "body", None)) or "")
         })
-    if (response := getattr(exc, "response", None)) is not None:  # bool(response) on status errors returns False
+    if response is not None:  # bool(response) on status errors returns False
         error_details.update({
-            "server_response_status": getattr(response, "status_code", None),
-            "server_response_body": str(getattr(response, "text", getattr(response, "content", None)) or "")
+            "server_response_status": response_status,
+            "server_response_body": _truncate(getattr(response, "text", getattr(response, "content", None)) or "")
         })
 
-    # Publish the error event
-    await publish_event(
-        event=IntegrationActionFailed(
-            payload=ActionExecutionFailed(**error_details)
-        ),
-        topic_name=settings.INTEGRATION_EVENTS_TOPIC,
-    )
+    if publish:  # Publish the error event for the activity logs
+        event_details = error_details
+        if suppressed:
+            event_details = {**error_details, "error": f"{error_details['error']} ({suppressed} similar errors not logged)"}
+        _publish_error_event_in_background(
+            IntegrationActionFailed(payload=ActionExecutionFailed(**event_details))
+        )
 
     # Return the JSON response
     return JSONResponse(
@@ -72,7 +171,74 @@ async def _handle_error(
     )
 
 
-async def execute_action(integration_id: str, action_id: str, config_overrides: dict = None):
+async def execute_action(
+        integration_id: str, action_id: str, config_overrides: dict = None, trace_context: dict = None,
+        profile: bool = False
+):
+    """
+    Executes an action handler and returns its result, or a JSON response with the error details.
+    trace_context has the trace headers propagated by the caller (e.g. in the attributes of a Pub/Sub message).
+    With profile=True the handler runs under a sampling profiler, and the profile is returned in the result.
+    """
+    with tracer.start_as_current_span(
+        "execute_action",
+        context=extract_trace_context(trace_context),
+        attributes={"integration_id": str(integration_id), "action_id": str(action_id)},
+    ) as span:
+        result = await _execute_action_with_lease(integration_id, action_id, config_overrides, profile)
+        if isinstance(result, JSONResponse):  # Errors are handled in _execute_action
+            span.set_attribute("http.status_code", result.status_code)
+            if result.status_code >= 400 and result.status_code != status.HTTP_409_CONFLICT:  # Not skipped runs
+                span.set_status(Status(StatusCode.ERROR))
+        return result
+
+
+async def _execute_action_with_lease(
+        integration_id: str, action_id: str, config_overrides: dict = None, profile: bool = False
+):
+    # Prevents overlapping runs of the same action for the same integration (e.g. scheduled and manual runs)
+    mode = settings.ACTION_LEASE_MODE
+    if mode == "disabled" or action_id not in settings.ACTION_LEASE_ACTIONS:
+        return await _execute_action(integration_id, action_id, config_overrides, profile)
+
+    lease_name = f"{integration_id}.{action_id}"
+    if mode == "wait":
+        token = await action_lease.wait(lease_name, timeout=settings.ACTION_LEASE_WAIT_TIMEOUT)
+    else:
+        token = await action_lease.acquire(lease_name)
+    if token is None and mode == "queue":
+        await action_lease.add_pending(lease_name, {"config_overrides": config_overrides})
+        # Try again in case the lease was released meanwhile, otherwise the holder runs the pending request
+        if (token := await action_lease.acquire(lease_name)) is None:
+            message = f"Action '{action_id}' is running for integration '{integration_id}'. Queued to run after it."
+            logger.info(message)
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"detail": message})
+        await action_lease.pop_pending(lease_name)  # This is the pending run
+    if token is None:
+        message = f"Action '{action_id}' is already running for integration '{integration_id}'. Skipped."
+        logger.info(message)
+        return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"detail": message})
+
+    try:
+        with action_lease.hold(lease_name, token):  # State writes of this run are fenced with the token
+            result = await _execute_action(integration_id, action_id, config_overrides, profile)
+    finally:
+        await action_lease.release(lease_name, token)
+    if mode == "queue" and (pending := await action_lease.pop_pending(lease_name)) is not None:
+        logger.info(f"Running queued action '{action_id}' for integration '{integration_id}'...")
+        # In the action pools, so the caller of this run doesn't wait for the next one and the pool limits apply
+        try:
+            action_pools.submit(
+                priority=PRIORITY_NORMAL, integration_id=integration_id, action_id=action_id,
+                config_overrides=pending.get("config_overrides")
+            )
+        except (ActionQueueFull, ActionQueueClosed) as e:
+            logger.warning(f"Queued action '{action_id}' for integration '{integration_id}' can't run now: {e}")
+            await action_lease.add_pending(lease_name, pending)  # Runs after the next run instead
+    return result
+
+
+async def _execute_action(integration_id: str, action_id: str, config_overrides: dict = None, profile: bool = False):
     logger.info(f"Executing action '{action_id}' for integration '{integration_id}'...")
 
     try:  # Get the integration details to pass it to the action handler
@@ -87,7 +253,7 @@ async def execute_action(integration_id: str, action_id: str, config_overrides:
         logger.error(message)
         return await _handle_error(
             ValueError(message), integration_id, action_id,
-            config_data={"configurations": [i.dict() for i in integration.configurations]},
+            config_data={"configurations": _summarize_configurations(integration.configurations)},
             status_code=status.HTTP_404_NOT_FOUND
         )
 
@@ -97,7 +263,7 @@ async def execute_action(integration_id: str, action_id: str, config_overrides:
         return await _handle_error(
             KeyError(f"Action '{action_id}' is not supported"),
             integration_id, action_id,
-            config_data=action_config,
+            config_data={"configurations": _summarize_configurations([c for c in [action_config] if c])},
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
         )
 
@@ -111,25 +277,206 @@ async def execute_action(integration_id: str, action_id: str, config_overrides:
 
     try:  # Execute the action handler with a timeout
         start_time = time.monotonic()
-        result = await asyncio.wait_for(
-            handler(integration=integration, action_config=parsed_config),
-            timeout=settings.MAX_ACTION_EXECUTION_TIME
-        )
+        handler_call = handler(integration=integration, action_config=parsed_config)
+        if profile:  # Opt-in, the profiler isn't imported otherwise
+            handler_call = run_with_profiler(handler_call, name=f"{integration_id}-{action_id}")
+        result = await asyncio.wait_for(handler_call, timeout=settings.MAX_ACTION_EXECUTION_TIME)
     except asyncio.TimeoutError:
+        ACTION_DURATION.labels(action_id=action_id, status="timeout").observe(time.monotonic() - start_time)
         return await _handle_error(
             asyncio.TimeoutError(f"Action '{action_id}' timed out"),
             integration_id, action_id,
-            config_data={"configurations": [c.dict() for c in integration.configurations]},
+            config_data={"configurations": _summarize_configurations(integration.configurations)},
             status_code=status.HTTP_504_GATEWAY_TIMEOUT
         )
     except Exception as e:
+        ACTION_DURATION.labels(action_id=action_id, status="error").observe(time.monotonic() - start_time)
         return await _handle_error(e, integration_id, action_id,
-                                   config_data={"configurations": [c.dict() for c in integration.configurations]})
+                                   config_data={"configurations": _summarize_configurations(integration.configurations)})
 
     # Success. Log the execution time and return the result
     end_time = time.monotonic()
     execution_time = end_time - start_time
+    ACTION_DURATION.labels(action_id=action_id, status="success").observe(execution_time)
     logger.debug(
         f"Action '{action_id}' executed successfully for integration {integration_id} in {execution_time:.2f} seconds."
     )
+    if profile:
+        result, profile_data = result
+        if isinstance(result, dict):
+            result = {**result, "profile": profile_data}
     return result
+
+
+async def submit_action_for_integrations(
+        action_id: str, integration_ids: List[str] = None, config_overrides: dict = None, priority: int = PRIORITY_LOW
+) -> Dict[str, asyncio.Future]:
+    """
+    Queues one action for many integrations in the action pools, so the global concurrency limits apply.
+    If no integration ids are given, the action runs for all the enabled integrations of this type found in the cache.
+    Returns a future with the result of the action for each integration.
+    Raises ActionQueueFull if the pool can't take all of them, nothing is queued then.
+    """
+    if integration_ids is None:
+        integrations = await config_manager.get_integrations(integration_type=settings.INTEGRATION_TYPE_SLUG)
+        integration_ids = [str(integration.id) for integration in integrations if integration.enabled]
+    logger.info(f"Executing action '{action_id}' for {len(integration_ids)} integrations...")
+    return action_pools.submit_many(
+        action_id, integration_ids, priority=priority, config_overrides=config_overrides
+    )
+
+
+async def execute_action_for_integrations(
+        action_id: str, integration_ids: List[str] = None, config_overrides: dict = None, priority: int = PRIORITY_LOW
+):
+    """
+    Executes one action for many integrations in the action pools and waits for them.
+    Returns a dict with the result of the action for each integration.
+    """
+    futures = await submit_action_for_integrations(action_id, integration_ids, config_overrides, priority)
+    results = await asyncio.gather(*futures.values())
+    return {
+        # Errors are already logged and published by execute_action
+        integration_id: {"status_code": result.status_code, **json.loads(result.body)}
+        if isinstance(result, JSONResponse) else result
+        for integration_id, result in zip(futures.keys(), results)
+    }
+
+
+class ActionPool:
+    """
+    Bounded pool of workers executing actions in priority order (lower values first, FIFO within a priority).
+    Actions are rejected when the queue is full, so memory stays bounded under load and callers can retry later.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue_size: int, shutdown_timeout: float = 30):
+        self.name = name
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.shutdown_timeout = shutdown_timeout  # Seconds
+        self._queue = None
+        self._tasks = []
+        self._loop = None
+        self._closed = False
+        self._counter = itertools.count()  # Keeps FIFO order within a priority
+
+    def _start(self):
+        # Workers are started lazily in the running event loop
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            _, _, enqueued_at, kwargs, future = await self._queue.get()
+            ACTION_QUEUE_DEPTH.labels(pool=self.name).set(self._queue.qsize())
+            ACTION_QUEUE_WAIT.labels(pool=self.name).observe(time.monotonic() - enqueued_at)
+            try:
+                result = await execute_action(**kwargs)
+            except Exception as e:  # execute_action handles action errors, this is a safety net for the worker
+                logger.exception(f"Error executing action in pool '{self.name}': {e}")
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():  # The caller may have given up
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def free_slots(self) -> float:
+        if self.max_queue_size <= 0:  # Unbounded
+            return float("inf")
+        return self.max_queue_size - self.queue_size
+
+    def submit(self, priority: int = PRIORITY_NORMAL, **kwargs) -> asyncio.Future:
+        """
+        Queues execute_action(**kwargs) and returns a future with its result.
+        """
+        if self._closed:
+            raise ActionQueueClosed(f"The '{self.name}' actions queue is closed.")
+        if self._loop is not asyncio.get_running_loop():
+            self._start()
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait((priority, next(self._counter), time.monotonic(), kwargs, future))
+        except asyncio.QueueFull:
+            raise ActionQueueFull(f"The '{self.name}' actions queue is full ({self.max_queue_size} actions).")
+        ACTION_QUEUE_DEPTH.labels(pool=self.name).set(self._queue.qsize())
+        return future
+
+    async def stop(self):
+        self._closed = True
+        if not self._tasks:
+            return
+        try:  # Let the workers finish the pending actions
+            await asyncio.wait_for(self._queue.join(), timeout=self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.queue_size} actions in pool '{self.name}' weren't executed before shutdown.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class ActionPools:
+    """
+    Routes actions to separate pools, so e.g. auth checks never wait behind long backfills.
+    Auth actions go to the "auth" pool, other actions to the pool in assignments or the "pull" pool.
+    """
+
+    def __init__(self, pools: Dict[str, int], assignments: Dict[str, str], max_queue_size: int):
+        self.assignments = assignments
+        self.pools = {
+            name: ActionPool(name=name, workers=workers, max_queue_size=max_queue_size)
+            for name, workers in pools.items()
+        }
+
+    def get_pool(self, action_id: str) -> ActionPool:
+        if action_id in self.assignments:
+            name = self.assignments[action_id]
+        else:
+            _, config_model = action_handlers.get(action_id, (None, None))
+            is_auth = config_model is not None and issubclass(config_model, AuthActionConfiguration)
+            name = "auth" if is_auth else "pull"
+        return self.pools.get(name) or self.pools["pull"]
+
+    def submit(self, action_id: str, priority: int = PRIORITY_NORMAL, **kwargs) -> asyncio.Future:
+        return self.get_pool(action_id).submit(priority=priority, action_id=action_id, **kwargs)
+
+    def submit_many(
+            self, action_id: str, integration_ids: List[str], priority: int = PRIORITY_NORMAL, **kwargs
+    ) -> Dict[str, asyncio.Future]:
+        """
+        Queues the action for each integration, all or none: raises ActionQueueFull if they don't fit in the queue.
+        """
+        pool = self.get_pool(action_id)
+        if len(integration_ids) > pool.free_slots:
+            raise ActionQueueFull(
+                f"The '{pool.name}' actions queue can't take {len(integration_ids)} actions "
+                f"({pool.queue_size} of {pool.max_queue_size} queued)."
+            )
+        return {
+            integration_id: pool.submit(priority=priority, integration_id=integration_id, action_id=action_id, **kwargs)
+            for integration_id in integration_ids
+        }
+
+    async def run(self, action_id: str, priority: int = PRIORITY_NORMAL, **kwargs):
+        """
+        Executes the action in its pool and returns the result.
+        """
+        return await self.submit(action_id, priority=priority, **kwargs)
+
+    async def stop(self):
+        await asyncio.gather(*[pool.stop() for pool in self.pools.values()])
+
+
+action_pools = ActionPools(
+    pools=settings.ACTION_POOLS,
+    assignments=settings.ACTION_POOL_ASSIGNMENTS,
+    max_queue_size=settings.ACTION_QUEUE_MAX_SIZE,
+)
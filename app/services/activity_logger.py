@@ -2,10 +2,8 @@ import asyncio
 import json
 import logging
 
-import aiohttp
 import stamina
 from functools import wraps
-from gcloud.aio import pubsub
 from gundi_core.events import (
     SystemEventBaseModel,
     IntegrationActionCustomLog,
@@ -26,20 +24,33 @@ from gundi_core.events import (
     CustomWebhookLog,
 )
 from app import settings
+from app.services.metrics import PUBSUB_PUBLISH_DURATION
+from app.services.tracing import tracer, inject_trace_context
 
 
 logger = logging.getLogger(__name__)
 
 
 # Publish events for other services or system components
-@stamina.retry(
-    on=(aiohttp.ClientError, asyncio.TimeoutError),
-    attempts=5,
-    wait_initial=4.0,
-    wait_max=60,
-    wait_jitter=5.0
-)
 async def publish_event(event: SystemEventBaseModel, topic_name: str):
+    # aiohttp and the Pub/Sub client are imported on first use as they take a good part of the service startup time
+    import aiohttp
+
+    async for attempt in stamina.retry_context(
+        on=(aiohttp.ClientError, asyncio.TimeoutError),
+        attempts=5,
+        wait_initial=4.0,
+        wait_max=60,
+        wait_jitter=5.0
+    ):
+        with attempt:
+            return await _publish_event(event=event, topic_name=topic_name)
+
+
+async def _publish_event(event: SystemEventBaseModel, topic_name: str):
+    import aiohttp
+    from gcloud.aio import pubsub
+
     timeout_settings = aiohttp.ClientTimeout(total=20.0)
     async with aiohttp.ClientSession(
         raise_for_status=True, timeout=timeout_settings
@@ -49,10 +60,13 @@ async def publish_event(event: SystemEventBaseModel, topic_name: str):
         topic = client.topic_path(settings.GCP_PROJECT_ID, topic_name)
         # Prepare the payload
         binary_payload = json.dumps(event.dict(), default=str).encode("utf-8")
-        messages = [pubsub.PubsubMessage(binary_payload)]
         logger.debug(f"Sending event {event} to PubSub topic {topic_name}..")
         try:  # Send to pubsub
-            response = await client.publish(topic, messages)
+            with tracer.start_as_current_span("publish_event", attributes={"topic": topic_name}):
+                # The trace context goes in the message attributes, so consumers can continue the trace
+                messages = [pubsub.PubsubMessage(binary_payload, **inject_trace_context())]
+                with PUBSUB_PUBLISH_DURATION.labels(topic=topic_name).time():
+                    response = await client.publish(topic, messages)
         except Exception as e:
             logger.exception(
                 f"Error publishing system event to topic {topic_name}: {e}. This will be retried."
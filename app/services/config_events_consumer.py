@@ -1,4 +1,7 @@
 import logging
+from typing import List, Tuple
+
+import redis.asyncio as redis
 
 from gundi_core.events import (
     SystemEventBaseModel,
@@ -12,10 +15,11 @@ from gundi_core.events import (
 
 
 from .config_manager import IntegrationConfigurationManager
+from .utils import LazyInstance
 
 
 logger = logging.getLogger(__name__)
-config_manager = IntegrationConfigurationManager()
+config_manager = LazyInstance(IntegrationConfigurationManager)
 
 
 async def handle_integration_created_event(event: IntegrationCreated):
@@ -90,6 +94,96 @@ event_schemas = {
 }
 
 
+def _get_event_config_name(event_type: str, event) -> str:
+    # Name of the configuration changed by the event, to keep track of the latest change applied
+    event_data = event.payload
+    if event_type in ("IntegrationCreated", "IntegrationUpdated", "IntegrationDeleted"):
+        return f"integration.{event_data.id}"
+    if event_type == "ActionConfigCreated":
+        return f"integrationconfig.{event_data.integration}.{event_data.action.value}"
+    return f"integrationconfig.{event_data.integration_id}.{event_data.alt_id}"
+
+
+def _get_event_version_names(event_type: str, event) -> List[str]:
+    # Updates carry only the changed fields, so their version is tracked per field,
+    # and in "<config>.*" (the latest update of any field) to check created and deleted events against.
+    # Created and deleted events replace the whole config.
+    config_name = _get_event_config_name(event_type, event)
+    if event_type in ("IntegrationUpdated", "ActionConfigUpdated"):
+        return [f"{config_name}.*", *[f"{config_name}.{field}" for field in event.payload.changes]]
+    return [config_name]
+
+
+async def _filter_config_events(events: list) -> list:
+    """
+    Drops redelivered events (already processed) and changes older than the latest change applied to the same config.
+    Updates older than a later update of some of their fields keep only the other fields.
+    Events are processed anyway if the guard can't be checked.
+    """
+    names = set()
+    for event_type, event in events:
+        config_name = _get_event_config_name(event_type, event)
+        names.update([config_name, f"{config_name}.*"])
+        names.update(_get_event_version_names(event_type, event))
+    try:
+        processed_events = set(await config_manager.get_processed_events([str(event.event_id) for _, event in events]))
+        versions = dict(await config_manager.get_config_versions(list(names)))
+    except redis.RedisError as e:
+        logger.warning(f"Error checking processed config events: {e}. Events won't be deduplicated.")
+        return events
+    accepted_events = []
+    for event_type, event in events:
+        event_id = str(event.event_id)
+        config_name = _get_event_config_name(event_type, event)
+        timestamp = event.timestamp.timestamp()
+        if event_id in processed_events:
+            logger.info(f"Configuration event {event_type} ({event_id}) was already processed. Message discarded.")
+            continue
+        if event_type in ("IntegrationUpdated", "ActionConfigUpdated"):
+            latest_version = versions.get(config_name, 0)
+        else:  # A created or deleted config can't go back to a state older than the latest update
+            latest_version = max(versions.get(config_name, 0), versions.get(f"{config_name}.*", 0))
+        if timestamp < latest_version:
+            logger.info(
+                f"Configuration event {event_type} ({event_id}) is older than the latest change in '{config_name}'. Message discarded."
+            )
+            continue
+        if event_type in ("IntegrationUpdated", "ActionConfigUpdated"):
+            changes = {
+                field: value for field, value in event.payload.changes.items()
+                if timestamp >= versions.get(f"{config_name}.{field}", 0)
+            }
+            if not changes:
+                logger.info(
+                    f"Configuration event {event_type} ({event_id}) is older than the latest change of its fields in '{config_name}'. Message discarded."
+                )
+                continue
+            if len(changes) < len(event.payload.changes):
+                logger.info(
+                    f"Configuration event {event_type} ({event_id}) has outdated fields, only {list(changes)} are applied."
+                )
+                event = event.copy(update={"payload": event.payload.copy(update={"changes": changes})})
+        processed_events.add(event_id)
+        for name in _get_event_version_names(event_type, event):
+            versions[name] = timestamp
+        accepted_events.append((event_type, event))
+    return accepted_events
+
+
+async def _set_config_events_processed(events: list):
+    versions = {}
+    for event_type, event in events:
+        for name in _get_event_version_names(event_type, event):
+            versions[name] = max(versions.get(name, 0), event.timestamp.timestamp())
+    try:
+        await config_manager.set_events_processed(
+            event_ids=[str(event.event_id) for _, event in events],
+            versions=versions
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Error saving processed config events: {e}")
+
+
 async def process_config_event(event_data: dict, attributes: dict = None):
     try:
         logger.info(f"Received Configuration Event. data: {event_data}, attributes: {attributes}.")
@@ -112,10 +206,145 @@ async def process_config_event(event_data: dict, attributes: dict = None):
             logger.warning(f"Event Schema for '{event_type}' not found. Message discarded.")
             return
         parsed_event = schema.parse_obj(event_data)
+        if not (accepted_events := await _filter_config_events([(event_type, parsed_event)])):
+            return {"status": "success", "message": "Event discarded (duplicated or outdated)"}
+        _, parsed_event = accepted_events[0]  # Outdated fields of updates are left out
         await handler(event=parsed_event)
+        await _set_config_events_processed([(event_type, parsed_event)])
     except Exception as e:  # ToDo: handle more specific exceptions
         logger.exception(f"Error processing event: {type(e)}:{e}",)
         return {"status": "error", "message": f"Internal error: {str(e)}"}
     else:
         logger.info(f"Configuration event {event_type} ({parsed_event.event_id}) processed successfully.")
         return {"status": "success", "message": "Event processed successfully"}
+
+
+def _get_config_event_key(event_type: str, event_data):
+    # Key of the integration or action configuration changed by the event, in the batch dicts
+    if event_type in ("IntegrationCreated", "IntegrationUpdated", "IntegrationDeleted"):
+        return str(event_data.id)
+    if event_type == "ActionConfigCreated":
+        return str(event_data.integration), event_data.action.value
+    return str(event_data.integration_id), event_data.alt_id
+
+
+async def _prefetch_updated_configs(events: list) -> Tuple[dict, dict]:
+    """
+    Reads from the cache, at once, the integrations and action configurations that are updated in the batch
+    before being created or deleted in it, as the updates carry only the changed fields.
+    """
+    integration_ids, action_config_keys, seen = [], [], set()
+    for event_type, event in events:
+        key = _get_config_event_key(event_type, event.payload)
+        if key in seen:
+            continue
+        seen.add(key)
+        if event_type == "IntegrationUpdated":
+            integration_ids.append(key)
+        elif event_type == "ActionConfigUpdated":
+            action_config_keys.append(key)
+    return await config_manager.get_cached_configurations(
+        integration_ids=integration_ids, action_config_keys=action_config_keys
+    )
+
+
+async def _coalesce_config_event(
+        event_type: str, event, integrations: dict, action_configs: dict,
+        cached_integrations: dict = None, cached_action_configs: dict = None
+):
+    # Changes are applied in memory, on top of the previous events of the batch for the same key
+    event_data = event.payload
+    key = _get_config_event_key(event_type, event_data)
+    if event_type == "IntegrationCreated":
+        integrations[key] = event_data
+    elif event_type == "IntegrationUpdated":
+        if key in integrations:
+            if (integration := integrations[key]) is None:
+                logger.info(f"Integration '{key}' was deleted earlier in the batch. Update discarded.")
+                return
+        elif (integration := (cached_integrations or {}).get(key)) is None:
+            integration = await config_manager.get_integration(integration_id=key)
+        for attr, value in event_data.changes.items():
+            if hasattr(integration, attr):
+                setattr(integration, attr, value)
+        integrations[key] = integration
+    elif event_type == "IntegrationDeleted":
+        integrations[key] = None
+    elif event_type == "ActionConfigCreated":
+        action_configs[key] = event_data
+    elif event_type == "ActionConfigUpdated":
+        if key in action_configs:
+            if (action_config := action_configs[key]) is None:
+                logger.info(f"Action configuration '{key[1]}' of integration '{key[0]}' was deleted earlier in the batch. Update discarded.")
+                return
+        elif (action_config := (cached_action_configs or {}).get(key)) is None:
+            action_config = await config_manager.get_action_configuration(integration_id=key[0], action_id=key[1])
+        for attr, value in event_data.changes.items():
+            setattr(action_config, attr, value)
+        action_configs[key] = action_config
+    elif event_type == "ActionConfigDeleted":
+        action_configs[key] = None
+
+
+async def process_config_events(events: List[Tuple[dict, dict]]):
+    """
+    Processes a batch of configuration events, given as (event data, attributes) tuples in order.
+    Changes are coalesced per integration and per action configuration, and saved at once,
+    so a burst of updates results in a single write per key.
+    """
+    integrations = {}  # integration id -> integration, or None if it was deleted
+    action_configs = {}  # (integration id, action id) -> configuration, or None if it was deleted
+    parsed_events = []
+    discarded = 0
+    for event_data, attributes in events:
+        event_type = (attributes or {}).get("event_type")
+        if (schema := event_schemas.get(event_type)) is None:
+            logger.warning(f"Event of type '{event_type}' unknown. Message discarded.")
+            discarded += 1
+            continue
+        try:
+            parsed_event = schema.parse_obj(event_data)
+        except Exception as e:
+            logger.exception(f"Error parsing event: {type(e)}:{e}",)
+            discarded += 1
+            continue
+        if parsed_event.schema_version != "v1":
+            logger.warning(f"Schema version '{parsed_event.schema_version}' is not supported. Message discarded.")
+            discarded += 1
+            continue
+        parsed_events.append((event_type, parsed_event))
+    # Duplicated and outdated events are dropped before applying any change
+    accepted_events = await _filter_config_events(parsed_events) if parsed_events else []
+    discarded += len(parsed_events) - len(accepted_events)
+    try:
+        cached_integrations, cached_action_configs = await _prefetch_updated_configs(accepted_events)
+    except redis.RedisError as e:
+        logger.warning(f"Error reading the configurations updated in the batch: {e}. They'll be read one by one.")
+        cached_integrations, cached_action_configs = {}, {}
+    processed_events = []
+    for event_type, parsed_event in accepted_events:
+        try:
+            await _coalesce_config_event(
+                event_type, parsed_event, integrations, action_configs, cached_integrations, cached_action_configs
+            )
+        except Exception as e:  # ToDo: handle more specific exceptions
+            logger.exception(f"Error processing event: {type(e)}:{e}",)
+            discarded += 1
+        else:
+            processed_events.append((event_type, parsed_event))
+    processed = len(processed_events)
+    try:
+        writes = await config_manager.apply_changes(integrations=integrations, action_configs=action_configs)
+    except Exception as e:
+        logger.exception(f"Error saving configuration changes: {type(e)}:{e}",)
+        return {"status": "error", "message": f"Internal error: {str(e)}"}
+    if processed_events:
+        await _set_config_events_processed(processed_events)
+    logger.info(f"{processed} configuration events processed ({discarded} discarded), {writes} keys updated.")
+    return {
+        "status": "success",
+        "message": "Events processed successfully",
+        "events_processed": processed,
+        "events_discarded": discarded,
+        "keys_updated": writes,
+    }
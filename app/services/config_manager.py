@@ -1,20 +1,29 @@
+import asyncio
 import json
+from typing import Dict, List, Optional, Set, Tuple
+
 import stamina
 import httpx
 import redis.asyncio as redis
-from gundi_core.schemas.v2 import Integration, IntegrationSummary, IntegrationActionConfiguration
+from gundi_core.schemas.v2 import Integration, IntegrationSummary, IntegrationActionConfiguration, WebhookConfiguration
 from gundi_client_v2 import GundiClient
 from app import settings
+from app.services.metrics import REDIS_OPERATION_DURATION, observe_duration
+from app.services.tracing import traced
+
+
+class GundiServerError(httpx.HTTPStatusError):
+    """Server errors (5xx, 429) from the Gundi API, retried like connection errors."""
 
 
 class IntegrationConfigurationManager:
-    # ToDo: Add support for webhook configs
 
     def __init__(self, **kwargs):
         host = kwargs.get("host", settings.REDIS_HOST)
         port = kwargs.get("port", settings.REDIS_PORT)
         db = kwargs.get("db", settings.REDIS_CONFIGS_DB)
         self.db_client = redis.Redis(host=host, port=port, db=db)
+        self._inflight_reloads: Dict[str, asyncio.Future] = {}
 
     def _get_integration_key(self, integration_id: str) -> str:
         return f"integration.{integration_id}"
@@ -22,43 +31,91 @@ class IntegrationConfigurationManager:
     def _get_integration_config_key(self, integration_id: str, action_id: str) -> str:
         return f"integrationconfig.{integration_id}.{action_id}"
 
+    def _get_webhook_config_key(self, integration_id: str) -> str:
+        return f"integrationwebhookconfig.{integration_id}"
+
+    def _get_processed_event_key(self, event_id: str) -> str:
+        return f"configevent.{event_id}"
+
+    def _get_config_version_key(self, name: str) -> str:
+        return f"configversion.{name}"
+
     async def _reload_integration_from_gundi(self, integration_id: str) -> Integration:
+        # Single-flight: concurrent lookups of the same integration await the same request to Gundi
+        if (reload := self._inflight_reloads.get(integration_id)) is None:
+            reload = asyncio.ensure_future(self._fetch_and_save_integration(integration_id))
+            self._inflight_reloads[integration_id] = reload
+            reload.add_done_callback(lambda _: self._inflight_reloads.pop(integration_id, None))
+        integration_details = await asyncio.shield(reload)
+        # Callers may modify the configurations (e.g. config overrides), so each one gets its own copy
+        return integration_details.copy(deep=True)
+
+    async def _fetch_and_save_integration(self, integration_id: str) -> Integration:
         key = self._get_integration_key(integration_id)
         async with GundiClient() as gundi:
-            async for attempt in stamina.retry_context(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0,  wait_max=32.0):
+            # Only transport errors and server errors are retried, e.g. unknown integrations (404) fail fast
+            async for attempt in stamina.retry_context(
+                    on=(httpx.TransportError, GundiServerError), wait_initial=1.0, wait_jitter=5.0,  wait_max=32.0
+            ):
                 with attempt:
-                    integration_details = await gundi.get_integration_details(integration_id)
+                    try:
+                        integration_details = await gundi.get_integration_details(integration_id)
+                    except httpx.HTTPStatusError as e:
+                        if e.response.status_code >= 500 or e.response.status_code == 429:
+                            raise GundiServerError(str(e), request=e.request, response=e.response) from e
+                        raise
             integration = IntegrationSummary.from_integration(integration_details)
             await self.db_client.set(key, integration.json())
             # Save configurations for individual actions
             for config in integration_details.configurations:
                 config_key = self._get_integration_config_key(integration_id, config.action.value)
                 await self.db_client.set(config_key, config.json())
+            # "null" is saved for actions without configuration, so they aren't reloaded from Gundi on every lookup
+            configured_actions = {config.action.value for config in integration_details.configurations}
+            for action in integration_details.type.actions:
+                if action.value not in configured_actions:
+                    config_key = self._get_integration_config_key(integration_id, action.value)
+                    await self.db_client.set(config_key, json.dumps(None))
+            # There are no events for webhook configs yet, so they expire to be reloaded eventually
+            await self._save_webhook_configuration(integration_id, integration_details.webhook_configuration)
             return integration_details
 
+    async def _save_webhook_configuration(self, integration_id: str, config: Optional[WebhookConfiguration]):
+        key = self._get_webhook_config_key(integration_id)
+        # "null" is saved for integrations without webhook, so they aren't reloaded from Gundi on every lookup
+        data = config.json() if config else json.dumps(None)
+        await self.db_client.set(key, data, ex=settings.WEBHOOK_CONFIG_CACHE_TTL or None)
+
+    @traced("config.get_action_configuration")
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_action_configuration")
     async def get_action_configuration(self, integration_id: str, action_id: str) -> IntegrationActionConfiguration:
         key = self._get_integration_config_key(integration_id, action_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 data = await self.db_client.get(key)
         if data:
-            return IntegrationActionConfiguration.parse_raw(data)
+            config_data = json.loads(data)
+            return IntegrationActionConfiguration.parse_obj(config_data) if config_data else None
         # If not found in the redis db, try reloading data from Gundi API
         integration_details = await self._reload_integration_from_gundi(integration_id)
         return integration_details.get_action_config(action_id)
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.set_action_configuration")
     async def set_action_configuration(self, integration_id: str, action_id: str, config: IntegrationActionConfiguration):
         key = self._get_integration_config_key(integration_id, action_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 await self.db_client.set(key, config.json())
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.delete_action_configuration")
     async def delete_action_configuration(self, integration_id: str, action_id: str):
         key = self._get_integration_config_key(integration_id, action_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 return await self.db_client.delete(key)
 
+    @traced("config.get_integration")
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_integration")
     async def get_integration(self, integration_id: str) -> IntegrationSummary:
         key = self._get_integration_key(integration_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
@@ -71,25 +128,176 @@ class IntegrationConfigurationManager:
         integration_details = await self._reload_integration_from_gundi(integration_id)
         return IntegrationSummary.from_integration(integration_details)
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_integrations")
+    async def get_integrations(self, integration_type: str = None, batch_size: int = 500) -> List[IntegrationSummary]:
+        """
+        Lists the integrations saved in the cache, optionally filtered by integration type (slug).
+        Keys are scanned and read in batches to keep the number of round trips low.
+        """
+        integrations = []
+        keys = [key async for key in self.db_client.scan_iter(match=self._get_integration_key("*"), count=batch_size)]
+        for i in range(0, len(keys), batch_size):
+            for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+                with attempt:
+                    values = await self.db_client.mget(keys[i: i + batch_size])
+            for integration_data in values:
+                if not integration_data:
+                    continue
+                integration = IntegrationSummary.parse_raw(integration_data)
+                if integration_type is None or integration.type.value == integration_type:
+                    integrations.append(integration)
+        return integrations
+
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_cached_configurations")
+    async def get_cached_configurations(
+            self,
+            integration_ids: List[str] = None,
+            action_config_keys: List[Tuple[str, str]] = None
+    ) -> Tuple[Dict[str, IntegrationSummary], Dict[Tuple[str, str], IntegrationActionConfiguration]]:
+        """
+        Reads integrations and action configurations (keyed by integration id and action id) from the cache at once.
+        Keys missing in the cache are left out, Gundi isn't called.
+        """
+        integration_ids = integration_ids or []
+        action_config_keys = action_config_keys or []
+        if not integration_ids and not action_config_keys:
+            return {}, {}
+        keys = [
+            *[self._get_integration_key(integration_id) for integration_id in integration_ids],
+            *[self._get_integration_config_key(integration_id, action_id) for integration_id, action_id in action_config_keys]
+        ]
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                values = await self.db_client.mget(keys)
+        integrations_data, configs_data = values[:len(integration_ids)], values[len(integration_ids):]
+        integrations = {
+            integration_id: IntegrationSummary.parse_raw(data)
+            for integration_id, data in zip(integration_ids, integrations_data) if data
+        }
+        action_configs = {
+            key: IntegrationActionConfiguration.parse_obj(config_data)
+            for key, data in zip(action_config_keys, configs_data) if data and (config_data := json.loads(data))
+        }
+        return integrations, action_configs
+
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.set_integration")
     async def set_integration(self, integration: IntegrationSummary):
         key = self._get_integration_key(integration.id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 await self.db_client.set(key, integration.json())
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.delete_integration")
     async def delete_integration(self, integration_id: str):
         key = self._get_integration_key(integration_id)
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
                 await self.db_client.delete(key)
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.apply_changes")
+    async def apply_changes(
+            self,
+            integrations: Dict[str, Optional[IntegrationSummary]] = None,
+            action_configs: Dict[Tuple[str, str], Optional[IntegrationActionConfiguration]] = None
+    ) -> int:
+        """
+        Saves integrations and action configurations (keyed by integration id and action id) in a single round trip.
+        None values mean the integration or configuration was deleted. Returns the number of writes.
+        """
+        integrations = integrations or {}
+        action_configs = action_configs or {}
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                async with self.db_client.pipeline(transaction=True) as pipe:
+                    for integration_id, integration in integrations.items():
+                        key = self._get_integration_key(integration_id)
+                        if integration:
+                            pipe.set(key, integration.json())
+                        else:
+                            pipe.delete(key)
+                    for (integration_id, action_id), config in action_configs.items():
+                        key = self._get_integration_config_key(integration_id, action_id)
+                        if config:
+                            pipe.set(key, config.json())
+                        else:
+                            pipe.delete(key)
+                    await pipe.execute()
+        return len(integrations) + len(action_configs)
+
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_processed_events")
+    async def get_processed_events(self, event_ids: List[str]) -> Set[str]:
+        """
+        Returns the ids of the configuration events that were already processed.
+        """
+        if not event_ids:
+            return set()
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                values = await self.db_client.mget([self._get_processed_event_key(event_id) for event_id in event_ids])
+        return {event_id for event_id, value in zip(event_ids, values) if value}
+
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_config_versions")
+    async def get_config_versions(self, names: List[str]) -> Dict[str, float]:
+        """
+        Returns the timestamp of the latest event applied to each config (e.g. "integration.<id>").
+        """
+        if not names:
+            return {}
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                values = await self.db_client.mget([self._get_config_version_key(name) for name in names])
+        return {name: float(value) for name, value in zip(names, values) if value}
+
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.set_events_processed")
+    async def set_events_processed(self, event_ids: List[str], versions: Dict[str, float]):
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                async with self.db_client.pipeline(transaction=False) as pipe:
+                    for event_id in event_ids:
+                        pipe.set(self._get_processed_event_key(event_id), 1, ex=settings.CONFIG_EVENTS_DEDUPLICATION_TTL)
+                    for name, version in versions.items():
+                        pipe.set(self._get_config_version_key(name), version, ex=settings.CONFIG_EVENTS_VERSION_TTL)
+                    await pipe.execute()
+
+    @traced("config.get_webhook_configuration")
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_webhook_configuration")
+    async def get_webhook_configuration(self, integration_id: str) -> Optional[WebhookConfiguration]:
+        key = self._get_webhook_config_key(integration_id)
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                data = await self.db_client.get(key)
+        if data:
+            config_data = json.loads(data)
+            return WebhookConfiguration.parse_obj(config_data) if config_data else None
+        # If not found in the redis db, try reloading data from Gundi API
+        integration_details = await self._reload_integration_from_gundi(integration_id)
+        return integration_details.webhook_configuration
+
+    @traced("config.get_integration_details")
+    @observe_duration(REDIS_OPERATION_DURATION, operation="config.get_integration_details")
     async def get_integration_details(self, integration_id: str) -> Integration:
-        integration_summary = await self.get_integration(integration_id)
-        configurations = []
-        for action in integration_summary.type.actions:
-            config = await self.get_action_configuration(integration_id, action.value)
-            if config:
-                configurations.append(config)
+        """
+        Builds the integration details from the cache, reading all the configurations at once.
+        Gundi is called (once) only if the integration isn't cached, or its webhook configuration expired.
+        Actions without a configuration in the cache are left out.
+        """
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                integration_data = await self.db_client.get(self._get_integration_key(integration_id))
+        if not integration_data:
+            return await self._reload_integration_from_gundi(integration_id)
+        integration_summary = IntegrationSummary.parse_raw(integration_data)
+        config_keys = [
+            self._get_integration_config_key(integration_id, action.value) for action in integration_summary.type.actions
+        ]
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                *configs_data, webhook_config_data = await self.db_client.mget(
+                    [*config_keys, self._get_webhook_config_key(integration_id)]
+                )
+        if not webhook_config_data:  # Expires, as there are no events for webhook configs
+            return await self._reload_integration_from_gundi(integration_id)
+        webhook_config = json.loads(webhook_config_data)
         return Integration(
             id=integration_summary.id,
             name=integration_summary.name,
@@ -99,6 +307,9 @@ class IntegrationConfigurationManager:
             owner=integration_summary.owner,
             default_route=integration_summary.default_route,
             additional=integration_summary.additional,
-            configurations=configurations,
-            # ToDo: webhook_configuration
-        )
\ No newline at end of file
+            configurations=[
+                IntegrationActionConfiguration.parse_obj(config_data)
+                for config_data in [json.loads(data) for data in configs_data if data] if config_data
+            ],
+            webhook_configuration=WebhookConfiguration.parse_obj(webhook_config) if webhook_config else None,
+        )
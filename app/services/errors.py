@@ -15,3 +15,31 @@ class ConfigurationValidationError(Exception):
 class ActionExecutionError(Exception):
     pass
 
+
+
+class CircuitBreakerOpen(Exception):
+    pass
+
+
+class WebhookQueueFull(Exception):
+    pass
+
+
+class WebhookQueueClosed(Exception):
+    pass
+
+
+class WebhookHandlerNotFound(Exception):
+    pass
+
+
+class ActionQueueFull(Exception):
+    pass
+
+
+class ActionQueueClosed(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    pass
@@ -3,6 +3,9 @@ from typing import List
 import httpx
 import stamina
 from gundi_client_v2.client import GundiClient, GundiDataSenderClient
+from opentelemetry import trace
+from app.services.metrics import GUNDI_BATCH_DURATION
+from app.services.tracing import traced
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
@@ -23,6 +26,7 @@ async def _get_sensors_api_client(integration_id):
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@traced("gundi.send_events")
 async def send_events_to_gundi(events: List[dict], **kwargs) -> dict:
     """
     Send Events to Gundi using the REST API v2
@@ -47,11 +51,14 @@ async def send_events_to_gundi(events: List[dict], **kwargs) -> dict:
     """
     integration_id = kwargs.get("integration_id")
     assert integration_id, "integration_id is required"
+    trace.get_current_span().set_attributes({"integration_id": str(integration_id), "batch_size": len(events)})
     sensors_api_client = await _get_sensors_api_client(integration_id=str(integration_id))
-    return await sensors_api_client.post_events(data=events)
+    with GUNDI_BATCH_DURATION.labels(data_type="events").time():
+        return await sensors_api_client.post_events(data=events)
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@traced("gundi.send_attachments")
 async def send_event_attachments_to_gundi(event_id: str, attachments: List[tuple], **kwargs) -> dict:
     """
     Send Event Attachments to Gundi using the REST API v2
@@ -65,11 +72,14 @@ async def send_event_attachments_to_gundi(event_id: str, attachments: List[tuple
     """
     integration_id = kwargs.get("integration_id")
     assert integration_id, "integration_id is required"
+    trace.get_current_span().set_attributes({"integration_id": str(integration_id), "batch_size": len(attachments)})
     sensors_api_client = await _get_sensors_api_client(integration_id=str(integration_id))
-    return await sensors_api_client.post_event_attachments(event_id=event_id, attachments=attachments)
+    with GUNDI_BATCH_DURATION.labels(data_type="attachments").time():
+        return await sensors_api_client.post_event_attachments(event_id=event_id, attachments=attachments)
 
 
 @stamina.retry(on=httpx.HTTPError, wait_initial=1.0, wait_jitter=5.0, wait_max=32.0)
+@traced("gundi.send_observations")
 async def send_observations_to_gundi(observations: List[dict], **kwargs) -> dict:
     """
     Send Observations to Gundi using the REST API v2
@@ -95,5 +105,7 @@ async def send_observations_to_gundi(observations: List[dict], **kwargs) -> dict
     """
     integration_id = kwargs.get("integration_id")
     assert integration_id, "integration_id is required"
+    trace.get_current_span().set_attributes({"integration_id": str(integration_id), "batch_size": len(observations)})
     sensors_api_client = await _get_sensors_api_client(integration_id=str(integration_id))
-    return await sensors_api_client.post_observations(data=observations)
+    with GUNDI_BATCH_DURATION.labels(data_type="observations").time():
+        return await sensors_api_client.post_observations(data=observations)
@@ -0,0 +1,109 @@
+"""
+Import time of the service, measured with `python -X importtime` in fresh interpreters.
+Used by app/services/tests/test_startup.py and by the benchmarks/importtime.py report.
+"""
+import os
+import statistics
+import subprocess
+import sys
+from collections import namedtuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Budget for the self time of the app modules imported by `import app.main`, enforced in test_startup.py.
+# Third party imports are left out as they depend on the disk cache of the runner. Override it for slow CI runners.
+APP_IMPORT_TIME_BUDGET_MS = float(os.environ.get("APP_IMPORT_TIME_BUDGET_MS", 250))
+# Heavy modules that are imported on first use, so they must not be imported when the service starts
+DEFERRED_MODULES = ("numpy", "aiohttp", "gcloud.aio.pubsub", "pyinstrument")
+
+ImportRecord = namedtuple("ImportRecord", ["name", "self_us", "cumulative_us", "depth"])
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Parses the output of `python -X importtime` into ImportRecords, in import order (a package after its imports).
+    The depth is the nesting level of the import, 0 for the modules imported by the script.
+    """
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():  # Header
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        records.append(ImportRecord(name.strip(), int(self_us), int(cumulative_us), depth))
+    return records
+
+
+def run_importtime(module: str) -> list:
+    """Imports the module in a fresh interpreter and returns the parsed import times."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def measure_import_time(module: str = "app.main", runs: int = 5, top: int = 20) -> dict:
+    """
+    Imports the module `runs` times (after a warm-up import that compiles the bytecode) and reports the median time,
+    the self time of the app modules, the packages that take most of it and the slowest modules by self time,
+    from the fastest run.
+    """
+    run_importtime(module)  # Warm-up
+    all_records = [run_importtime(module) for _ in range(runs)]
+    totals = [_get_total_us(records, module) for records in all_records]
+    records = all_records[totals.index(min(totals))]
+    return {
+        "module": module,
+        "runs": runs,
+        "total_ms": round(statistics.median(totals) / 1000, 1),
+        "min_ms": round(min(totals) / 1000, 1),
+        "max_ms": round(max(totals) / 1000, 1),
+        "app_self_ms": round(min(_get_app_self_us(records) for records in all_records) / 1000, 1),
+        "modules": len(records),
+        "imported": sorted({r.name for r in records}),
+        "top_packages": _top(_aggregate_packages(records), top),
+        "top_self": _top({r.name: r.self_us for r in records}, top),
+    }
+
+
+def _get_total_us(records: list, module: str) -> int:
+    return next(r.cumulative_us for r in reversed(records) if r.name == module and r.depth == 0)
+
+
+def _get_app_self_us(records: list) -> int:
+    return sum(r.self_us for r in records if r.name == "app" or r.name.startswith("app."))
+
+
+def _aggregate_packages(records: list) -> dict:
+    # Self time of all the modules of each top level package
+    packages = {}
+    for record in records:
+        package = record.name.split(".")[0]
+        packages[package] = packages.get(package, 0) + record.self_us
+    return packages
+
+
+def _top(times_us: dict, top: int) -> list:
+    return [
+        {"name": name, "ms": round(us / 1000, 1)}
+        for name, us in sorted(times_us.items(), key=lambda item: item[1], reverse=True)[:top]
+    ]
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"import {report['module']}: {report['total_ms']} ms (median of {report['runs']} runs, "
+        f"min {report['min_ms']} ms, max {report['max_ms']} ms), {report['modules']} modules.",
+        f"Self time of the app modules: {report['app_self_ms']} ms. Budget: {APP_IMPORT_TIME_BUDGET_MS:.0f} ms",
+        "",
+        "Slowest packages (self time of all their modules):",
+        *[f"  {item['ms']:>8.1f} ms  {item['name']}" for item in report["top_packages"]],
+        "",
+        "Slowest modules (self time):",
+        *[f"  {item['ms']:>8.1f} ms  {item['name']}" for item in report["top_self"]],
+    ]
+    if deferred := [m for m in DEFERRED_MODULES if m in report["imported"]]:
+        lines += ["", f"Imported at startup but expected on first use: {', '.join(deferred)}"]
+    return "\n".join(lines)
@@ -0,0 +1,53 @@
+import logging
+import random
+
+from app import settings
+
+
+class TruncatedPayload:
+    """
+    Wraps a payload to be logged. It's only converted to a string if the log record is emitted,
+    and the text is truncated to LOG_PAYLOAD_MAX_LENGTH characters.
+    """
+
+    def __init__(self, payload, max_length: int = None):
+        self.payload = payload
+        self.max_length = max_length if max_length is not None else settings.LOG_PAYLOAD_MAX_LENGTH
+
+    def __str__(self):
+        if isinstance(self.payload, (bytes, bytearray)):
+            text = self.payload[:self.max_length + 1].decode("utf-8", errors="replace")
+            total_length = len(self.payload)
+        else:
+            text = str(self.payload)
+            total_length = len(text)
+        if total_length > self.max_length:
+            return f"{text[:self.max_length]}... ({total_length} total)"
+        return text
+
+
+def should_log_payload(path: str) -> bool:
+    sample_rate = settings.LOG_PAYLOAD_SAMPLE_RATES.get(path, settings.LOG_PAYLOAD_SAMPLE_RATE)
+    return sample_rate >= 1.0 or random.random() < sample_rate
+
+
+SENSITIVE_HEADERS = {"authorization", "proxy-authorization", "cookie", "set-cookie", "x-api-key", "apikey"}
+
+
+def redact_headers(headers) -> dict:
+    return {
+        name: "**********" if name.lower() in SENSITIVE_HEADERS else value
+        for name, value in headers.items()
+    }
+
+
+def log_payload(logger: logging.Logger, message: str, payload, path: str, level: int = logging.DEBUG, **extra):
+    """
+    Logs a (potentially large) payload received or sent through the given path.
+    This is cheap when the level is disabled or the record isn't sampled: nothing is formatted.
+    Pass bytes rather than decoded text, only the logged part is decoded. Credentials in headers are redacted.
+    """
+    if logger.isEnabledFor(level) and should_log_payload(path):
+        if "headers" in extra:
+            extra["headers"] = redact_headers(extra["headers"])
+        logger.log(level, "%s: %s", message, TruncatedPayload(payload), extra={"path": path, **extra})
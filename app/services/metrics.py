@@ -0,0 +1,75 @@
+"""
+Prometheus metrics of the service, exposed in GET /metrics.
+"""
+import functools
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Actions can take minutes, the default buckets go up to 10 seconds only
+ACTION_DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+ACTION_DURATION = Histogram(
+    "action_duration_seconds",
+    "Execution time of the action handlers",
+    ["action_id", "status"],
+    buckets=ACTION_DURATION_BUCKETS,
+)
+ACTION_QUEUE_DEPTH = Gauge(
+    "action_queue_depth",
+    "Actions waiting in the queue of each pool",
+    ["pool"],
+)
+ACTION_QUEUE_WAIT = Histogram(
+    "action_queue_wait_seconds",
+    "Time the actions wait in the queue of each pool before running",
+    ["pool"],
+    buckets=ACTION_DURATION_BUCKETS,
+)
+DIGITANIMAL_REQUEST_DURATION = Histogram(
+    "digitanimal_request_duration_seconds",
+    "Latency of the requests to the DigitAnimal API",
+    ["status"],
+    buckets=REQUEST_DURATION_BUCKETS,
+)
+OBSERVATIONS = Counter(
+    "observations",
+    "Observations processed by the actions, by stage (fetched, filtered or sent)",
+    ["action_id", "stage"],
+)
+GUNDI_BATCH_DURATION = Histogram(
+    "gundi_batch_duration_seconds",
+    "Latency of the requests sending a batch of data to Gundi",
+    ["data_type"],
+    buckets=REQUEST_DURATION_BUCKETS,
+)
+REDIS_OPERATION_DURATION = Histogram(
+    "redis_operation_duration_seconds",
+    "Latency of the operations with the configurations and states saved in Redis",
+    ["operation"],
+    buckets=REQUEST_DURATION_BUCKETS,
+)
+PUBSUB_PUBLISH_DURATION = Histogram(
+    "pubsub_publish_duration_seconds",
+    "Latency of the events published to GCP PubSub",
+    ["topic"],
+    buckets=REQUEST_DURATION_BUCKETS,
+)
+
+
+def observe_duration(histogram: Histogram, **labels):
+    """
+    Decorator for coroutine functions, records how long each call takes in the histogram.
+    Histogram.time() can't be used with coroutines as it only times the coroutine creation.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.labels(**labels).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
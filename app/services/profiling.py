@@ -0,0 +1,58 @@
+"""
+On-demand profiling of single action executions, with the pyinstrument sampling profiler.
+Nothing is imported or started unless profiling is requested.
+"""
+import datetime
+import logging
+import os
+from typing import Any, Awaitable, Tuple
+
+from app import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _save_profile(profiler, name: str) -> dict:
+    from pyinstrument.renderers import PstatsRenderer, SpeedscopeRenderer
+
+    os.makedirs(settings.ACTION_PROFILES_DIR, exist_ok=True)
+    timestamp = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(settings.ACTION_PROFILES_DIR, f"{timestamp}-{name}")
+    artifacts = {
+        "html": (f"{path}.html", profiler.output_html()),  # Interactive call tree and timeline
+        "speedscope": (f"{path}.speedscope.json", profiler.output(SpeedscopeRenderer())),  # Flamegraph
+        "pstats": (f"{path}.pstats", profiler.output(PstatsRenderer())),  # For pstats, snakeviz, etc.
+    }
+    for filename, content in artifacts.values():
+        # The pstats output is binary data decoded with surrogateescape
+        with open(filename, "w", encoding="utf-8", errors="surrogateescape") as f:
+            f.write(content)
+    return {artifact: filename for artifact, (filename, _) in artifacts.items()}
+
+
+async def run_with_profiler(awaitable: Awaitable, name: str) -> Tuple[Any, dict]:
+    """
+    Awaits the coroutine under the sampling profiler, only the time spent in this task is sampled.
+    Returns the result and a dict with the profile summary and the paths of the saved artifacts.
+    """
+    from pyinstrument import Profiler
+
+    profiler = Profiler(interval=settings.ACTION_PROFILING_INTERVAL, async_mode="enabled")
+    profiler.start()
+    try:
+        result = await awaitable
+    finally:
+        session = profiler.stop()
+        try:
+            artifacts = _save_profile(profiler, name)
+        except Exception as e:  # Profiling must not break the action, the summary is still returned
+            logger.warning(f"Error saving the profile of {name}: {e}")
+            artifacts = {}
+        profile = {
+            "duration": round(session.duration, 3),
+            "samples": session.sample_count,
+            "artifacts": artifacts,
+            "summary": profiler.output_text(),
+        }
+        logger.info(f"Profile of {name} saved: {artifacts}")
+    return result, profile
@@ -88,14 +88,17 @@ async def register_integration_in_gundi(gundi_client, type_slug=None, service_ur
     data["actions"] = actions
 
     try:  # Register webhook config if available
-        webhook_handler, payload_model, config_model = get_webhook_handler()
-    except (ImportError, AttributeError, NotImplementedError) as e:
-        logger.info(f"Webhook handler not found. Skipping webhook registration.")
+        webhook_handler_info = get_webhook_handler()
     except Exception as e:
+        webhook_handler_info = None
         logger.warning(
             f"Error getting webhook handler: {e}. Skipping webhook registration."
         )
     else:
+        if webhook_handler_info is None:
+            logger.info(f"Webhook handler not found. Skipping webhook registration.")
+    if webhook_handler_info:
+        webhook_handler, payload_model, config_model = webhook_handler_info
         data["webhook"] = {
             "name": f"{integration_type_name} Webhook",
             "value": f"{integration_type_slug}_webhook",
@@ -1,11 +1,27 @@
 import json
+from typing import Dict, List
+
 import stamina
 import httpx
 import redis.asyncio as redis
 from app import settings
+from app.services.errors import LeaseLost
+from app.services.metrics import REDIS_OPERATION_DURATION, observe_duration
+from app.services.throttling import get_current_lease
+from app.services.tracing import traced
 
 
 class IntegrationStateManager:
+    # Saves the states only if the lease (KEYS[1]) still has the fencing token (ARGV[1]) of the writer
+    FENCED_SET_SCRIPT = """
+    if redis.call("get", KEYS[1]) ~= ARGV[1] then
+        return 0
+    end
+    for i = 2, #KEYS do
+        redis.call("set", KEYS[i], ARGV[i])
+    end
+    return 1
+    """
 
     def __init__(self, **kwargs):
         host = kwargs.get("host", settings.REDIS_HOST)
@@ -13,6 +29,7 @@ class IntegrationStateManager:
         db = kwargs.get("db", settings.REDIS_STATE_DB)
         self.db_client = redis.Redis(host=host, port=port, db=db)
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="state.get_state")
     async def get_state(self, integration_id: str, action_id: str, source_id: str = "no-source") -> dict:
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
@@ -20,14 +37,57 @@ class IntegrationStateManager:
         value = json.loads(json_value) if json_value else {}
         return value
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="state.set_state")
     async def set_state(self, integration_id: str, action_id: str, state: dict, source_id: str = "no-source"):
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
-                await self.db_client.set(
-                    f"integration_state.{integration_id}.{action_id}.{source_id}",
-                    json.dumps(state, default=str)
-                )
+                key = f"integration_state.{integration_id}.{action_id}.{source_id}"
+                value = json.dumps(state, default=str)
+                if get_current_lease():
+                    await self._fenced_set({key: value})
+                else:
+                    await self.db_client.set(key, value)
+
+    @traced("state.get_states")
+    @observe_duration(REDIS_OPERATION_DURATION, operation="state.get_states")
+    async def get_states(self, integration_id: str, action_id: str, source_ids: List[str]) -> Dict[str, dict]:
+        """Reads the state of many sources with a single round trip. Returns a dict keyed by source id."""
+        if not source_ids:
+            return {}
+        keys = [f"integration_state.{integration_id}.{action_id}.{source_id}" for source_id in source_ids]
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                json_values = await self.db_client.mget(keys)
+        return {
+            source_id: json.loads(json_value) if json_value else {}
+            for source_id, json_value in zip(source_ids, json_values)
+        }
+
+    @traced("state.set_states")
+    @observe_duration(REDIS_OPERATION_DURATION, operation="state.set_states")
+    async def set_states(self, integration_id: str, action_id: str, states: Dict[str, dict]):
+        """Saves the state of many sources with a single round trip. states is a dict keyed by source id."""
+        if not states:
+            return
+        values = {
+            f"integration_state.{integration_id}.{action_id}.{source_id}": json.dumps(state, default=str)
+            for source_id, state in states.items()
+        }
+        for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                if get_current_lease():
+                    await self._fenced_set(values)
+                else:
+                    await self.db_client.mset(values)
+
+    async def _fenced_set(self, values: Dict[str, str]):
+        # Within an action run that holds a lease, so a run that lost it (e.g. it expired) can't overwrite newer states
+        lease_key, token = get_current_lease()
+        keys = list(values.keys())
+        if not await self.db_client.eval(self.FENCED_SET_SCRIPT, len(keys) + 1, lease_key, *keys, token, *values.values()):
+            raise LeaseLost(f"The lease '{lease_key}' with token {token} was lost, the states weren't saved.")
 
+    @observe_duration(REDIS_OPERATION_DURATION, operation="state.delete_state")
     async def delete_state(self, integration_id: str, action_id: str, source_id: str = "no-source"):
         for attempt in stamina.retry_context(on=redis.RedisError, attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
             with attempt:
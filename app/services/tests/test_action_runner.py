@@ -1,16 +1,27 @@
+import asyncio
 import base64
 import json
+import os
 
 import pytest
+from unittest.mock import AsyncMock
 from fastapi.testclient import TestClient
 from fastapi import status
 from gundi_core.commands import RunIntegrationAction
 from gundi_core.events import IntegrationActionFailed
+from gundi_core.schemas.v2 import IntegrationSummary
+from prometheus_client import REGISTRY
 
 from app import settings
-from app.conftest import MockSubActionConfiguration
+from app.conftest import MockSubActionConfiguration, MockPullActionConfiguration, async_return
 from app.main import app
+from app.services.action_runner import (
+    execute_action, execute_action_for_integrations, ActionPool, ActionPools, PRIORITY_HIGH, PRIORITY_NORMAL,
+    flush_error_events
+)
+from app.services.errors import ActionQueueFull, ActionQueueClosed
 from app.services.action_scheduler import trigger_action
+from app.worker import get_message_handler, run_worker
 
 api_client = TestClient(app)
 
@@ -73,6 +84,138 @@ async def test_execute_action_from_api(
     assert mock_action_handler.called
 
 
+@pytest.mark.asyncio
+async def test_execute_action_records_metrics(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
+        mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    labels = {"action_id": "pull_observations", "status": "success"}
+    executions = REGISTRY.get_sample_value("action_duration_seconds_count", labels) or 0
+
+    api_client.post(
+        "/v1/actions/execute/",
+        json={"integration_id": str(integration_v2.id), "action_id": "pull_observations"}
+    )
+    response = api_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'action_duration_seconds_count{action_id="pull_observations",status="success"}' in response.text
+    assert REGISTRY.get_sample_value("action_duration_seconds_count", labels) == executions + 1
+
+
+@pytest.mark.asyncio
+async def test_execute_action_from_api_with_profiling(
+        mocker, tmp_path, mock_gundi_client_v2, integration_v2, mock_config_manager,
+        mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.services.profiling.settings.ACTION_PROFILES_DIR", str(tmp_path))
+
+    response = api_client.post(
+        "/v1/actions/execute/",
+        json={"integration_id": str(integration_v2.id), "action_id": "pull_observations", "profile": True}
+    )
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["observations_extracted"] == 10
+    assert "summary" in result["profile"]
+    assert set(result["profile"]["artifacts"]) == {"html", "speedscope", "pstats"}
+    assert all(os.path.exists(path) for path in result["profile"]["artifacts"].values())
+
+
+@pytest.mark.asyncio
+async def test_execute_action_without_profiling(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
+        mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mock_profiler = mocker.patch("app.services.action_runner.run_with_profiler")
+
+    response = api_client.post(
+        "/v1/actions/execute/",
+        json={"integration_id": str(integration_v2.id), "action_id": "pull_observations"}
+    )
+
+    assert response.json() == {"observations_extracted": 10}
+    assert not mock_profiler.called
+
+
+@pytest.mark.asyncio
+async def test_execute_action_skipped_when_already_running(
+        mocker, integration_v2, mock_config_manager, mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.settings.ACTION_LEASE_MODE", "skip")
+    mock_lease = mocker.patch("app.services.action_runner.action_lease")
+    mock_lease.acquire = AsyncMock(return_value=None)  # Held by another run
+
+    response = await execute_action(str(integration_v2.id), "pull_observations")
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    mock_action_handler, _ = mock_action_handlers["pull_observations"]
+    assert not mock_action_handler.called
+    assert not mock_publish_event.called  # Skipped runs aren't errors
+
+
+@pytest.mark.asyncio
+async def test_execute_action_queued_when_already_running(
+        mocker, integration_v2, mock_config_manager, mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.settings.ACTION_LEASE_MODE", "queue")
+    mock_lease = mocker.patch("app.services.action_runner.action_lease")
+    mock_lease.acquire = AsyncMock(return_value=None)
+    mock_lease.add_pending = AsyncMock()
+
+    response = await execute_action(str(integration_v2.id), "pull_observations", config_overrides={"lookback_days": 2})
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    mock_lease.add_pending.assert_awaited_once_with(
+        f"{integration_v2.id}.pull_observations", {"config_overrides": {"lookback_days": 2}}
+    )
+
+
+@pytest.mark.asyncio
+async def test_execute_action_runs_queued_request_after_releasing_the_lease(
+        mocker, integration_v2, mock_config_manager, mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.settings.ACTION_LEASE_MODE", "queue")
+    mock_lease = mocker.patch("app.services.action_runner.action_lease")
+    mock_lease.acquire = AsyncMock(side_effect=[1, 2])
+    mock_lease.release = AsyncMock()
+    mock_lease.pop_pending = AsyncMock(side_effect=[{"config_overrides": None}, None])
+    pools = ActionPools(pools={"pull": 1}, assignments={}, max_queue_size=10)
+    mocker.patch("app.services.action_runner.action_pools", pools)
+
+    result = await execute_action(str(integration_v2.id), "pull_observations")
+    await pools.stop()  # Waits for the queued run
+
+    assert result == {"observations_extracted": 10}
+    mock_action_handler, _ = mock_action_handlers["pull_observations"]
+    assert mock_action_handler.call_count == 2
+    assert [c.args[1] for c in mock_lease.release.await_args_list] == [1, 2]
+
+
 @pytest.mark.asyncio
 async def test_execute_action_from_api_with_config_overrides(
         mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
@@ -157,6 +300,25 @@ async def test_execute_action_from_api_with_invalid_config(
     assert response.status_code == 422
 
 
+
+@pytest.mark.asyncio
+async def test_execute_unsupported_action_with_config_overrides_and_no_config(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager, mock_publish_event
+):
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mock_config_manager.get_action_configuration.return_value = async_return(None)
+
+    response = await execute_action(
+        integration_id=str(integration_v2.id), action_id="nonexistent_action", config_overrides={"x": 1}
+    )
+    await flush_error_events()
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert json.loads(response.body)["detail"]["config_data"] == {"configurations": []}
+
+
 @pytest.mark.asyncio
 async def test_trigger_subaction(
         mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
@@ -285,3 +447,237 @@ async def test_execute_action_with_handler_error(
     assert event.payload.server_response_status == expected_error.response.status_code
     assert event.payload.server_response_body == str(expected_error.response.text)
 
+
+
+@pytest.mark.asyncio
+async def test_execute_action_error_details_are_truncated_and_redacted(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager, mock_publish_event
+):
+    mock_handler = AsyncMock(side_effect=Exception("x" * 10000))
+    mocker.patch("app.services.action_runner.action_handlers", {"pull_observations": (mock_handler, MockPullActionConfiguration)})
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.settings.ACTION_ERROR_DETAILS_MAX_LENGTH", 100)
+
+    response = await execute_action(integration_id=str(integration_v2.id), action_id="pull_observations")
+    await flush_error_events()
+
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    error_details = json.loads(response.body)["detail"]
+    assert error_details["error"].endswith("total)")
+    assert len(error_details["error"]) < 150
+    configurations = error_details["config_data"]["configurations"]
+    assert {"action": "auth", "data": {"token": "**********"}} in configurations
+    assert "testtoken" not in response.body.decode()
+    assert mock_publish_event.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_execute_action_repeated_errors_are_rate_limited(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager, mock_publish_event
+):
+    mock_handler = AsyncMock(side_effect=Exception("Vendor API is down"))
+    mocker.patch("app.services.action_runner.action_handlers", {"pull_observations": (mock_handler, MockPullActionConfiguration)})
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mock_monotonic = mocker.patch("app.services.action_runner.time.monotonic", return_value=1000.0)
+
+    for _ in range(3):
+        response = await execute_action(integration_id=str(integration_v2.id), action_id="pull_observations")
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR  # The caller always gets the error
+    await flush_error_events()
+    assert mock_publish_event.call_count == 1
+
+    # Once the interval passes, the next error is published with the number of errors not published
+    mock_monotonic.return_value = 1000.0 + settings.ACTION_ERROR_EVENTS_INTERVAL
+    await execute_action(integration_id=str(integration_v2.id), action_id="pull_observations")
+    await flush_error_events()
+    assert mock_publish_event.call_count == 2
+    event = mock_publish_event.mock_calls[1].kwargs["event"]
+    assert event.payload.error.endswith("(2 similar errors not logged)")
+
+
+@pytest.mark.asyncio
+async def test_execute_action_for_many_integrations_from_api(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
+        mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    integration_ids = [str(integration_v2.id), "779ff3ab-5589-4f4c-9e0a-ae8d6c9edff0"]
+
+    response = api_client.post(
+        "/v1/actions/execute-bulk",
+        json={
+            "integration_ids": integration_ids,
+            "action_id": "pull_observations"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {integration_id: {"observations_extracted": 10} for integration_id in integration_ids}
+    for integration_id in integration_ids:
+        mock_config_manager.get_integration_details.assert_any_call(integration_id)
+    mock_action_handler, _ = mock_action_handlers["pull_observations"]
+    assert mock_action_handler.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_execute_action_for_all_integrations_of_this_type(
+        mocker, mock_gundi_client_v2, integration_v2, mock_config_manager,
+        mock_publish_event, mock_action_handlers,
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.settings.INTEGRATION_TYPE_SLUG", integration_v2.type.value)
+    mock_config_manager.get_integrations.return_value = async_return(
+        [IntegrationSummary.from_integration(integration_v2)]
+    )
+
+    results = await execute_action_for_integrations(action_id="pull_observations")
+
+    assert results == {str(integration_v2.id): {"observations_extracted": 10}}
+    mock_config_manager.get_integrations.assert_called_once_with(integration_type=integration_v2.type.value)
+
+
+@pytest.mark.asyncio
+async def test_execute_action_from_pull_worker(
+        mocker, mock_publish_event, mock_action_handlers, mock_config_manager, event_v2_pubsub_payload
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mock_subscriber_client = mocker.MagicMock()
+    mock_subscriber_client.modify_ack_deadline = AsyncMock()
+    message = mocker.MagicMock()
+    message.data = base64.b64decode(event_v2_pubsub_payload["message"]["data"])
+    message.attributes = event_v2_pubsub_payload["message"].get("attributes", {})
+    payload_dict = json.loads(message.data)
+    handle_message = get_message_handler(
+        subscriber_client=mock_subscriber_client,
+        subscription="projects/local-project/subscriptions/local-actions-subscription",
+        ack_deadline=60
+    )
+
+    await handle_message(message)
+
+    mock_config_manager.get_integration_details.assert_called_with(payload_dict["integration_id"])
+    mock_action_handler, _ = mock_action_handlers[payload_dict["action_id"]]
+    assert mock_action_handler.called
+    # The ack deadline is extended as soon as the action starts
+    mock_subscriber_client.modify_ack_deadline.assert_awaited_once_with(
+        "projects/local-project/subscriptions/local-actions-subscription", [message.ack_id], 60
+    )
+
+
+@pytest.mark.asyncio
+async def test_pull_worker_uses_the_subscription_ack_deadline_and_shuts_down(mocker):
+    mock_subscriber_client = mocker.MagicMock()
+    mock_subscriber_client.get_subscription = AsyncMock(return_value={"ackDeadlineSeconds": 20})
+    mocker.patch("app.worker.pubsub.SubscriberClient", return_value=mock_subscriber_client)
+    mock_subscribe = mocker.patch("app.worker.pubsub.subscribe", AsyncMock(side_effect=asyncio.CancelledError()))
+    mock_get_message_handler = mocker.patch("app.worker.get_message_handler")
+    mock_action_pools = mocker.patch("app.worker.action_pools")
+    mock_action_pools.stop = AsyncMock()
+    mock_flush_error_events = mocker.patch("app.worker.flush_error_events", AsyncMock())
+
+    with pytest.raises(asyncio.CancelledError):
+        await run_worker(subscription_name="local-actions-subscription", concurrency=1, max_messages=1)
+
+    assert mock_subscribe.called
+    assert mock_get_message_handler.call_args.args[2] == 20
+    # Queued actions and pending error events aren't lost when the worker stops
+    mock_action_pools.stop.assert_awaited_once()
+    mock_flush_error_events.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_action_pool_runs_actions_by_priority(mocker):
+    executed = []
+
+    async def execute_action(**kwargs):
+        executed.append(kwargs["action_id"])
+        return {"action_id": kwargs["action_id"]}
+
+    mocker.patch("app.services.action_runner.execute_action", execute_action)
+    pool = ActionPool(name="pull", workers=1, max_queue_size=10)
+
+    futures = [
+        pool.submit(priority=PRIORITY_NORMAL, integration_id="1", action_id="scheduled_1"),
+        pool.submit(priority=PRIORITY_NORMAL, integration_id="1", action_id="scheduled_2"),
+        pool.submit(priority=PRIORITY_HIGH, integration_id="1", action_id="manual"),
+    ]
+    results = await asyncio.gather(*futures)
+    await pool.stop()
+
+    assert executed == ["manual", "scheduled_1", "scheduled_2"]
+    assert results == [{"action_id": "scheduled_1"}, {"action_id": "scheduled_2"}, {"action_id": "manual"}]
+
+
+@pytest.mark.asyncio
+async def test_action_pool_rejects_actions_when_full(mocker):
+    mocker.patch("app.services.action_runner.execute_action", AsyncMock())
+    pool = ActionPool(name="pull", workers=1, max_queue_size=1)
+    pool.submit(integration_id="1", action_id="pull_observations")
+
+    with pytest.raises(ActionQueueFull):
+        pool.submit(integration_id="2", action_id="pull_observations")
+
+    await pool.stop()
+    with pytest.raises(ActionQueueClosed):
+        pool.submit(integration_id="3", action_id="pull_observations")
+
+
+def test_action_pools_routing():
+    pools = ActionPools(
+        pools={"auth": 1, "pull": 1, "backfill": 1},
+        assignments={"pull_historical_observations": "backfill"},
+        max_queue_size=10,
+    )
+
+    assert pools.get_pool("auth").name == "auth"  # Auth actions are detected by their configuration model
+    assert pools.get_pool("pull_historical_observations").name == "backfill"
+    assert pools.get_pool("pull_observations").name == "pull"
+    assert pools.get_pool("unknown_action").name == "pull"
+
+
+@pytest.mark.asyncio
+async def test_execute_action_from_api_rejected_when_queue_is_full(mocker, integration_v2):
+    mock_pools = mocker.patch("app.routers.actions.action_pools")
+    mock_pools.submit.side_effect = ActionQueueFull("The 'pull' actions queue is full (1000 actions).")
+
+    response = api_client.post(
+        "/v1/actions/execute/",
+        json={"integration_id": str(integration_v2.id), "action_id": "pull_observations", "run_in_background": True}
+    )
+
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.headers["Retry-After"] == "10"
+
+
+@pytest.mark.asyncio
+async def test_execute_action_for_many_integrations_rejected_when_queue_is_full(mocker, integration_v2):
+    pools = ActionPools(pools={"pull": 1}, assignments={}, max_queue_size=1)
+    mocker.patch("app.services.action_runner.action_pools", pools)
+    mock_execute_action = mocker.patch("app.services.action_runner.execute_action", AsyncMock())
+
+    response = api_client.post(
+        "/v1/actions/execute-bulk",
+        json={"integration_ids": ["1", "2"], "action_id": "pull_observations", "run_in_background": True}
+    )
+
+    # All or none, so the caller can retry the whole request
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert pools.pools["pull"].queue_size == 0
+    assert not mock_execute_action.called
@@ -27,7 +27,7 @@ async def test_publish_event(
         mocker, mock_pubsub_client, integration_event_pubsub_message, gcp_pubsub_publish_response,
         system_event
 ):
-    mocker.patch("app.services.activity_logger.pubsub", mock_pubsub_client)
+    mocker.patch("gcloud.aio.pubsub", mock_pubsub_client)
 
     response = await publish_event(
         event=system_event,
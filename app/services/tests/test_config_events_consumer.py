@@ -1,6 +1,11 @@
+import base64
+import copy
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 
+from app.conftest import async_return
 from app.main import app
 
 
@@ -116,3 +121,257 @@ async def test_process_event_action_config_deleted_from_pubsub(
     assert response.status_code == 200
     assert mock_config_manager.delete_action_configuration.called
 
+
+@pytest.mark.asyncio
+async def test_process_config_events_in_batch(
+        mocker, mock_config_manager, pubsub_message_request_headers,
+        integration_created_event_as_pubsub_message, integration_updated_event_as_pubsub_message,
+        action_config_updated_event_as_pubsub_message, integration_v2
+):
+    mock_config_manager.apply_changes.return_value = async_return(2)
+    action_config_key = ("5201c847-a938-48b0-ba64-ad92552736b1", "pull_observations")
+    mock_config_manager.get_cached_configurations.return_value = async_return(
+        ({}, {action_config_key: integration_v2.configurations[0].copy(deep=True)})
+    )
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    messages = [
+        integration_created_event_as_pubsub_message["message"],
+        integration_updated_event_as_pubsub_message["message"],
+        action_config_updated_event_as_pubsub_message["message"],
+        action_config_updated_event_as_pubsub_message["message"],
+    ]
+
+    response = api_client.post(
+        "/config-events/batch",
+        headers=pubsub_message_request_headers,
+        json={"messages": messages},
+    )
+
+    assert response.status_code == 200
+    # The redelivered event is discarded
+    assert response.json()["events_processed"] == 3
+    assert response.json()["events_discarded"] == 1
+    # The integration was created in the same batch so it's not read from the cache
+    assert not mock_config_manager.get_integration.called
+    # The updated action configuration is read with the rest of the batch
+    mock_config_manager.get_cached_configurations.assert_called_once_with(
+        integration_ids=[], action_config_keys=[action_config_key]
+    )
+    assert not mock_config_manager.get_action_configuration.called
+    assert not mock_config_manager.set_integration.called
+    assert not mock_config_manager.set_action_configuration.called
+    mock_config_manager.apply_changes.assert_called_once()
+    changes = mock_config_manager.apply_changes.call_args.kwargs
+    integration = changes["integrations"]["c4517ce8-3c14-46c0-9c68-8978bdc34a1f"]
+    assert integration.name == "[Mariano] eBird edited"
+    action_config = changes["action_configs"][("5201c847-a938-48b0-ba64-ad92552736b1", "pull_observations")]
+    assert action_config.data == {"lookback_days": 2}
+
+
+@pytest.mark.asyncio
+async def test_process_config_events_in_batch_update_after_delete(
+        mocker, mock_config_manager, pubsub_message_request_headers,
+        action_config_deleted_event_as_pubsub_message, action_config_updated_event_as_pubsub_message
+):
+    mock_config_manager.apply_changes.return_value = async_return(1)
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    # The configuration is deleted, and updated later in the same batch
+    delete_message = copy.deepcopy(action_config_deleted_event_as_pubsub_message["message"])
+    delete_event = json.loads(base64.b64decode(delete_message["data"]))
+    delete_event["timestamp"] = "2025-01-07 12:30:00.000000+00:00"
+    delete_event["payload"]["integration_id"] = "5201c847-a938-48b0-ba64-ad92552736b1"
+    delete_message["data"] = base64.b64encode(json.dumps(delete_event).encode()).decode()
+    messages = [delete_message, action_config_updated_event_as_pubsub_message["message"]]
+
+    response = api_client.post(
+        "/config-events/batch",
+        headers=pubsub_message_request_headers,
+        json={"messages": messages},
+    )
+
+    assert response.status_code == 200
+    # The deleted configuration isn't read again to apply the update
+    assert not mock_config_manager.get_action_configuration.called
+    mock_config_manager.get_cached_configurations.assert_called_once_with(integration_ids=[], action_config_keys=[])
+    mock_config_manager.apply_changes.assert_called_once_with(
+        integrations={}, action_configs={("5201c847-a938-48b0-ba64-ad92552736b1", "pull_observations"): None}
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_config_events_in_batch_discards_unknown_events(
+        mocker, mock_config_manager, pubsub_message_request_headers, integration_deleted_event_as_pubsub_message
+):
+    mock_config_manager.apply_changes.return_value = async_return(1)
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    unknown_message = {**integration_deleted_event_as_pubsub_message["message"], "attributes": {"event_type": "Unknown"}}
+
+    response = api_client.post(
+        "/config-events/batch",
+        headers=pubsub_message_request_headers,
+        json={"messages": [unknown_message, integration_deleted_event_as_pubsub_message["message"]]},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["events_processed"] == 1
+    assert response.json()["events_discarded"] == 1
+    mock_config_manager.apply_changes.assert_called_once_with(
+        integrations={"c4517ce8-3c14-46c0-9c68-8978bdc34a1f": None}, action_configs={}
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_event_already_processed_is_discarded(
+        mocker, mock_config_manager, pubsub_message_request_headers, action_config_updated_event_as_pubsub_message
+):
+    mock_config_manager.get_processed_events.return_value = async_return({"952375ad-164c-4c83-9021-b4104432840e"})
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+
+    response = api_client.post(
+        "/config-events/",
+        headers=pubsub_message_request_headers,
+        json=action_config_updated_event_as_pubsub_message,
+    )
+
+    assert response.status_code == 200
+    assert not mock_config_manager.get_action_configuration.called
+    assert not mock_config_manager.set_action_configuration.called
+
+
+@pytest.mark.asyncio
+async def test_process_outdated_event_is_discarded(
+        mocker, mock_config_manager, pubsub_message_request_headers, action_config_updated_event_as_pubsub_message
+):
+    config_name = "integrationconfig.5201c847-a938-48b0-ba64-ad92552736b1.pull_observations"
+    # The config was created again by an event sent after this one
+    mock_config_manager.get_config_versions.return_value = async_return({config_name: 1736300000.0})
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+
+    response = api_client.post(
+        "/config-events/",
+        headers=pubsub_message_request_headers,
+        json=action_config_updated_event_as_pubsub_message,
+    )
+
+    assert response.status_code == 200
+    assert not mock_config_manager.set_action_configuration.called
+    mock_config_manager.get_config_versions.assert_called_once()
+    assert set(mock_config_manager.get_config_versions.call_args.args[0]) == {
+        config_name, f"{config_name}.*", f"{config_name}.data"
+    }
+
+
+@pytest.mark.asyncio
+async def test_process_outdated_update_fields_are_discarded(
+        mocker, mock_config_manager, pubsub_message_request_headers, action_config_updated_event_as_pubsub_message
+):
+    config_name = "integrationconfig.5201c847-a938-48b0-ba64-ad92552736b1.pull_observations"
+    # The data field was changed by an event sent after this one
+    mock_config_manager.get_config_versions.return_value = async_return({f"{config_name}.data": 1736300000.0})
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+
+    response = api_client.post(
+        "/config-events/",
+        headers=pubsub_message_request_headers,
+        json=action_config_updated_event_as_pubsub_message,
+    )
+
+    assert response.status_code == 200
+    assert not mock_config_manager.set_action_configuration.called
+
+
+@pytest.mark.asyncio
+async def test_process_created_event_older_than_an_update_is_discarded(
+        mocker, mock_config_manager, pubsub_message_request_headers, integration_created_event_as_pubsub_message
+):
+    # The integration was updated by an event sent after this one
+    mock_config_manager.get_config_versions.return_value = async_return(
+        {"integration.c4517ce8-3c14-46c0-9c68-8978bdc34a1f.*": 1736300000.0}
+    )
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+
+    response = api_client.post(
+        "/config-events/",
+        headers=pubsub_message_request_headers,
+        json=integration_created_event_as_pubsub_message,
+    )
+
+    assert response.status_code == 200
+    assert not mock_config_manager.set_integration.called
+
+
+@pytest.mark.asyncio
+async def test_process_config_events_in_batch_created_after_update_out_of_order(
+        mocker, mock_config_manager, pubsub_message_request_headers,
+        integration_created_event_as_pubsub_message, integration_updated_event_as_pubsub_message
+):
+    mock_config_manager.apply_changes.return_value = async_return(1)
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    messages = [
+        integration_updated_event_as_pubsub_message["message"],
+        integration_created_event_as_pubsub_message["message"],  # Sent before the update
+    ]
+
+    response = api_client.post(
+        "/config-events/batch",
+        headers=pubsub_message_request_headers,
+        json={"messages": messages},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["events_processed"] == 1
+    assert response.json()["events_discarded"] == 1
+    integration = mock_config_manager.apply_changes.call_args.kwargs["integrations"]["c4517ce8-3c14-46c0-9c68-8978bdc34a1f"]
+    assert integration.name == "[Mariano] eBird edited"
+
+
+@pytest.mark.asyncio
+async def test_process_config_events_in_batch_out_of_order_updates_of_other_fields(
+        mocker, mock_config_manager, pubsub_message_request_headers, integration_updated_event_as_pubsub_message
+):
+    integration_id = "c4517ce8-3c14-46c0-9c68-8978bdc34a1f"
+    mock_config_manager.apply_changes.return_value = async_return(1)
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+    # An update of other fields, sent before the name update but received after it
+    older_message = copy.deepcopy(integration_updated_event_as_pubsub_message["message"])
+    older_event = json.loads(base64.b64decode(older_message["data"]))
+    older_event["event_id"] = "0c6a8a1e-34a5-4a3b-9d0b-b7a3c2ae3d61"
+    older_event["timestamp"] = "2025-01-07 14:00:00.000000+00:00"
+    older_event["payload"]["changes"] = {"name": "Older name", "base_url": "https://api.example.com/"}
+    older_message["data"] = base64.b64encode(json.dumps(older_event).encode()).decode()
+
+    response = api_client.post(
+        "/config-events/batch",
+        headers=pubsub_message_request_headers,
+        json={"messages": [integration_updated_event_as_pubsub_message["message"], older_message]},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["events_processed"] == 2
+    integration = mock_config_manager.apply_changes.call_args.kwargs["integrations"][integration_id]
+    # The newer name is kept, and the older change of another field is applied
+    assert integration.name == "[Mariano] eBird edited"
+    assert integration.base_url == "https://api.example.com/"
+
+
+@pytest.mark.asyncio
+async def test_processed_events_are_saved(
+        mocker, mock_config_manager, pubsub_message_request_headers, action_config_updated_event_as_pubsub_message
+):
+    mocker.patch("app.services.config_events_consumer.config_manager", mock_config_manager)
+
+    response = api_client.post(
+        "/config-events/",
+        headers=pubsub_message_request_headers,
+        json=action_config_updated_event_as_pubsub_message,
+    )
+
+    assert response.status_code == 200
+    assert mock_config_manager.set_action_configuration.called
+    mock_config_manager.set_events_processed.assert_called_once_with(
+        event_ids=["952375ad-164c-4c83-9021-b4104432840e"],
+        versions={
+            "integrationconfig.5201c847-a938-48b0-ba64-ad92552736b1.pull_observations.*": 1736253116.302384,
+            "integrationconfig.5201c847-a938-48b0-ba64-ad92552736b1.pull_observations.data": 1736253116.302384,
+        }
+    )
@@ -1,6 +1,10 @@
+import asyncio
+
+import httpx
 import pytest
 
 from gundi_core.schemas.v2 import IntegrationSummary, IntegrationActionConfiguration, Integration
+from app.conftest import async_return
 from app.services.config_manager import IntegrationConfigurationManager
 
 
@@ -106,8 +110,197 @@ async def test_get_integration_details_with_empty_redis_db(
     assert isinstance(integration, Integration)
     assert len(integration.configurations) == len(integration_v2.configurations)
     assert integration.id == integration_v2.id
-    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_with(integration_id)
+    # Gundi is called only once and the cache is populated
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once_with(integration_id)
+    mock_redis_empty.Redis.return_value.get.assert_called_once_with(f"integration.{integration_id}")
     for config in integration_v2.configurations:
         action_id = config.action.value
-        mock_redis_empty.Redis.return_value.get.assert_any_call(f"integrationconfig.{integration_id}.{action_id}")
+        mock_redis_empty.Redis.return_value.set.assert_any_call(
+            f"integrationconfig.{integration_id}.{action_id}", config.json()
+        )
+    # Actions without configuration are saved too, so they aren't reloaded on every lookup
+    mock_redis_empty.Redis.return_value.set.assert_any_call(f"integrationconfig.{integration_id}.push_events", "null")
+
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_not_found_isnt_retried(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    request = httpx.Request("GET", f"https://gundi/v2/integrations/{integration_v2.id}/")
+    mock_gundi_client_v2_class.return_value.get_integration_details.side_effect = httpx.HTTPStatusError(
+        "Not Found", request=request, response=httpx.Response(404, request=request)
+    )
+    config_manager = IntegrationConfigurationManager()
+
+    with pytest.raises(httpx.HTTPStatusError) as exc_info:
+        await config_manager.get_integration_details(str(integration_v2.id))
+
+    assert exc_info.value.response.status_code == 404
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reloads_of_an_integration_are_coalesced(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+
+    async def get_integration_details(integration_id):
+        await asyncio.sleep(0.01)
+        return integration_v2
+
+    mock_gundi_client_v2_class.return_value.get_integration_details.side_effect = get_integration_details
+    config_manager = IntegrationConfigurationManager()
+
+    integrations = await asyncio.gather(
+        *[config_manager.get_integration_details(str(integration_v2.id)) for _ in range(5)]
+    )
+
+    assert all(integration.id == integration_v2.id for integration in integrations)
+    assert len({id(integration) for integration in integrations}) == 5  # Each caller gets its own copy
+    mock_gundi_client_v2_class.return_value.get_integration_details.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_from_redis(
+        mocker, mock_redis_with_integration_config, mock_gundi_client_v2_class, integration_v2_with_webhook,
+):
+    integration = integration_v2_with_webhook
+    redis_client = mock_redis_with_integration_config.Redis.return_value
+    redis_client.get.return_value = async_return(IntegrationSummary.from_integration(integration).json())
+    configs_data = {f"integrationconfig.{integration.id}.{config.action.value}": config.json() for config in integration.configurations}
+    redis_client.mget.side_effect = lambda keys: async_return([
+        configs_data.get(key, integration.webhook_configuration.json()) for key in keys
+    ])
+    mocker.patch("app.services.config_manager.redis", mock_redis_with_integration_config)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+
+    integration_details = await config_manager.get_integration_details(str(integration.id))
+
+    assert integration_details.id == integration.id
+    assert len(integration_details.configurations) == len(integration.configurations)
+    assert integration_details.webhook_configuration == integration.webhook_configuration
+    # All the configurations are read at once
+    assert redis_client.mget.call_count == 1
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+
+
+@pytest.mark.asyncio
+async def test_get_integration_details_with_unconfigured_actions_from_redis(
+        mocker, mock_redis_with_integration_config, mock_gundi_client_v2_class, integration_v2,
+):
+    integration_id = str(integration_v2.id)
+    redis_client = mock_redis_with_integration_config.Redis.return_value
+    redis_client.get.return_value = async_return(IntegrationSummary.from_integration(integration_v2).json())
+    cached_data = {
+        **{f"integrationconfig.{integration_id}.{config.action.value}": config.json() for config in integration_v2.configurations},
+        f"integrationconfig.{integration_id}.push_events": "null",  # No configuration in Gundi
+        f"integrationwebhookconfig.{integration_id}": "null",
+    }
+    redis_client.mget.side_effect = lambda keys: async_return([cached_data.get(key) for key in keys])
+    mocker.patch("app.services.config_manager.redis", mock_redis_with_integration_config)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
 
+    integration_details = await config_manager.get_integration_details(integration_id)
+
+    assert {c.action.value for c in integration_details.configurations} == {
+        c.action.value for c in integration_v2.configurations
+    }
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+
+
+@pytest.mark.asyncio
+async def test_get_webhook_configuration_of_integration_without_webhook(
+        mocker, mock_redis_empty, mock_gundi_client_v2_class, integration_v2,
+):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+
+    webhook_config = await config_manager.get_webhook_configuration(integration_id)
+
+    assert webhook_config is None
+    # "null" is saved so the integration isn't reloaded from Gundi on every lookup
+    mock_redis_empty.Redis.return_value.set.assert_any_call(
+        f"integrationwebhookconfig.{integration_id}", "null", ex=600
+    )
+
+
+
+@pytest.mark.asyncio
+async def test_get_integrations_by_type(
+        mocker, mock_redis_with_integration_config, mock_gundi_client_v2_class, integration_v2, integration_v2_as_json
+):
+    async def scan_iter(*args, **kwargs):
+        for key in [f"integration.{integration_v2.id}", "integration.other"]:
+            yield key
+
+    redis_client = mock_redis_with_integration_config.Redis.return_value
+    redis_client.scan_iter = scan_iter
+    redis_client.mget.return_value = async_return([integration_v2_as_json, None])
+    mocker.patch("app.services.config_manager.redis", mock_redis_with_integration_config)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+
+    integrations = await config_manager.get_integrations(integration_type=integration_v2.type.value)
+    other_integrations = await config_manager.get_integrations(integration_type="other_type")
+
+    assert [integration.id for integration in integrations] == [integration_v2.id]
+    assert other_integrations == []
+    redis_client.mget.assert_called_with([f"integration.{integration_v2.id}", "integration.other"])
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
+
+
+@pytest.mark.asyncio
+async def test_apply_changes_in_a_single_pipeline(mocker, mock_redis_empty, integration_v2):
+    mocker.patch("app.services.config_manager.redis", mock_redis_empty)
+    redis_client = mock_redis_empty.Redis.return_value
+    config_manager = IntegrationConfigurationManager()
+    integration_id = str(integration_v2.id)
+    action_config = integration_v2.configurations[0]
+
+    writes = await config_manager.apply_changes(
+        integrations={integration_id: IntegrationSummary.from_integration(integration_v2)},
+        action_configs={(integration_id, action_config.action.value): action_config, (integration_id, "other"): None},
+    )
+
+    assert writes == 3
+    redis_client.pipeline.assert_called_once_with(transaction=True)
+    assert redis_client.set.call_count == 2
+    redis_client.delete.assert_called_once_with(f"integrationconfig.{integration_id}.other")
+    assert redis_client.execute.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_cached_configurations_in_a_single_read(
+        mocker, mock_redis_with_integration_config, mock_gundi_client_v2_class, integration_v2, integration_v2_as_json
+):
+    integration_id = str(integration_v2.id)
+    action_config = integration_v2.configurations[0]
+    redis_client = mock_redis_with_integration_config.Redis.return_value
+    redis_client.mget.return_value = async_return([integration_v2_as_json, action_config.json(), None])
+    mocker.patch("app.services.config_manager.redis", mock_redis_with_integration_config)
+    mocker.patch("app.services.config_manager.GundiClient", mock_gundi_client_v2_class)
+    config_manager = IntegrationConfigurationManager()
+
+    integrations, action_configs = await config_manager.get_cached_configurations(
+        integration_ids=[integration_id],
+        action_config_keys=[(integration_id, action_config.action.value), (integration_id, "other")]
+    )
+
+    assert list(integrations) == [integration_id]
+    # Configurations missing in the cache are left out
+    assert action_configs == {(integration_id, action_config.action.value): action_config}
+    redis_client.mget.assert_called_once_with([
+        f"integration.{integration_id}",
+        f"integrationconfig.{integration_id}.{action_config.action.value}",
+        f"integrationconfig.{integration_id}.other",
+    ])
+    assert not mock_gundi_client_v2_class.return_value.get_integration_details.called
@@ -0,0 +1,48 @@
+import logging
+
+import pytest
+
+from app.services.logs import TruncatedPayload, log_payload
+
+
+def test_truncated_payload_short_text():
+    assert str(TruncatedPayload({"a": 1}, max_length=100)) == "{'a': 1}"
+
+
+def test_truncated_payload_long_bytes():
+    payload = b"x" * 50
+
+    text = str(TruncatedPayload(payload, max_length=10))
+
+    assert text == "xxxxxxxxxx... (50 total)"
+
+
+def test_log_payload_is_not_formatted_when_level_is_disabled(mocker):
+    logger = logging.getLogger("test_logs.disabled")
+    logger.setLevel(logging.INFO)
+    mock_str = mocker.patch.object(TruncatedPayload, "__str__", return_value="")
+
+    log_payload(logger, "Payload", b"{}", path="/webhooks")
+
+    assert not mock_str.called
+
+
+@pytest.mark.parametrize("sample_rate,expected_records", [(0.0, 0), (1.0, 1)])
+def test_log_payload_sampling_per_path(mocker, caplog, sample_rate, expected_records):
+    mocker.patch("app.settings.LOG_PAYLOAD_SAMPLE_RATES", {"/webhooks": sample_rate})
+    logger = logging.getLogger("test_logs.sampling")
+
+    with caplog.at_level(logging.DEBUG, logger="test_logs.sampling"):
+        log_payload(logger, "Payload", b"{}", path="/webhooks")
+
+    assert len(caplog.records) == expected_records
+
+
+def test_log_payload_redacts_credentials_in_headers(caplog):
+    logger = logging.getLogger("test_logs.headers")
+    headers = {"Authorization": "Bearer secret-token", "Content-Type": "application/json"}
+
+    with caplog.at_level(logging.DEBUG, logger="test_logs.headers"):
+        log_payload(logger, "Payload", b"{}", path="/webhooks", headers=headers)
+
+    assert caplog.records[0].headers == {"Authorization": "**********", "Content-Type": "application/json"}
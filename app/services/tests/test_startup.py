@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import pytest
+
+from app.services.importtime import (
+    measure_import_time, format_report, APP_IMPORT_TIME_BUDGET_MS, DEFERRED_MODULES, REPO_ROOT
+)
+
+
+@pytest.fixture(scope="module")
+def import_time_report():
+    return measure_import_time(module="app.main", runs=3)
+
+
+def test_app_import_time_within_budget(import_time_report):
+    # Cold starts (e.g. scaling from zero) wait for the service to be imported.
+    # Only the self time of the app modules (fastest run) is checked, the wall clock time is too noisy on shared runners.
+    assert import_time_report["app_self_ms"] <= APP_IMPORT_TIME_BUDGET_MS, format_report(import_time_report)
+
+
+def test_heavy_modules_not_imported_on_startup(import_time_report):
+    imported = set(import_time_report["imported"])
+    assert not imported.intersection(DEFERRED_MODULES), format_report(import_time_report)
+
+
+def test_clients_not_created_on_startup():
+    # Clients are created on first use (see LazyInstance), so importing the service doesn't create any
+    script = (
+        "import gc, sys\n"
+        "import app.main\n"
+        "from redis.asyncio import Redis\n"
+        "from gundi_client_v2 import GundiClient, GundiDataSenderClient\n"
+        "clients = (Redis, GundiClient, GundiDataSenderClient)\n"
+        "if 'gcloud.aio.pubsub' in sys.modules:\n"
+        "    from gcloud.aio.pubsub import PublisherClient, SubscriberClient\n"
+        "    clients += (PublisherClient, SubscriberClient)\n"
+        "print(sorted({type(o).__name__ for o in gc.get_objects() if isinstance(o, clients)}))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
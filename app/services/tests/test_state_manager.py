@@ -2,7 +2,11 @@ import datetime
 import json
 
 import pytest
+import redis.asyncio as redis
+from app.conftest import async_return
+from app.services.errors import LeaseLost
 from app.services.state import IntegrationStateManager
+from app.services.throttling import ActionLease
 
 
 @pytest.mark.asyncio
@@ -150,3 +154,69 @@ async def test_delete_state_source_state(mocker, mock_redis, integration_v2, moc
     mock_redis.Redis.return_value.delete.assert_called_once_with(
         f"integration_state.{integration_id}.pull_observations.{source_id}"
     )
+
+
+@pytest.mark.asyncio
+async def test_get_states_for_many_sources(mocker, mock_redis, integration_v2, mock_integration_state):
+    mocker.patch("app.services.state.redis", mock_redis)
+    mock_redis.Redis.return_value.mget.return_value = async_return(
+        [json.dumps(mock_integration_state), None]
+    )
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    states = await state_manager.get_states(
+        integration_id=integration_id,
+        action_id="pull_observations",
+        source_ids=["device-1", "device-2"]
+    )
+
+    assert states == {"device-1": mock_integration_state, "device-2": {}}
+    mock_redis.Redis.return_value.mget.assert_called_once_with([
+        f"integration_state.{integration_id}.pull_observations.device-1",
+        f"integration_state.{integration_id}.pull_observations.device-2",
+    ])
+
+
+@pytest.mark.asyncio
+async def test_set_states_for_many_sources(mocker, mock_redis, integration_v2, mock_integration_state):
+    mocker.patch("app.services.state.redis", mock_redis)
+    mock_redis.Redis.return_value.mset.return_value = async_return(True)
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+
+    await state_manager.set_states(
+        integration_id=integration_id,
+        action_id="pull_observations",
+        states={"device-1": mock_integration_state, "device-2": mock_integration_state}
+    )
+
+    mock_redis.Redis.return_value.mset.assert_called_once_with({
+        f"integration_state.{integration_id}.pull_observations.device-1": json.dumps(mock_integration_state),
+        f"integration_state.{integration_id}.pull_observations.device-2": json.dumps(mock_integration_state),
+    })
+
+
+@pytest.mark.parametrize("lease_held", [True, False])
+@pytest.mark.asyncio
+async def test_set_states_fenced_by_the_action_lease(mocker, mock_redis, integration_v2, mock_integration_state, lease_held):
+    mocker.patch("app.services.state.redis", mock_redis)
+    mock_redis.RedisError = redis.RedisError  # Lease errors must not be retried
+    mock_redis.Redis.return_value.eval.return_value = async_return(1 if lease_held else 0)
+    state_manager = IntegrationStateManager()
+    integration_id = str(integration_v2.id)
+    lease = ActionLease(db_client=mocker.MagicMock())
+    key = f"integration_state.{integration_id}.pull_observations.device-1"
+
+    with lease.hold(f"{integration_id}.pull_observations", token=7):
+        if lease_held:
+            await state_manager.set_states(integration_id, "pull_observations", {"device-1": mock_integration_state})
+        else:  # The lease expired and was taken by another run
+            with pytest.raises(LeaseLost):
+                await state_manager.set_states(integration_id, "pull_observations", {"device-1": mock_integration_state})
+
+    mock_redis.Redis.return_value.eval.assert_called_once_with(
+        IntegrationStateManager.FENCED_SET_SCRIPT, 2, f"action_lease.{integration_id}.pull_observations",
+        key, 7, json.dumps(mock_integration_state)
+    )
+    assert not mock_redis.Redis.return_value.mset.called
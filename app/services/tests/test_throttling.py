@@ -0,0 +1,234 @@
+import asyncio
+import time
+
+import pytest
+import redis.asyncio as redis
+from unittest.mock import AsyncMock
+
+from app.services.errors import CircuitBreakerOpen
+from app.services.throttling import TokenBucketRateLimiter, CircuitBreaker, ActionLease, get_current_lease
+
+
+class FakeRedis:
+    """Minimal in-memory stand-in for the redis commands used by the circuit breaker and the action lease"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        values = self.data.setdefault(key, {})
+        if mapping:
+            values.update({k: str(v) for k, v in mapping.items()})
+        else:
+            values[field] = str(value)
+
+    async def hincrby(self, key, field, amount=1):
+        values = self.data.setdefault(key, {})
+        values[field] = str(int(values.get(field, 0)) + amount)
+        return int(values[field])
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def expire(self, key, seconds):
+        return True
+
+    async def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    async def getdel(self, key):
+        return self.data.pop(key, None)
+
+    async def eval(self, script, numkeys, key, token):
+        assert script == ActionLease.RELEASE_SCRIPT
+        if str(self.data.get(key)) == str(token):
+            del self.data[key]
+            return 1
+        return 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_allows_bursts_up_to_capacity():
+    rate_limiter = TokenBucketRateLimiter(rate=1, capacity=3)
+    start = time.monotonic()
+    for _ in range(3):
+        await rate_limiter.acquire("account")
+    assert time.monotonic() - start < 0.1
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_waits_when_bucket_is_empty():
+    rate_limiter = TokenBucketRateLimiter(rate=20, capacity=1)
+    start = time.monotonic()
+    for _ in range(3):
+        await rate_limiter.acquire("account")
+    assert time.monotonic() - start >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_buckets_are_per_key():
+    rate_limiter = TokenBucketRateLimiter(rate=0.1, capacity=1)
+    await rate_limiter.acquire("account-1")
+    await asyncio.wait_for(rate_limiter.acquire("account-2"), timeout=0.1)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_evicts_idle_buckets(mocker):
+    rate_limiter = TokenBucketRateLimiter(rate=1, capacity=1)
+    for i in range(3):
+        await rate_limiter.acquire(f"account-{i}")
+    assert len(rate_limiter._buckets) == 3
+
+    # The buckets are full again after capacity / rate seconds
+    now = time.monotonic() + 2
+    mocker.patch("app.services.throttling.time.monotonic", return_value=now)
+    await rate_limiter.acquire("account-new")
+
+    assert list(rate_limiter._buckets) == ["account-new"]
+    assert list(rate_limiter._locks) == ["account-new"]
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_opens_after_consecutive_failures():
+    circuit_breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60, db_client=FakeRedis())
+    await circuit_breaker.before_request("account")
+    await circuit_breaker.record_failure("account")
+    await circuit_breaker.before_request("account")
+    await circuit_breaker.record_failure("account")
+
+    with pytest.raises(CircuitBreakerOpen):
+        await circuit_breaker.before_request("account")
+    assert (await circuit_breaker.get_state("account"))["state"] == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_success_resets_failures():
+    circuit_breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60, db_client=FakeRedis())
+    await circuit_breaker.record_failure("account")
+    await circuit_breaker.record_success("account")
+    await circuit_breaker.record_failure("account")
+
+    await circuit_breaker.before_request("account")
+    assert (await circuit_breaker.get_state("account"))["state"] == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_half_open_allows_a_single_trial():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.01, db_client=FakeRedis())
+    await circuit_breaker.record_failure("account")
+    await asyncio.sleep(0.02)
+
+    await circuit_breaker.before_request("account")  # Trial request
+    assert (await circuit_breaker.get_state("account"))["state"] == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitBreakerOpen):
+        await circuit_breaker.before_request("account")
+
+    await circuit_breaker.record_success("account")
+    await circuit_breaker.before_request("account")
+    assert (await circuit_breaker.get_state("account"))["state"] == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_released_trial_lets_another_one_through():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.01, db_client=FakeRedis())
+    await circuit_breaker.record_failure("account")
+    await asyncio.sleep(0.02)
+    await circuit_breaker.before_request("account")  # Trial request, ended without an upstream response
+
+    await circuit_breaker.release_trial("account")
+
+    await circuit_breaker.before_request("account")
+    assert (await circuit_breaker.get_state("account"))["state"] == CircuitBreaker.HALF_OPEN
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_failed_trial_opens_the_circuit_again():
+    circuit_breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=0.01, db_client=FakeRedis())
+    for _ in range(3):
+        await circuit_breaker.record_failure("account")
+    await asyncio.sleep(0.02)
+    await circuit_breaker.before_request("account")
+
+    await circuit_breaker.record_failure("account")
+
+    assert (await circuit_breaker.get_state("account"))["state"] == CircuitBreaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_action_lease_is_exclusive_and_fencing_tokens_increase():
+    lease = ActionLease(db_client=FakeRedis())
+
+    token = await lease.acquire("integration.pull_observations")
+    assert await lease.acquire("integration.pull_observations") is None
+    await lease.release("integration.pull_observations", token)
+    next_token = await lease.acquire("integration.pull_observations")
+
+    assert next_token > token
+
+
+@pytest.mark.asyncio
+async def test_action_lease_is_only_released_by_its_holder():
+    lease = ActionLease(db_client=FakeRedis())
+    token = await lease.acquire("integration.pull_observations")
+
+    await lease.release("integration.pull_observations", token - 1)  # e.g. a holder whose lease expired
+
+    assert await lease.acquire("integration.pull_observations") is None
+
+
+@pytest.mark.asyncio
+async def test_action_lease_wait_until_released():
+    lease = ActionLease(db_client=FakeRedis())
+    token = await lease.acquire("integration.pull_observations")
+
+    async def release_later():
+        await asyncio.sleep(0.05)
+        await lease.release("integration.pull_observations", token)
+
+    asyncio.create_task(release_later())
+    assert await lease.wait("integration.pull_observations", timeout=1, interval=0.01) > token
+    assert await lease.wait("integration.pull_observations", timeout=0.05, interval=0.01) is None
+
+
+@pytest.mark.asyncio
+async def test_action_lease_pending_runs_are_coalesced():
+    lease = ActionLease(db_client=FakeRedis())
+
+    await lease.add_pending("integration.pull_observations", {"config_overrides": {"lookback_days": 1}})
+    await lease.add_pending("integration.pull_observations", {"config_overrides": {"lookback_days": 2}})
+
+    assert await lease.pop_pending("integration.pull_observations") == {"config_overrides": {"lookback_days": 2}}
+    assert await lease.pop_pending("integration.pull_observations") is None
+
+
+@pytest.mark.asyncio
+async def test_action_lease_fails_open_on_redis_errors():
+    db_client = FakeRedis()
+    db_client.incr = AsyncMock(side_effect=redis.ConnectionError("Connection refused"))
+    lease = ActionLease(db_client=db_client)
+
+    assert await lease.acquire("integration.pull_observations") == 0
+
+
+def test_action_lease_held_in_context():
+    lease = ActionLease(db_client=FakeRedis())
+
+    with lease.hold("integration.pull_observations", token=3):
+        assert get_current_lease() == ("action_lease.integration.pull_observations", 3)
+    assert get_current_lease() is None
+    with lease.hold("integration.pull_observations", token=0):  # Failed open, nothing to fence
+        assert get_current_lease() is None
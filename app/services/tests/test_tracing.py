@@ -0,0 +1,50 @@
+import pytest
+
+from app import settings
+from app.services.action_runner import execute_action
+from app.services.activity_logger import publish_event
+from app.services.tracing import traced
+
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+TRACEPARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+@pytest.mark.asyncio
+async def test_execute_action_continues_propagated_trace(
+        mocker, span_exporter, mock_action_handlers, mock_config_manager, mock_publish_event, integration_v2
+):
+    mocker.patch("app.services.action_runner.action_handlers", mock_action_handlers)
+    mocker.patch("app.services.action_runner.config_manager", mock_config_manager)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+
+    await execute_action(
+        integration_id=str(integration_v2.id),
+        action_id="pull_observations",
+        trace_context={"traceparent": TRACEPARENT},
+    )
+
+    span = next(span for span in span_exporter.get_finished_spans() if span.name == "execute_action")
+    assert format(span.context.trace_id, "032x") == TRACE_ID
+    assert span.attributes["action_id"] == "pull_observations"
+    assert span.attributes["integration_id"] == str(integration_v2.id)
+
+
+@pytest.mark.asyncio
+async def test_publish_event_propagates_trace_context(
+        mocker, span_exporter, mock_pubsub_client, action_complete_event
+):
+    mocker.patch("gcloud.aio.pubsub", mock_pubsub_client)
+
+    @traced("test")
+    async def run_action():
+        await publish_event(event=action_complete_event, topic_name=settings.INTEGRATION_EVENTS_TOPIC)
+
+    await run_action()
+
+    spans = {span.name: span for span in span_exporter.get_finished_spans()}
+    assert spans["publish_event"].parent.span_id == spans["test"].context.span_id
+    attributes = mock_pubsub_client.PubsubMessage.call_args.kwargs
+    trace_id = format(spans["test"].context.trace_id, "032x")
+    assert attributes["traceparent"].split("-")[1] == trace_id
@@ -0,0 +1,169 @@
+import contextvars
+import copy
+
+import pyjq
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from app.services.utils import (
+    StructHexString, get_struct_hex_decoder, get_jq_program, jq_transform_many, StageTimings, timed_stage, LazyInstance
+)
+from app.webhooks.core import GenericJsonTransformConfig
+
+
+@pytest.fixture
+def hex_format():
+    return {
+        "byte_order": ">",
+        "fields": [
+            {"name": "start_bit", "format": "B", "output_type": "int"},
+            {"name": "v", "format": "I"},
+            {"name": "interval", "format": "H", "output_type": "int"},
+            {"name": "meter_state_1", "format": "B"},
+            {
+                "name": "meter_state_2",
+                "format": "B",
+                "bit_fields": [
+                    {"name": "meter_batter_alarm", "end_bit": 0, "start_bit": 0, "output_type": "bool"},
+                    {"name": "empty_pipe_alarm", "end_bit": 1, "start_bit": 1, "output_type": "bool"},
+                    {"name": "state_bits", "end_bit": 7, "start_bit": 1, "output_type": "int"},
+                ]
+            },
+            {"name": "r1", "format": "B", "output_type": "int"},
+            {"name": "r2", "format": "B", "output_type": "int"},
+            {"name": "crc", "format": "B", "output_type": "hex"},
+        ]
+    }
+
+
+def test_struct_hex_string_unpacks_fields_and_bit_fields(hex_format):
+    hex_string = StructHexString.validate("6881631900003c20020000c3", {"hex_format": hex_format}, None)
+
+    assert hex_string.format_spec == ">BIHBBBBB"
+    assert hex_string.unpacked_data == {
+        "start_bit": 104,
+        "v": 2170755328,
+        "interval": 60,
+        "meter_state_1": 32,
+        "meter_state_2": 2,
+        "r1": 0,
+        "r2": 0,
+        "crc": "0xc3",
+        "meter_batter_alarm": False,
+        "empty_pipe_alarm": True,
+        "state_bits": 1,
+    }
+
+
+def test_struct_hex_string_rejects_invalid_length(hex_format):
+    with pytest.raises(ValueError):
+        StructHexString.validate("6881", {"hex_format": hex_format}, None)
+
+
+def test_struct_hex_decoders_are_cached_by_format(hex_format):
+    decoder = get_struct_hex_decoder(hex_format)
+
+    assert get_struct_hex_decoder(hex_format) is decoder
+    assert get_struct_hex_decoder(copy.deepcopy(hex_format)) is decoder
+    assert get_struct_hex_decoder({**hex_format, "byte_order": "<"}) is not decoder
+    # Changes in the same dict are picked up
+    modified_format = copy.deepcopy(hex_format)
+    assert get_struct_hex_decoder(modified_format) is decoder
+    modified_format["byte_order"] = "<"
+    assert get_struct_hex_decoder(modified_format).format_spec.startswith("<")
+
+
+def test_struct_hex_string_json_serialization(hex_format):
+    hex_string = StructHexString("6881631900003c20020000c3", hex_format)
+
+    serialized = jsonable_encoder(hex_string)
+
+    assert serialized == {
+        "value": "6881631900003c20020000c3",
+        "hex_format": hex_format,
+        "format_spec": ">BIHBBBBB",
+        "unpacked_data": hex_string.unpacked_data,
+    }
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_struct_hex_strings_decoded_in_batch(mocker, hex_format, use_numpy):
+    values = ["6881631900003c20020000c3", "0100000001000aff010203ff"]
+    expected = [StructHexString(v, hex_format).unpacked_data for v in values]
+    decoder = get_struct_hex_decoder(hex_format)
+    if use_numpy:
+        pytest.importorskip("numpy")
+        assert decoder.numpy_dtype is not None  # Decoded with a structured array
+    else:
+        mocker.patch.object(decoder, "numpy_dtype", None)
+
+    hex_strings = StructHexString.decode_many(values, hex_format)
+
+    assert [h.value for h in hex_strings] == values
+    assert [h.unpacked_data for h in hex_strings] == expected
+
+
+def test_struct_hex_strings_decoded_in_batch_with_invalid_length(hex_format):
+    with pytest.raises(ValueError):
+        StructHexString.decode_many(["6881631900003c20020000c3", "6881"], hex_format)
+
+
+def test_jq_programs_are_compiled_once(mocker):
+    jq_filter = '{"source": .device, "value": .value}'
+    get_jq_program.cache_clear()
+    compile_spy = mocker.spy(pyjq, "compile")
+
+    config = GenericJsonTransformConfig(jq_filter=jq_filter, output_type="obv")
+    first = config.transform({"device": "d1", "value": 1})
+    second = config.transform({"device": "d2", "value": 2})
+
+    assert first == [{"source": "d1", "value": 1}]
+    assert second == [{"source": "d2", "value": 2}]
+    assert compile_spy.call_count == 1
+
+
+def test_jq_transform_many():
+    items = [{"device": "d1", "values": [1, 2]}, {"device": "d2", "values": [3]}]
+
+    results = jq_transform_many('.values[] as $v | {"source": .device, "value": $v}', items)
+
+    assert results == [
+        {"source": "d1", "value": 1},
+        {"source": "d1", "value": 2},
+        {"source": "d2", "value": 3},
+    ]
+
+
+def test_stage_timings_exclude_nested_stages(mocker):
+    clock = mocker.patch("app.services.utils.time.perf_counter")
+    clock.side_effect = [0.0, 1.0, 1.5, 2.0, 3.0, 3.0]
+    timings = StageTimings.start()
+
+    with timings.stage("fetch"):  # 1.0 -> 3.0
+        with timed_stage("parse"):  # 1.5 -> 2.0
+            pass
+
+    assert timings.as_dict() == {"fetch": 1500.0, "parse": 500.0, "total": 3000.0}
+
+
+def test_timed_stage_without_timings():
+    def parse():
+        with timed_stage("parse"):  # Nothing to record, e.g. when the client is used outside an action
+            return 1
+
+    assert contextvars.Context().run(parse) == 1
+
+
+def test_lazy_instance_created_on_first_use(mocker):
+    factory = mocker.Mock()
+    lazy_client = LazyInstance(factory, host="localhost")
+
+    assert not lazy_client.created
+    assert not factory.called
+
+    lazy_client.get(1)
+    lazy_client.get(2)
+
+    factory.assert_called_once_with(host="localhost")
+    assert lazy_client.created
+    assert factory.return_value.get.call_count == 2
@@ -1,26 +1,46 @@
+import asyncio
 import base64
+import copy
 import json
+from collections import OrderedDict
+import types
 from unittest.mock import ANY
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 
-from app.conftest import MockWebhookPayloadModel, MockWebhookConfigModel
+from app.conftest import async_return, MockWebhookPayloadModel, MockWebhookConfigModel
 from app.main import app
-from app.webhooks import GenericJsonTransformConfig
+from app.services.utils import DyntamicFactory, StructHexString
+from app.services.webhooks import (
+    get_dynamic_payload_model, decode_hex_strings_in_batch, get_integration_details, clear_integrations_cache,
+    WebhookBatcher, WebhookWorkerPool, process_webhook
+)
+from app.services.errors import WebhookQueueFull, WebhookQueueClosed
+from app.webhooks import GenericJsonTransformConfig, GenericJsonPayload
+from app.webhooks.core import get_webhook_handler, reload_webhook_handler
 
 api_client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def clean_integrations_cache():
+    clear_integrations_cache()
+    yield
+    clear_integrations_cache()
+
+
 @pytest.mark.asyncio
 async def test_process_webhook_request_with_fixed_schema(
-        mocker, integration_v2_with_webhook, mock_gundi_client_v2_for_webhooks, mock_publish_event,
+        mocker, integration_v2_with_webhook, mock_config_manager_for_webhooks, mock_publish_event,
         mock_get_webhook_handler_for_fixed_json_payload, mock_webhook_handler,
         mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_fixed_schema
 ):
     mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_fixed_json_payload)
-    mocker.patch("app.services.webhooks._portal", mock_gundi_client_v2_for_webhooks)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks)
 
+    mocker.patch("app.routers.webhooks.settings.PROCESS_WEBHOOKS_IN_BACKGROUND", False)
     response = api_client.post(
         "/webhooks",
         headers=mock_webhook_request_headers_onyesha,
@@ -28,7 +48,7 @@ async def test_process_webhook_request_with_fixed_schema(
     )
 
     assert response.status_code == 200
-    assert mock_gundi_client_v2_for_webhooks.get_integration_details.called
+    assert mock_config_manager_for_webhooks.get_integration_details.called
     assert mock_get_webhook_handler_for_fixed_json_payload.called
     expected_payload = MockWebhookPayloadModel.parse_obj(mock_webhook_request_payload_for_fixed_schema)
     expected_config = MockWebhookConfigModel.parse_obj(integration_v2_with_webhook.webhook_configuration.data)
@@ -41,13 +61,14 @@ async def test_process_webhook_request_with_fixed_schema(
 
 @pytest.mark.asyncio
 async def test_process_webhook_request_with_dynamic_schema(
-        mocker, integration_v2_with_webhook_generic, mock_gundi_client_v2_for_webhooks_generic, mock_publish_event,
+        mocker, integration_v2_with_webhook_generic, mock_config_manager_for_webhooks_generic, mock_publish_event,
         mock_get_webhook_handler_for_generic_json_payload, mock_webhook_handler,
         mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_dynamic_schema
 ):
     mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_generic_json_payload)
-    mocker.patch("app.services.webhooks._portal", mock_gundi_client_v2_for_webhooks_generic)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks_generic)
 
+    mocker.patch("app.routers.webhooks.settings.PROCESS_WEBHOOKS_IN_BACKGROUND", False)
     response = api_client.post(
         "/webhooks",
         headers=mock_webhook_request_headers_onyesha,
@@ -55,7 +76,7 @@ async def test_process_webhook_request_with_dynamic_schema(
     )
 
     assert response.status_code == 200
-    assert mock_gundi_client_v2_for_webhooks_generic.get_integration_details.called
+    assert mock_config_manager_for_webhooks_generic.get_integration_details.called
     assert mock_get_webhook_handler_for_generic_json_payload.called
     expected_config = GenericJsonTransformConfig.parse_obj(integration_v2_with_webhook_generic.webhook_configuration.data)
     mock_webhook_handler.assert_called_once_with(
@@ -65,3 +86,265 @@ async def test_process_webhook_request_with_dynamic_schema(
     )
 
 
+def test_dynamic_payload_models_are_cached_by_schema(mocker, mock_generic_webhook_config):
+    json_schema = mock_generic_webhook_config["json_schema"]
+    mocker.patch("app.services.webhooks._dynamic_models_cache", OrderedDict())
+    make_spy = mocker.spy(DyntamicFactory, "make")
+
+    model = get_dynamic_payload_model(json_schema=json_schema, base_model=GenericJsonPayload)
+    same_model = get_dynamic_payload_model(json_schema=copy.deepcopy(json_schema), base_model=GenericJsonPayload)
+    other_model = get_dynamic_payload_model(
+        json_schema={**json_schema, "title": "OtherSchema"}, base_model=GenericJsonPayload
+    )
+
+    assert model is same_model
+    assert other_model is not model
+    assert make_spy.call_count == 2
+
+
+def test_hex_strings_in_list_payloads_are_decoded_in_batch(mocker):
+    hex_format = {"byte_order": ">", "fields": [{"name": "a", "format": "B"}, {"name": "b", "format": "H"}]}
+    items = [{"device": "d1", "data": "010002"}, {"device": "d2", "data": "020003"}]
+    decode_many_spy = mocker.spy(StructHexString, "decode_many")
+
+    decode_hex_strings_in_batch(items, hex_data_field="data", hex_format=hex_format)
+
+    assert decode_many_spy.call_count == 1
+    assert [item["data"].unpacked_data for item in items] == [{"a": 1, "b": 2}, {"a": 2, "b": 3}]
+    assert all(item["hex_format"] is hex_format and item["hex_data_field"] == "data" for item in items)
+
+
+def test_hex_strings_in_list_payloads_with_errors_are_left_for_validation():
+    hex_format = {"byte_order": ">", "fields": [{"name": "a", "format": "B"}, {"name": "b", "format": "H"}]}
+    items = [{"device": "d1", "data": "010002"}, {"device": "d2", "data": "zz"}]
+
+    decode_hex_strings_in_batch(items, hex_data_field="data", hex_format=hex_format)
+
+    assert [item["data"] for item in items] == ["010002", "zz"]
+
+
+@pytest.mark.asyncio
+async def test_webhook_integration_lookups_are_cached(
+        mocker, integration_v2_with_webhook, mock_config_manager_for_webhooks
+):
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks)
+    integration_id = str(integration_v2_with_webhook.id)
+
+    integration = await get_integration_details(integration_id)
+    cached_integration = await get_integration_details(integration_id)
+
+    assert integration == integration_v2_with_webhook
+    assert cached_integration is integration
+    mock_config_manager_for_webhooks.get_integration_details.assert_called_once_with(integration_id)
+
+
+@pytest.mark.asyncio
+async def test_webhook_lookups_of_unknown_integrations_are_cached(mocker):
+    not_found_error = httpx.HTTPStatusError(
+        "Not Found", request=httpx.Request("GET", "https://gundi"), response=httpx.Response(404)
+    )
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.side_effect = not_found_error
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager)
+
+    assert await get_integration_details("unknown-id") is None
+    assert await get_integration_details("unknown-id") is None
+    assert mock_config_manager.get_integration_details.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_webhook_lookup_errors_are_not_cached(mocker, integration_v2_with_webhook):
+    mock_config_manager = mocker.MagicMock()
+    mock_config_manager.get_integration_details.side_effect = [
+        httpx.ConnectError("Connection refused"), async_return(integration_v2_with_webhook)
+    ]
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager)
+    integration_id = str(integration_v2_with_webhook.id)
+
+    with pytest.raises(httpx.ConnectError):
+        await get_integration_details(integration_id)
+    assert await get_integration_details(integration_id) == integration_v2_with_webhook
+
+
+def test_webhook_handler_is_resolved_once(mocker):
+    async def webhook_handler(payload: MockWebhookPayloadModel, integration=None, webhook_config: MockWebhookConfigModel = None):
+        pass
+    mock_importlib = mocker.patch("app.webhooks.core.importlib")
+    mock_import_module = mock_importlib.import_module
+    mock_import_module.return_value.webhook_handler = webhook_handler
+    get_webhook_handler.cache_clear()
+
+    try:
+        handler = get_webhook_handler()
+        assert get_webhook_handler() is handler
+        assert handler == (webhook_handler, MockWebhookPayloadModel, MockWebhookConfigModel)
+        assert mock_import_module.call_count == 1
+        # The handler is resolved again after a reload
+        reload_webhook_handler()
+        assert mock_import_module.call_count == 3  # Imported to reload it, and to resolve the handler
+        assert mock_importlib.reload.called
+    finally:
+        get_webhook_handler.cache_clear()
+
+
+def test_missing_webhook_handler_is_resolved_once(mocker):
+    mock_importlib = mocker.patch("app.webhooks.core.importlib")
+    mock_import_module = mock_importlib.import_module
+    mock_import_module.return_value = types.ModuleType("app.webhooks.handlers")  # No webhook_handler
+    get_webhook_handler.cache_clear()
+
+    try:
+        assert get_webhook_handler() is None
+        assert get_webhook_handler() is None
+        assert mock_import_module.call_count == 1
+    finally:
+        get_webhook_handler.cache_clear()
+
+
+def test_webhook_handler_import_errors_are_raised(mocker):
+    mock_importlib = mocker.patch("app.webhooks.core.importlib")
+    mock_importlib.import_module.side_effect = ImportError("No module named 'missing_dependency'")
+    get_webhook_handler.cache_clear()
+
+    try:
+        with pytest.raises(ImportError):
+            get_webhook_handler()
+    finally:
+        get_webhook_handler.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_without_handler(
+        mocker, integration_v2_with_webhook, mock_publish_event
+):
+    mocker.patch("app.services.webhooks.get_integration", return_value=integration_v2_with_webhook)
+    mocker.patch("app.services.webhooks.get_webhook_handler", return_value=None)
+    mocker.patch("app.services.webhooks.publish_event", mock_publish_event)
+
+    await process_webhook(request=mocker.MagicMock(), body=b"{}")
+
+    assert mock_publish_event.called
+    event = mock_publish_event.call_args.kwargs["event"]
+    assert "Webhooks handler not found" in event.payload.error
+
+
+@pytest.mark.asyncio
+async def test_webhook_batcher_flushes_full_batches(
+        mocker, integration_v2_with_webhook, mock_get_webhook_handler_for_fixed_json_payload, mock_webhook_handler
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_fixed_json_payload)
+    batcher = WebhookBatcher(max_size=3, max_wait=60)
+    webhook_config = MockWebhookConfigModel.parse_obj(integration_v2_with_webhook.webhook_configuration.data)
+
+    await batcher.add(integration=integration_v2_with_webhook, webhook_config=webhook_config, payload={"id": 1})
+    assert not mock_webhook_handler.called
+    await batcher.add(integration=integration_v2_with_webhook, webhook_config=webhook_config, payload=[{"id": 2}, {"id": 3}])
+
+    mock_webhook_handler.assert_called_once_with(
+        payload=[{"id": 1}, {"id": 2}, {"id": 3}],
+        integration=integration_v2_with_webhook,
+        webhook_config=webhook_config
+    )
+    assert not batcher._timers
+
+
+@pytest.mark.asyncio
+async def test_webhook_batcher_flushes_batches_after_max_wait(
+        mocker, integration_v2_with_webhook, mock_get_webhook_handler_for_fixed_json_payload, mock_webhook_handler
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_fixed_json_payload)
+    batcher = WebhookBatcher(max_size=100, max_wait=0.01)
+
+    await batcher.add(integration=integration_v2_with_webhook, webhook_config={}, payload={"id": 1})
+    await batcher.add(integration=integration_v2_with_webhook, webhook_config={}, payload={"id": 2})
+    await asyncio.sleep(0.05)
+
+    mock_webhook_handler.assert_called_once_with(
+        payload=[{"id": 1}, {"id": 2}], integration=integration_v2_with_webhook, webhook_config={}
+    )
+
+
+@pytest.mark.asyncio
+async def test_process_webhook_request_with_batching_enabled(
+        mocker, integration_v2_with_webhook, mock_config_manager_for_webhooks, mock_publish_event,
+        mock_get_webhook_handler_for_fixed_json_payload, mock_webhook_handler,
+        mock_webhook_request_headers_onyesha, mock_webhook_request_payload_for_fixed_schema
+):
+    mocker.patch("app.services.webhooks.get_webhook_handler", mock_get_webhook_handler_for_fixed_json_payload)
+    mocker.patch("app.services.webhooks.config_manager", mock_config_manager_for_webhooks)
+    mocker.patch("app.services.webhooks.settings.WEBHOOK_BATCHING_ENABLED", True)
+    mock_batcher = mocker.MagicMock()
+    mock_batcher.add.return_value = async_return(None)
+    mocker.patch("app.services.webhooks.webhook_batcher", mock_batcher)
+
+    mocker.patch("app.routers.webhooks.settings.PROCESS_WEBHOOKS_IN_BACKGROUND", False)
+    response = api_client.post(
+        "/webhooks",
+        headers=mock_webhook_request_headers_onyesha,
+        json=mock_webhook_request_payload_for_fixed_schema,
+    )
+
+    assert response.status_code == 200
+    assert not mock_webhook_handler.called
+    mock_batcher.add.assert_called_once_with(
+        integration=integration_v2_with_webhook,
+        webhook_config=MockWebhookConfigModel.parse_obj(integration_v2_with_webhook.webhook_configuration.data),
+        payload=MockWebhookPayloadModel.parse_obj(mock_webhook_request_payload_for_fixed_schema)
+    )
+
+
+@pytest.mark.asyncio
+async def test_webhook_worker_pool_processes_jobs_in_background():
+    pool = WebhookWorkerPool(workers=2, max_queue_size=10)
+    processed = []
+
+    async def job(value):
+        processed.append(value)
+
+    for i in range(5):
+        pool.submit(job, value=i)
+    await pool.stop()  # Pending jobs are processed before stopping
+
+    assert sorted(processed) == [0, 1, 2, 3, 4]
+    with pytest.raises(WebhookQueueClosed):
+        pool.submit(job, value=5)
+
+
+@pytest.mark.asyncio
+async def test_webhook_worker_pool_rejects_jobs_when_the_queue_is_full():
+    pool = WebhookWorkerPool(workers=1, max_queue_size=1)
+    release = asyncio.Event()
+
+    async def job():
+        await release.wait()
+
+    pool.submit(job)
+    await asyncio.sleep(0)  # The worker takes the first job
+    pool.submit(job)  # Queued
+    with pytest.raises(WebhookQueueFull):
+        pool.submit(job)
+    release.set()
+    await pool.stop()
+
+
+def test_webhook_requests_are_rejected_when_the_queue_is_full(mocker, mock_webhook_request_headers_onyesha):
+    mocker.patch("app.routers.webhooks.settings.PROCESS_WEBHOOKS_IN_BACKGROUND", True)
+    mock_pool = mocker.MagicMock()
+    mock_pool.submit.side_effect = WebhookQueueFull("The webhooks queue is full")
+    mocker.patch("app.routers.webhooks.webhook_worker_pool", mock_pool)
+
+    response = api_client.post("/webhooks", headers=mock_webhook_request_headers_onyesha, json={"device": "d1"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_webhook_workers_get_the_request_body(mocker, mock_webhook_request_headers_onyesha):
+    mocker.patch("app.routers.webhooks.settings.PROCESS_WEBHOOKS_IN_BACKGROUND", True)
+    mock_pool = mocker.MagicMock()
+    mocker.patch("app.routers.webhooks.webhook_worker_pool", mock_pool)
+
+    response = api_client.post("/webhooks", headers=mock_webhook_request_headers_onyesha, json={"device": "d1"})
+
+    assert response.status_code == 200
+    assert json.loads(mock_pool.submit.call_args.kwargs["body"]) == {"device": "d1"}
@@ -0,0 +1,252 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import redis.asyncio as redis
+from app import settings
+from .errors import CircuitBreakerOpen
+from .utils import LazyInstance
+
+
+logger = logging.getLogger(__name__)
+# (lease key, fencing token) of the lease held by the running action, see ActionLease.hold()
+_current_lease = contextvars.ContextVar("current_lease", default=None)
+
+
+class TokenBucketRateLimiter:
+    """
+    In-process token bucket, one bucket per key (e.g. per third-party account).
+    Callers wait until a token is available instead of failing.
+    Buckets that are full again are the same as new ones, so they are evicted to keep memory bounded.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, last refill time)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Time for an empty bucket to be full again
+        self._idle_after = max(capacity / rate, 1.0) if rate > 0 else 0.0
+        self._last_eviction = time.monotonic()
+
+    def _refill(self, key: str) -> float:
+        now = time.monotonic()
+        tokens, last_refill = self._buckets.get(key, (float(self.capacity), now))
+        tokens = min(float(self.capacity), tokens + (now - last_refill) * self.rate)
+        self._buckets[key] = (tokens, now)
+        return tokens
+
+    def _evict_idle_buckets(self):
+        now = time.monotonic()
+        if now - self._last_eviction < self._idle_after:
+            return
+        self._last_eviction = now
+        for key, (tokens, last_refill) in list(self._buckets.items()):
+            if tokens + (now - last_refill) * self.rate < self.capacity:
+                continue
+            if (lock := self._locks.get(key)) is not None and lock.locked():
+                continue
+            del self._buckets[key]
+            self._locks.pop(key, None)
+
+    async def acquire(self, key: str):
+        if self.rate <= 0:  # Rate limiting disabled
+            return
+        self._evict_idle_buckets()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:  # Waiters are served in order
+            while (tokens := self._refill(key)) < 1:
+                await asyncio.sleep((1 - tokens) / self.rate)
+            self._buckets[key] = (tokens - 1, self._buckets[key][1])
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with its state saved in Redis, so it's shared by all the replicas of the service.
+    - closed: requests go through, failures are counted.
+    - open: requests fail fast with CircuitBreakerOpen until the recovery timeout elapses.
+    - half_open: a single trial request is let through; success closes the circuit, failure opens it again.
+    Redis errors never block requests (the breaker fails open).
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, **kwargs):
+        host = kwargs.get("host", settings.REDIS_HOST)
+        port = kwargs.get("port", settings.REDIS_PORT)
+        db = kwargs.get("db", settings.REDIS_STATE_DB)
+        self.failure_threshold = kwargs.get("failure_threshold", 5)
+        self.recovery_timeout = kwargs.get("recovery_timeout", 60)  # Seconds
+        self.db_client = kwargs.get("db_client") or LazyInstance(redis.Redis, host=host, port=port, db=db)
+
+    def _get_circuit_key(self, name: str) -> str:
+        return f"circuit_breaker.{name}"
+
+    def _get_trial_key(self, name: str) -> str:
+        return f"circuit_breaker.{name}.trial"
+
+    async def get_state(self, name: str) -> dict:
+        data = await self.db_client.hgetall(self._get_circuit_key(name))
+        data = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v for k, v in data.items()}
+        return {
+            "state": data.get("state", self.CLOSED),
+            "failures": int(data.get("failures", 0)),
+            "opened_at": float(data.get("opened_at", 0)),
+        }
+
+    async def before_request(self, name: str):
+        try:
+            circuit = await self.get_state(name)
+            if circuit["state"] == self.CLOSED:
+                return
+            retry_after = circuit["opened_at"] + self.recovery_timeout - time.time()
+            if circuit["state"] == self.OPEN and retry_after > 0:
+                raise CircuitBreakerOpen(f"Circuit '{name}' is open. Retry in {retry_after:.0f} seconds.")
+            # Let a single trial request through, across all replicas
+            if not await self.db_client.set(self._get_trial_key(name), 1, nx=True, ex=self.recovery_timeout):
+                raise CircuitBreakerOpen(f"Circuit '{name}' is half-open and a trial request is in progress.")
+            await self.db_client.hset(self._get_circuit_key(name), "state", self.HALF_OPEN)
+        except redis.RedisError as e:
+            logger.warning(f"Error reading circuit breaker '{name}' state: {e}")
+
+    async def record_success(self, name: str):
+        try:
+            await self.db_client.delete(self._get_circuit_key(name), self._get_trial_key(name))
+        except redis.RedisError as e:
+            logger.warning(f"Error resetting circuit breaker '{name}': {e}")
+
+    async def release_trial(self, name: str):
+        # For trial requests that ended without telling whether the upstream is healthy, so another one is let through
+        try:
+            await self.db_client.delete(self._get_trial_key(name))
+        except redis.RedisError as e:
+            logger.warning(f"Error releasing the trial request of circuit breaker '{name}': {e}")
+
+    async def record_failure(self, name: str):
+        key = self._get_circuit_key(name)
+        try:
+            failures = await self.db_client.hincrby(key, "failures", 1)
+            state = await self.db_client.hget(key, "state")
+            state = state.decode() if isinstance(state, bytes) else state
+            if failures >= self.failure_threshold or state == self.HALF_OPEN:
+                logger.warning(f"Opening circuit '{name}' after {failures} consecutive failures.")
+                await self.db_client.hset(key, mapping={"state": self.OPEN, "opened_at": time.time()})
+                await self.db_client.delete(self._get_trial_key(name))
+            # Forget old failures if the circuit isn't used for a while
+            await self.db_client.expire(key, max(self.recovery_timeout * 10, 600))
+        except redis.RedisError as e:
+            logger.warning(f"Error recording failure in circuit breaker '{name}': {e}")
+
+    def __str__(self):
+        return f"CircuitBreaker(failure_threshold={self.failure_threshold}, recovery_timeout={self.recovery_timeout})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ActionLease:
+    """
+    Distributed lease per name (e.g. integration and action) saved in Redis, so the same action doesn't run
+    more than once at the same time across all the replicas of the service.
+    Each acquisition gets a fencing token from an increasing counter, and the lease is only released by its holder.
+    Leases expire after the ttl in case the holder dies. While the lease is held (see hold()), state writes check
+    the token in Redis, so a holder whose lease expired can't overwrite the state saved by the next holder.
+    Redis errors never block actions: the lease fails open with token 0, and those runs aren't fenced.
+    """
+    RELEASE_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, **kwargs):
+        host = kwargs.get("host", settings.REDIS_HOST)
+        port = kwargs.get("port", settings.REDIS_PORT)
+        db = kwargs.get("db", settings.REDIS_STATE_DB)
+        self.ttl = kwargs.get("ttl", 600)  # Seconds
+        self.db_client = kwargs.get("db_client") or LazyInstance(redis.Redis, host=host, port=port, db=db)
+
+    def _get_lease_key(self, name: str) -> str:
+        return f"action_lease.{name}"
+
+    def _get_fencing_key(self, name: str) -> str:
+        return f"action_lease.{name}.fencing"
+
+    def _get_pending_key(self, name: str) -> str:
+        return f"action_lease.{name}.pending"
+
+    async def acquire(self, name: str) -> Optional[int]:
+        """
+        Returns the fencing token, or None if the lease is held by someone else.
+        """
+        try:
+            token = await self.db_client.incr(self._get_fencing_key(name))
+            if await self.db_client.set(self._get_lease_key(name), token, nx=True, ex=self.ttl):
+                return token
+            return None
+        except redis.RedisError as e:
+            logger.warning(f"Error acquiring lease '{name}': {e}")
+            return 0  # No holder can release a lease with token 0
+
+    async def wait(self, name: str, timeout: float, interval: float = 1.0) -> Optional[int]:
+        """
+        Waits until the lease is acquired and returns the fencing token, or None if it's still held after the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while (token := await self.acquire(name)) is None and time.monotonic() < deadline:
+            await asyncio.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        return token
+
+    async def release(self, name: str, token: int):
+        try:  # Compare and delete, so an expired holder doesn't release the lease of the next one
+            await self.db_client.eval(self.RELEASE_SCRIPT, 1, self._get_lease_key(name), token)
+        except redis.RedisError as e:
+            logger.warning(f"Error releasing lease '{name}': {e}")
+
+    @contextlib.contextmanager
+    def hold(self, name: str, token: int):
+        """
+        Marks the lease as held by the code running in this context, so its state writes are fenced with the token.
+        """
+        if not token:  # Failed open, there's no lease to check
+            yield
+            return
+        reset_token = _current_lease.set((self._get_lease_key(name), token))
+        try:
+            yield
+        finally:
+            _current_lease.reset(reset_token)
+
+    async def add_pending(self, name: str, data: dict):
+        """
+        Records a run requested while the lease was held. Pending runs are coalesced, the latest data is kept.
+        """
+        try:
+            await self.db_client.set(self._get_pending_key(name), json.dumps(data, default=str), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Error saving pending run for lease '{name}': {e}")
+
+    async def pop_pending(self, name: str) -> Optional[dict]:
+        try:
+            data = await self.db_client.getdel(self._get_pending_key(name))
+        except redis.RedisError as e:
+            logger.warning(f"Error reading pending run for lease '{name}': {e}")
+            return None
+        return json.loads(data) if data else None
+
+    def __str__(self):
+        return f"ActionLease(ttl={self.ttl})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def get_current_lease() -> Optional[Tuple[str, int]]:
+    """Returns the (lease key, fencing token) of the lease held by the running action, if any."""
+    return _current_lease.get()
@@ -0,0 +1,75 @@
+"""
+OpenTelemetry tracing. Spans are no-ops until configure_tracing() sets a tracer provider (TRACING_ENABLED).
+The trace context is propagated in the attributes of the Pub/Sub messages, so traces continue across services.
+"""
+import functools
+import logging
+from typing import Optional
+
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+from app import settings
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer("gundi-integration-action-runner")
+
+
+def _get_span_exporter():
+    if settings.TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    # Google Cloud Trace, requires opentelemetry-exporter-gcp-trace
+    from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+    return CloudTraceSpanExporter(project_id=settings.GCP_PROJECT_ID)
+
+
+def configure_tracing():
+    if not settings.TRACING_ENABLED or isinstance(trace.get_tracer_provider(), TracerProvider):
+        return  # Disabled or already configured
+    try:
+        exporter = _get_span_exporter()
+    except ImportError as e:
+        logger.error(f"Tracing is disabled, the exporter for '{settings.TRACING_EXPORTER}' is not installed: {e}")
+        return
+    resource = Resource.create({
+        "service.name": settings.INTEGRATION_TYPE_SLUG or "gundi-integration-action-runner",
+        "environment": settings.TRACE_ENVIRONMENT,
+    })
+    provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATE)))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing enabled. Exporter: {settings.TRACING_EXPORTER}, sample rate: {settings.TRACING_SAMPLE_RATE}")
+
+
+def shutdown_tracing():
+    # Exports the spans still buffered
+    if isinstance(provider := trace.get_tracer_provider(), TracerProvider):
+        provider.shutdown()
+
+
+def inject_trace_context(carrier: dict = None) -> dict:
+    """Adds the current trace context (the 'traceparent' header) to the carrier, e.g. the attributes of a message."""
+    carrier = {} if carrier is None else carrier
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract_trace_context(carrier: Optional[dict]) -> Optional[context.Context]:
+    """Returns the trace context propagated in the carrier, or None to continue the current trace."""
+    return propagate.extract(carrier) if carrier else None
+
+
+def traced(name: str, **attributes):
+    """
+    Decorator for coroutine functions, runs each call in a span. Exceptions are recorded in the span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name, attributes=attributes):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
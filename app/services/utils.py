@@ -1,10 +1,26 @@
+import contextlib
+import contextvars
+import functools
 import struct
+import time
 import typing
+import pyjq
 from pydantic import create_model, BaseModel
 from pydantic.fields import Field, FieldInfo, Undefined, NoArgAnyCallable
 from typing import Any, Dict, Optional, Union, List, Annotated
 
 
+@functools.lru_cache(maxsize=None)
+def _import_numpy():
+    # Used for vectorized decoding of hex string batches, the struct fallback is kept for custom builds without it.
+    # Imported on first use as it takes a good part of the service startup time.
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover
+        return None
+    return numpy
+
+
 def find_config_for_action(configurations, action_id):
     return next(
         (
@@ -15,12 +31,149 @@ def find_config_for_action(configurations, action_id):
     )
 
 
+def _get_output_cast(output_type="hex"):
+    if output_type == "bool":
+        return bool
+    elif output_type == "int":
+        return int
+    else:  # hex string by default
+        return hex
+
+
+# struct format characters (standard sizes) and their numpy equivalents
+NUMPY_TYPES = {
+    "b": "i1", "B": "u1", "?": "?", "h": "i2", "H": "u2", "i": "i4", "I": "u4", "l": "i4", "L": "u4",
+    "q": "i8", "Q": "u8", "e": "f2", "f": "f4", "d": "f8",
+}
+NUMPY_BYTE_ORDERS = {"<": "<", ">": ">", "!": ">", "=": "="}
+
+
+def _get_numpy_dtype(byte_order: str, formats: List[str]):
+    # Only single-char formats with standard sizes are supported, other specs are decoded with struct
+    if byte_order not in NUMPY_BYTE_ORDERS or any(f not in NUMPY_TYPES for f in formats):
+        return None
+    if (np := _import_numpy()) is None:
+        return None
+    return np.dtype([(f"f{i}", NUMPY_BYTE_ORDERS[byte_order] + NUMPY_TYPES[f]) for i, f in enumerate(formats)])
+
+
+class StructHexDecoder:
+    """
+    Compiled decoder for a hex_format spec: holds the struct.Struct and the bit field masks & shifts.
+    Use get_struct_hex_decoder() to get a cached instance.
+    """
+
+    def __init__(self, hex_format: dict):
+        fields = hex_format["fields"]
+        byte_order = hex_format.get("byte_order", "<")
+        self.format_spec = byte_order + ''.join(f["format"] for f in fields)
+        self.struct = struct.Struct(self.format_spec)
+        self.size = self.struct.size
+        self.numpy_dtype = _get_numpy_dtype(byte_order, [f["format"] for f in fields])
+        self.fields = [(f["name"], _get_output_cast(f.get("output_type", "int"))) for f in fields]
+        # (index of the source field, name, shift, mask, output cast)
+        field_indexes = {}
+        for i, f in enumerate(fields):
+            field_indexes.setdefault(f["name"], i)
+        self.bit_fields = [
+            (
+                field_indexes[f["name"]],
+                bit_field["name"],
+                bit_field["start_bit"],
+                2 ** (bit_field["end_bit"] - bit_field["start_bit"] + 1) - 1,
+                _get_output_cast(bit_field.get("output_type", "bool"))
+            )
+            for f in fields if "bit_fields" in f
+            for bit_field in f["bit_fields"]
+        ]
+
+    def unpack(self, bytes_data: bytes) -> dict:
+        return self._cast_fields(self.struct.unpack(bytes_data))
+
+    def unpack_many(self, bytes_data: bytes) -> List[dict]:
+        """
+        Decodes a buffer with many records of this format concatenated.
+        Uses a numpy structured array when numpy is available and the format is supported.
+        """
+        if len(bytes_data) % self.size:
+            raise ValueError(f"Buffer size is not a multiple of the record size ({self.size}) for format '{self.format_spec}'")
+        if self.numpy_dtype is None:
+            return [self._cast_fields(unpacked) for unpacked in self.struct.iter_unpack(bytes_data)]
+        records = _import_numpy().frombuffer(bytes_data, dtype=self.numpy_dtype)
+        columns = {}
+        for i, (name, cast) in enumerate(self.fields):
+            columns[name] = [cast(v) for v in records[f"f{i}"].tolist()]
+        for index, name, shift, mask, cast in self.bit_fields:  # Vectorized bit field extraction
+            columns[name] = [cast(v) for v in ((records[f"f{index}"] >> shift) & mask).tolist()]
+        names = list(columns.keys())
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+    def _cast_fields(self, unpacked_fields: tuple) -> dict:
+        unpacked_data = {}
+        for (name, cast), value in zip(self.fields, unpacked_fields):
+            unpacked_data[name] = cast(value)
+        for index, name, shift, mask, cast in self.bit_fields:
+            unpacked_data[name] = cast((unpacked_fields[index] >> shift) & mask)
+        return unpacked_data
+
+
+def _get_hex_format_key(hex_format: dict) -> tuple:
+    # Hashable representation of the hex_format spec, cheaper to build than serializing it
+    return (
+        hex_format.get("byte_order", "<"),
+        tuple(
+            (
+                f["name"],
+                f["format"],
+                f.get("output_type", "int"),
+                tuple(
+                    (b["name"], b["start_bit"], b["end_bit"], b.get("output_type", "bool"))
+                    for b in f.get("bit_fields", ())
+                )
+            )
+            for f in hex_format["fields"]
+        )
+    )
+
+
+STRUCT_HEX_DECODERS_CACHE_SIZE = 256
+_struct_hex_decoders: typing.Dict[tuple, StructHexDecoder] = {}
+
+
+def get_struct_hex_decoder(hex_format: dict) -> StructHexDecoder:
+    key = _get_hex_format_key(hex_format)
+    if (decoder := _struct_hex_decoders.get(key)) is None:
+        decoder = StructHexDecoder(hex_format)
+        if len(_struct_hex_decoders) >= STRUCT_HEX_DECODERS_CACHE_SIZE:
+            _struct_hex_decoders.pop(next(iter(_struct_hex_decoders)))
+        _struct_hex_decoders[key] = decoder
+    return decoder
+
+
 class StructHexString:
-    def __init__(self, value: str, hex_format):
+    def __init__(
+            self, value: str, hex_format, bytes_data: bytes = None, decoder: StructHexDecoder = None,
+            unpacked_data: dict = None
+    ):
         self.value = value
         self.hex_format = hex_format
-        self.format_spec = hex_format.get("byte_order", "<") + ''.join(f["format"] for f in hex_format["fields"])
-        self.unpacked_data = self._unpack_data()
+        decoder = decoder or get_struct_hex_decoder(hex_format)
+        self.format_spec = decoder.format_spec
+        if unpacked_data is None:
+            unpacked_data = decoder.unpack(bytes_data if bytes_data is not None else bytes.fromhex(value))
+        self.unpacked_data = unpacked_data
+
+    @classmethod
+    def decode_many(cls, values: List[str], hex_format: dict) -> List["StructHexString"]:
+        """Decodes many hex strings with the same format at once (see StructHexDecoder.unpack_many)"""
+        decoder = get_struct_hex_decoder(hex_format)
+        if any(len(v) != decoder.size * 2 for v in values):
+            raise ValueError("Hex string does not match the expected length for format")
+        unpacked_records = decoder.unpack_many(bytes.fromhex("".join(values)))
+        return [
+            cls(value, hex_format, decoder=decoder, unpacked_data=unpacked_data)
+            for value, unpacked_data in zip(values, unpacked_records)
+        ]
 
     @classmethod
     def __get_validators__(cls):
@@ -29,46 +182,23 @@ class StructHexString:
     @classmethod
     def validate(cls, v: str, values, field):
         hex_format = values['hex_format']  # Assumes format is already set in the parent model
-        format_spec = hex_format.get("byte_order", "<") + ''.join(d["format"] for d in hex_format["fields"])
+        if isinstance(v, cls) and v.hex_format == hex_format:  # Already decoded (e.g. in a batch)
+            return v
         try:
+            decoder = get_struct_hex_decoder(hex_format)
             bytes_data = bytes.fromhex(v)
-            if len(bytes_data) != struct.calcsize(format_spec):
+            if len(bytes_data) != decoder.size:
                 raise ValueError("Hex string does not match the expected length for format")
         except (ValueError, struct.error) as e:
+            format_spec = hex_format.get("byte_order", "<") + ''.join(d["format"] for d in hex_format["fields"])
             raise ValueError(f"Invalid hex string for format '{format_spec}': {str(e)}")
 
-        return cls(v, hex_format)
+        return cls(v, hex_format, bytes_data=bytes_data, decoder=decoder)
 
     @classmethod
     def __modify_schema__(cls, field_schema):
         field_schema.update(type="hex_string", example="123456789ABCDEF", description="Hex string data")
 
-    def _unpack_data(self):
-        field_values = []
-        unpacked_fields = struct.unpack(self.format_spec, bytes.fromhex(self.value))
-        for s, v in zip(self.hex_format["fields"], unpacked_fields):
-            field_values.append(self._cast_output(value=v, output_type=s.get("output_type", "int")))
-        field_names = [f["name"] for f in self.hex_format["fields"]]
-        fields_with_bitfields = [f for f in self.hex_format["fields"] if "bit_fields" in f]
-        for field in fields_with_bitfields:
-            bit_fields = field["bit_fields"]
-            for bit_field in bit_fields:
-                start_bit = bit_field["start_bit"]
-                end_bit = bit_field["end_bit"]
-                field_value = unpacked_fields[field_names.index(field["name"])]
-                bits_value = (field_value >> start_bit) & (2 ** (end_bit - start_bit + 1) - 1)
-                field_values.append(self._cast_output(value=bits_value, output_type=bit_field.get("output_type", "bool")))
-                field_names.append(bit_field["name"])
-        return dict(zip(field_names, field_values))
-
-    def _cast_output(self, value, output_type="hex"):
-        if output_type == "bool":
-            return bool(value)
-        elif output_type == "int":
-            return int(value)
-        else:  # hex string by default
-            return hex(value)
-
     def __repr__(self) -> str:
         return f"StructHexString(value={self.value}, hex_format={self.hex_format})"
 
@@ -83,6 +213,36 @@ class StructHexString:
 Model = typing.TypeVar('Model', bound='BaseModel')
 
 
+JQ_PROGRAMS_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=JQ_PROGRAMS_CACHE_SIZE)
+def get_jq_program(jq_filter: str):
+    """
+    Compiles a JQ filter, once per filter text.
+    """
+    return pyjq.compile(jq_filter)
+
+
+def jq_transform(jq_filter: str, data) -> list:
+    """
+    Applies a JQ filter to a JSON-like object, and returns all the outputs.
+    """
+    return get_jq_program(jq_filter).all(data)
+
+
+def jq_transform_many(jq_filter: str, items: list) -> list:
+    """
+    Applies a JQ filter to each item of a list, compiling it only once.
+    Returns the outputs of all the items, in order.
+    """
+    program = get_jq_program(jq_filter)
+    results = []
+    for item in items:
+        results.extend(program.all(item))
+    return results
+
+
 class DyntamicFactory:
     """
     Modified version of the DyntamicFactory class from:
@@ -398,7 +558,84 @@ class OptionalStringType(str):
         field_schema["type"] = ["string", "null"]
 
 
+class LazyInstance:
+    """
+    Proxy of an object that is created on first use, e.g. API or Redis clients kept at module level.
+    Creating them at import slows down the service startup and binds them to whatever event loop is running.
+    """
+
+    def __init__(self, factory: typing.Callable, *args, **kwargs):
+        self._factory = functools.partial(factory, *args, **kwargs)
+        self._instance = None
+
+    @property
+    def created(self) -> bool:
+        return self._instance is not None
+
+    def get_instance(self):
+        if self._instance is None:
+            self._instance = self._factory()
+        return self._instance
+
+    def reset(self):
+        self._instance = None
+
+    def __getattr__(self, name):
+        return getattr(self.get_instance(), name)
+
+
 def generate_batches(iterable, batch_size):
     for i in range(0, len(iterable), batch_size):
         yield iterable[i: i + batch_size]
 
+
+
+_current_stage_timings = contextvars.ContextVar("current_stage_timings", default=None)
+
+
+class StageTimings:
+    """
+    Accumulates the time spent in each stage of an action, in milliseconds.
+    Stages are exclusive: the time spent in a nested stage isn't counted in the outer stage.
+    Use StageTimings.start() in the action handler, so lower layers (e.g. the API client) can record their stages with timed_stage().
+    """
+
+    def __init__(self):
+        self._started_at = time.perf_counter()
+        self._durations = {}
+        self._nested = []  # Time spent in nested stages, for each open stage
+
+    @classmethod
+    def start(cls) -> "StageTimings":
+        timings = cls()
+        _current_stage_timings.set(timings)
+        return timings
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            self._durations[name] = self._durations.get(name, 0.0) + elapsed - nested
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def as_dict(self) -> dict:
+        timings = {name: round(duration * 1000, 2) for name, duration in self._durations.items()}
+        timings["total"] = round((time.perf_counter() - self._started_at) * 1000, 2)
+        return timings
+
+
+@contextlib.contextmanager
+def timed_stage(name: str):
+    # Records the stage in the timings of the running action, if any
+    timings = _current_stage_timings.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
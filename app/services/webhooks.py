@@ -1,16 +1,80 @@
+import asyncio
+import hashlib
 import importlib
+import json
 import logging
+import time
+from collections import OrderedDict
+import httpx
 from fastapi import Request
 from app import settings
 from app.services.activity_logger import log_activity, publish_event
-from gundi_client_v2 import GundiClient
 from gundi_core.events import IntegrationWebhookFailed, WebhookExecutionFailed
-from app.services.utils import DyntamicFactory
+from app.services.config_manager import IntegrationConfigurationManager
+from app.services.errors import WebhookQueueFull, WebhookQueueClosed, WebhookHandlerNotFound
+from app.services.utils import DyntamicFactory, LazyInstance, StructHexString
 from app.webhooks.core import get_webhook_handler, DynamicSchemaConfig, HexStringConfig, GenericJsonPayload
 
-_portal = GundiClient()
+config_manager = LazyInstance(IntegrationConfigurationManager)
 logger = logging.getLogger(__name__)
 
+# Integration details by integration id: (expiration time, integration or None if it doesn't exist)
+_integrations_cache = OrderedDict()
+
+# Payload models built from json schemas, keyed by schema hash (LRU)
+DYNAMIC_MODELS_CACHE_SIZE = 128
+_dynamic_models_cache = OrderedDict()
+
+
+def get_dynamic_payload_model(json_schema: dict, base_model):
+    schema_hash = hashlib.sha256(json.dumps(json_schema, sort_keys=True).encode("utf-8")).hexdigest()
+    cache_key = (schema_hash, base_model)
+    if (dynamic_payload_model := _dynamic_models_cache.get(cache_key)) is not None:
+        _dynamic_models_cache.move_to_end(cache_key)
+        return dynamic_payload_model
+    # Build the model from a json schema
+    model_factory = DyntamicFactory(
+        json_schema=json_schema,
+        base_model=base_model,
+        ref_template="definitions"
+    )
+    dynamic_payload_model = model_factory.make()
+    _dynamic_models_cache[cache_key] = dynamic_payload_model
+    if len(_dynamic_models_cache) > DYNAMIC_MODELS_CACHE_SIZE:
+        _dynamic_models_cache.popitem(last=False)
+    return dynamic_payload_model
+
+
+async def get_integration_details(integration_id: str):
+    """
+    Gets the integration details from the config cache, with an in-memory TTL layer on top.
+    Unknown integrations are cached too (for a shorter time) so they don't hit Gundi on every request.
+    """
+    now = time.monotonic()
+    if (cached := _integrations_cache.get(integration_id)) is not None:
+        expires_at, integration = cached
+        if expires_at > now:
+            return integration
+        del _integrations_cache[integration_id]
+    try:
+        integration = await config_manager.get_integration_details(integration_id)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 404:
+            raise
+        integration = None
+        ttl = settings.WEBHOOK_INTEGRATION_NOT_FOUND_CACHE_TTL
+    else:
+        ttl = settings.WEBHOOK_INTEGRATION_CACHE_TTL
+    if ttl > 0:
+        _integrations_cache[integration_id] = (now + ttl, integration)
+        if len(_integrations_cache) > settings.WEBHOOK_INTEGRATION_CACHE_MAX_ENTRIES:
+            _integrations_cache.popitem(last=False)  # Drop the oldest entry
+    return integration
+
+
+def clear_integrations_cache():
+    _integrations_cache.clear()
+
 
 async def get_integration(request):
     integration = None
@@ -19,36 +83,197 @@ async def get_integration(request):
     integration_id = consumer_integration or request.headers.get("x-gundi-integration-id") or request.query_params.get("integration_id")
     if integration_id:
         try:
-            integration = await _portal.get_integration_details(integration_id=integration_id)
+            integration = await get_integration_details(integration_id=integration_id)
         except Exception as e:
-            logger.warning(f"Error retrieving integration '{integration_id}' from the portal: {e}")
+            logger.warning(f"Error retrieving integration '{integration_id}' configuration: {e}")
     return integration
 
 
-async def process_webhook(request: Request):
+def decode_hex_strings_in_batch(items: list, hex_data_field: str, hex_format: dict) -> list:
+    """
+    Sets the hex string settings in each item of a list payload, and decodes the hex strings
+    of all the items sharing the same format at once (see StructHexString.decode_many).
+    Items that can't be decoded in a batch are left untouched, to be validated one by one.
+    """
+    batches = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        item["hex_data_field"] = item.get("hex_data_field", hex_data_field)
+        item["hex_format"] = item.get("hex_format", hex_format)
+        if isinstance(item.get(item["hex_data_field"]), str):
+            batch_key = (item["hex_data_field"], id(item["hex_format"]))
+            batches.setdefault(batch_key, []).append(item)
+    for (field_name, _), batch in batches.items():
+        try:
+            hex_strings = StructHexString.decode_many([item[field_name] for item in batch], batch[0]["hex_format"])
+        except Exception as e:
+            logger.debug(f"Hex strings in field '{field_name}' can't be decoded in a batch: {e}")
+            continue
+        for item, hex_string in zip(batch, hex_strings):
+            item[field_name] = hex_string
+    return items
+
+
+class WebhookBatcher:
+    """
+    Groups parsed webhook payloads per integration, and invokes the webhook handler with a list of payloads
+    once the batch is full or the oldest payload waited for max_wait seconds.
+    So the data received in many requests can be sent to Gundi at once.
+    """
+
+    def __init__(self, max_size: int, max_wait: float):
+        self.max_size = max_size
+        self.max_wait = max_wait  # Seconds
+        self._batches = {}  # integration id -> (integration, webhook config, payloads)
+        self._timers = {}  # integration id -> task flushing the batch after max_wait
+
+    async def add(self, integration, webhook_config, payload):
+        key = str(integration.id)
+        _, _, payloads = self._batches.get(key, (None, None, []))
+        if isinstance(payload, list):
+            payloads.extend(payload)
+        else:
+            payloads.append(payload)
+        # The latest integration details and config are used for the whole batch
+        self._batches[key] = (integration, webhook_config, payloads)
+        if len(payloads) >= self.max_size:
+            await self.flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: str):
+        await asyncio.sleep(self.max_wait)
+        self._timers.pop(key, None)
+        await self.flush(key)
+
+    async def flush(self, key: str):
+        if timer := self._timers.pop(key, None):
+            timer.cancel()
+        if (batch := self._batches.pop(key, None)) is None:
+            return
+        integration, webhook_config, payloads = batch
+        try:
+            webhook_handler, _, _ = get_webhook_handler()
+            await webhook_handler(payload=payloads, integration=integration, webhook_config=webhook_config)
+        except Exception as e:
+            message = f"Error processing a batch of {len(payloads)} webhook payloads: {str(e)}"
+            logger.exception(message)
+            await publish_event(
+                event=IntegrationWebhookFailed(
+                    payload=WebhookExecutionFailed(
+                        integration_id=str(integration.id),
+                        webhook_id=str(integration.type.webhook.value) if integration.type.webhook else None,
+                        config_data=webhook_config.dict() if webhook_config else {},
+                        error=message
+                    )
+                ),
+                topic_name=settings.INTEGRATION_EVENTS_TOPIC,
+            )
+
+    async def flush_all(self):
+        await asyncio.gather(*[self.flush(key) for key in list(self._batches.keys())])
+
+
+webhook_batcher = WebhookBatcher(
+    max_size=settings.WEBHOOK_BATCH_MAX_SIZE,
+    max_wait=settings.WEBHOOK_BATCH_MAX_WAIT
+)
+
+
+class WebhookWorkerPool:
+    """
+    Bounded pool of workers to process webhooks in the background.
+    Jobs are rejected when the queue is full, so memory stays bounded under load and callers can apply backpressure.
+    """
+
+    def __init__(self, workers: int, max_queue_size: int, shutdown_timeout: float = 30):
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.shutdown_timeout = shutdown_timeout  # Seconds
+        self._queue = None
+        self._tasks = []
+        self._loop = None
+        self._closed = False
+
+    def _start(self):
+        # Workers are started lazily in the running event loop
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            func, kwargs = await self._queue.get()
+            try:
+                await func(**kwargs)
+            except Exception as e:
+                logger.exception(f"Error processing webhook in the background: {e}")
+            finally:
+                self._queue.task_done()
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(self, func, **kwargs):
+        if self._closed:
+            raise WebhookQueueClosed("The webhooks queue is closed.")
+        if self._loop is not asyncio.get_running_loop():
+            self._start()
+        try:
+            self._queue.put_nowait((func, kwargs))
+        except asyncio.QueueFull:
+            raise WebhookQueueFull(f"The webhooks queue is full ({self.max_queue_size} requests).")
+
+    async def stop(self):
+        self._closed = True
+        if not self._tasks:
+            return
+        try:  # Let the workers finish the pending jobs
+            await asyncio.wait_for(self._queue.join(), timeout=self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.queue_size} webhooks weren't processed before shutdown.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+webhook_worker_pool = WebhookWorkerPool(
+    workers=settings.WEBHOOK_WORKERS,
+    max_queue_size=settings.WEBHOOK_QUEUE_MAX_SIZE
+)
+
+
+async def process_webhook(request: Request, body: bytes = None):
     try:
         # Try to relate the request to an integration
         integration = await get_integration(request=request)
         # Look for the handler function in webhooks/handlers.py
-        webhook_handler, payload_model, config_model = get_webhook_handler()
-        json_content = await request.json()
+        if (webhook_handler_info := get_webhook_handler()) is None:
+            raise WebhookHandlerNotFound()
+        webhook_handler, payload_model, config_model = webhook_handler_info
+        # Use the body read by the router if available, the request stream can't be read twice
+        json_content = json.loads(body) if body is not None else await request.json()
         # Parse config if a model was defined in webhooks/configurations.py
         webhook_config_data = integration.webhook_configuration.data if integration and integration.webhook_configuration else {}
         parsed_config = config_model.parse_obj(webhook_config_data) if config_model else {}
         if parsed_config and issubclass(config_model, HexStringConfig):
-            json_content["hex_data_field"] = json_content.get("hex_data_field", parsed_config.hex_data_field)
-            json_content["hex_format"] = json_content.get("hex_format", parsed_config.hex_format)
+            if isinstance(json_content, list):
+                decode_hex_strings_in_batch(json_content, parsed_config.hex_data_field, parsed_config.hex_format)
+            else:
+                json_content["hex_data_field"] = json_content.get("hex_data_field", parsed_config.hex_data_field)
+                json_content["hex_format"] = json_content.get("hex_format", parsed_config.hex_format)
         # Parse payload if a model was defined in webhooks/configurations.py
         if payload_model:
             try:
                 if issubclass(payload_model, GenericJsonPayload) and issubclass(config_model, DynamicSchemaConfig):
-                    # Build the model from a json schema
-                    model_factory = DyntamicFactory(
+                    # Build the model from a json schema, once per schema version
+                    dynamic_payload_model = get_dynamic_payload_model(
                         json_schema=parsed_config.json_schema,
-                        base_model=payload_model,
-                        ref_template="definitions"
+                        base_model=payload_model
                     )
-                    dynamic_payload_model = model_factory.make()
                     if isinstance(json_content, list):
                         parsed_payload = [dynamic_payload_model.parse_obj(d) for d in json_content]
                     else:
@@ -72,8 +297,11 @@ async def process_webhook(request: Request):
                 return {}
         else:  # Pass the raw payload
             parsed_payload = json_content
-        await webhook_handler(payload=parsed_payload, integration=integration, webhook_config=parsed_config)
-    except (ImportError, AttributeError, NotImplementedError) as e:
+        if settings.WEBHOOK_BATCHING_ENABLED and integration:
+            await webhook_batcher.add(integration=integration, webhook_config=parsed_config, payload=parsed_payload)
+        else:
+            await webhook_handler(payload=parsed_payload, integration=integration, webhook_config=parsed_config)
+    except WebhookHandlerNotFound:
         message = "Webhooks handler not found. Please implement a 'webhook_handler' function in app/webhooks/handlers.py"
         logger.exception(message)
         await publish_event(
@@ -6,10 +6,17 @@ env = Env()
 env.read_env()
 
 LOGGING_LEVEL = env.str("LOGGING_LEVEL", "INFO")
+LOGGING_FORMAT = env.str("LOGGING_FORMAT", "text")  # "text" or "json" (structured logs)
 
 DEFAULT_LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "formatters": {
+        "json": {
+            "()": "pythonjsonlogger.jsonlogger.JsonFormatter",
+            "fmt": "%(asctime)s %(levelname)s %(name)s %(message)s",
+        },
+    },
     "handlers": {
         "console": {
             "level": LOGGING_LEVEL,
@@ -24,8 +31,15 @@ DEFAULT_LOGGING = {
         },
     },
 }
+if LOGGING_FORMAT == "json":
+    DEFAULT_LOGGING["handlers"]["console"]["formatter"] = "json"
 logging.config.dictConfig(DEFAULT_LOGGING)
 
+# Request payloads are logged at DEBUG level, truncated and sampled per path (e.g. "/webhooks=0.01,/=1")
+LOG_PAYLOAD_MAX_LENGTH = env.int("LOG_PAYLOAD_MAX_LENGTH", 1000)
+LOG_PAYLOAD_SAMPLE_RATE = env.float("LOG_PAYLOAD_SAMPLE_RATE", 1.0)
+LOG_PAYLOAD_SAMPLE_RATES = env.dict("LOG_PAYLOAD_SAMPLE_RATES", {}, subcast_values=float)
+
 DEFAULT_REQUESTS_TIMEOUT = (10, 20)  # Connect, Read
 
 CDIP_API_ENDPOINT = env.str("CDIP_API_ENDPOINT", None)
@@ -43,6 +57,9 @@ SENSORS_API_BASE_URL = env.str("SENSORS_API_BASE_URL", None)
 
 # Used in OTel traces/spans to set the 'environment' attribute, used on metrics calculation
 TRACE_ENVIRONMENT = env.str("TRACE_ENVIRONMENT", "dev")
+TRACING_ENABLED = env.bool("TRACING_ENABLED", False)
+TRACING_EXPORTER = env.str("TRACING_EXPORTER", "gcp")  # "gcp" (Cloud Trace) or "console"
+TRACING_SAMPLE_RATE = env.float("TRACING_SAMPLE_RATE", 1.0)  # Used for new traces, otherwise the caller's decision is kept
 
 # GCP related settings
 GCP_PROJECT_ID = env.str("GCP_PROJECT_ID", "cdip-78ca")
@@ -67,10 +84,53 @@ INTEGRATION_TYPE_SLUG = env.str("INTEGRATION_TYPE_SLUG", None)  # Define a strin
 INTEGRATION_SERVICE_URL = env.str("INTEGRATION_SERVICE_URL", None)  # Define a string id here e.g. "my_tracker"
 PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND = env.bool("PROCESS_PUBSUB_MESSAGES_IN_BACKGROUND", False)
 PROCESS_WEBHOOKS_IN_BACKGROUND = env.bool("PROCESS_WEBHOOKS_IN_BACKGROUND", True)
+# Background webhooks are processed by a pool of workers. Requests are rejected (429) when the queue is full
+WEBHOOK_WORKERS = env.int("WEBHOOK_WORKERS", 10)
+WEBHOOK_QUEUE_MAX_SIZE = env.int("WEBHOOK_QUEUE_MAX_SIZE", 1000)
+# Webhook integration lookups are cached in memory on top of the config cache (0 disables the in-memory cache)
+WEBHOOK_INTEGRATION_CACHE_TTL = env.int("WEBHOOK_INTEGRATION_CACHE_TTL", 60)  # Seconds
+WEBHOOK_INTEGRATION_NOT_FOUND_CACHE_TTL = env.int("WEBHOOK_INTEGRATION_NOT_FOUND_CACHE_TTL", 30)  # Seconds
+WEBHOOK_INTEGRATION_CACHE_MAX_ENTRIES = env.int("WEBHOOK_INTEGRATION_CACHE_MAX_ENTRIES", 1024)
+WEBHOOK_CONFIG_CACHE_TTL = env.int("WEBHOOK_CONFIG_CACHE_TTL", 60 * 10)  # Seconds, in Redis (0 means no expiration)
+# Micro-batching: webhook payloads are grouped per integration and the handler receives a list of payloads
+WEBHOOK_BATCHING_ENABLED = env.bool("WEBHOOK_BATCHING_ENABLED", False)
+WEBHOOK_BATCH_MAX_SIZE = env.int("WEBHOOK_BATCH_MAX_SIZE", 100)  # Payloads
+WEBHOOK_BATCH_MAX_WAIT = env.float("WEBHOOK_BATCH_MAX_WAIT", 2.0)  # Seconds
 MAX_ACTION_EXECUTION_TIME = env.int("MAX_ACTION_EXECUTION_TIME", 60 * 9)  # 10 minutes is the maximum ack timeout
+# Actions executed by the API and the push endpoint run in separate pools of workers (name: workers), so long
+# backfills don't delay auth checks. Auth actions go to the "auth" pool, other actions to the pool assigned here or "pull"
+ACTION_POOLS = env.dict("ACTION_POOLS", {"auth": 2, "pull": 10, "backfill": 2}, subcast_values=int)
+ACTION_POOL_ASSIGNMENTS = env.dict("ACTION_POOL_ASSIGNMENTS", {"pull_historical_observations": "backfill"})
+ACTION_QUEUE_MAX_SIZE = env.int("ACTION_QUEUE_MAX_SIZE", 1000)  # Per pool, requests are rejected (429) when full
+# Overlapping runs of these actions for the same integration are prevented with a lease in Redis.
+# When the lease is held, new runs are skipped, wait for it (up to ACTION_LEASE_WAIT_TIMEOUT seconds),
+# or are queued to run once after the current run. Use "disabled" to allow overlapping runs.
+ACTION_LEASE_MODE = env.str("ACTION_LEASE_MODE", "skip")  # "skip", "wait", "queue" or "disabled"
+ACTION_LEASE_ACTIONS = env.list("ACTION_LEASE_ACTIONS", ["pull_observations"])
+ACTION_LEASE_TTL = env.int("ACTION_LEASE_TTL", MAX_ACTION_EXECUTION_TIME + 60)  # Seconds, outlives the action timeout
+ACTION_LEASE_WAIT_TIMEOUT = env.int("ACTION_LEASE_WAIT_TIMEOUT", 60)  # Seconds
+# Profiles of actions executed with "profile": true are saved here (sampling interval in seconds)
+ACTION_PROFILES_DIR = env.str("ACTION_PROFILES_DIR", "/tmp/action-profiles")
+ACTION_PROFILING_INTERVAL = env.float("ACTION_PROFILING_INTERVAL", 0.001)
+# Error details published for the activity logs are truncated, and repeated errors of an action for the same
+# integration are published at most once per interval (seconds, 0 publishes every error)
+ACTION_ERROR_DETAILS_MAX_LENGTH = env.int("ACTION_ERROR_DETAILS_MAX_LENGTH", 2000)  # Characters
+ACTION_ERROR_TRACEBACK_FRAMES = env.int("ACTION_ERROR_TRACEBACK_FRAMES", 10)
+ACTION_ERROR_EVENTS_INTERVAL = env.float("ACTION_ERROR_EVENTS_INTERVAL", 60)
 
 # Settings for system events & commands (EDA)
 INTEGRATION_EVENTS_TOPIC = env.str("INTEGRATION_EVENTS_TOPIC", "integration-events")
 default_commands_topic = f"{INTEGRATION_TYPE_SLUG}-actions-topic" if INTEGRATION_TYPE_SLUG else None
 INTEGRATION_COMMANDS_TOPIC = env.str("INTEGRATION_COMMANDS_TOPIC", default_commands_topic)
 TRIGGER_ACTIONS_ALWAYS_SYNC = env.bool("TRIGGER_ACTIONS_ALWAYS_SYNC", False)
+# Config events already processed are remembered to drop redeliveries, and each config keeps the timestamp
+# of the latest event applied so older events are discarded
+CONFIG_EVENTS_DEDUPLICATION_TTL = env.int("CONFIG_EVENTS_DEDUPLICATION_TTL", 60 * 60 * 24)  # Seconds
+CONFIG_EVENTS_VERSION_TTL = env.int("CONFIG_EVENTS_VERSION_TTL", 60 * 60 * 24 * 7)  # Seconds
+
+# Settings for the pull worker (app/worker.py), an alternative to the push endpoint for commands
+INTEGRATION_COMMANDS_SUBSCRIPTION = env.str("INTEGRATION_COMMANDS_SUBSCRIPTION", None)
+PUBSUB_WORKER_CONCURRENCY = env.int("PUBSUB_WORKER_CONCURRENCY", 10)  # Actions executed at the same time
+PUBSUB_WORKER_MAX_MESSAGES = env.int("PUBSUB_WORKER_MAX_MESSAGES", 20)  # Messages pulled but not yet acked
+PUBSUB_WORKER_ACK_DEADLINE = env.int("PUBSUB_WORKER_ACK_DEADLINE", None)  # Seconds, the subscription's by default
+PUBSUB_WORKER_METRICS_PORT = env.int("PUBSUB_WORKER_METRICS_PORT", None)  # Serve Prometheus metrics on this port
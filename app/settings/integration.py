@@ -1 +1,16 @@
 # Add your integration-specific settings here
+from .base import env
+
+
+# DigitAnimal responses are shared across integrations using the same account (0 disables the cache)
+DIGITANIMAL_RESPONSE_CACHE_TTL = env.int("DIGITANIMAL_RESPONSE_CACHE_TTL", 30)  # Seconds
+DIGITANIMAL_RESPONSE_CACHE_MAX_ENTRIES = env.int("DIGITANIMAL_RESPONSE_CACHE_MAX_ENTRIES", 256)
+# Share cached responses across replicas through Redis
+DIGITANIMAL_RESPONSE_CACHE_USE_REDIS = env.bool("DIGITANIMAL_RESPONSE_CACHE_USE_REDIS", False)
+
+# Client-side throttling for DigitAnimal, per account
+DIGITANIMAL_RATE_LIMIT_PER_SECOND = env.float("DIGITANIMAL_RATE_LIMIT_PER_SECOND", 1.0)  # 0 disables the rate limit
+DIGITANIMAL_RATE_LIMIT_BURST = env.int("DIGITANIMAL_RATE_LIMIT_BURST", 5)
+DIGITANIMAL_CIRCUIT_BREAKER_ENABLED = env.bool("DIGITANIMAL_CIRCUIT_BREAKER_ENABLED", True)
+DIGITANIMAL_CIRCUIT_BREAKER_FAILURE_THRESHOLD = env.int("DIGITANIMAL_CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5)
+DIGITANIMAL_CIRCUIT_BREAKER_RECOVERY_TIMEOUT = env.int("DIGITANIMAL_CIRCUIT_BREAKER_RECOVERY_TIMEOUT", 60)  # Seconds
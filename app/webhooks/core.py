@@ -1,10 +1,13 @@
+import functools
 import importlib
 import inspect
 import json
 from typing import Optional, Union
 from pydantic import BaseModel
 from fastapi.encoders import jsonable_encoder
-from app.services.utils import StructHexString, UISchemaModelMixin, FieldWithUIOptions, UIOptions
+from app.services.utils import (
+    StructHexString, UISchemaModelMixin, FieldWithUIOptions, UIOptions, jq_transform, jq_transform_many
+)
 
 
 class WebhookConfiguration(UISchemaModelMixin, BaseModel):
@@ -37,6 +40,13 @@ class JQTransformConfig(UISchemaModelMixin, BaseModel):
         )
     )
 
+    def transform(self, data) -> list:
+        # The compiled JQ program is cached and shared by all the requests using the same filter
+        return jq_transform(self.jq_filter, data)
+
+    def transform_many(self, items: list) -> list:
+        return jq_transform_many(self.jq_filter, items)
+
 
 class GenericJsonTransformConfig(JQTransformConfig, DynamicSchemaConfig):
     output_type: str = FieldWithUIOptions(
@@ -93,11 +103,17 @@ class GenericJsonWithHexStrPayload(HexStringPayload, GenericJsonPayload):
     pass
 
 
+@functools.lru_cache(maxsize=None)
 def get_webhook_handler():
+    """
+    Returns the webhook handler with its payload and config models, or None if no handler is implemented.
+    It's resolved once and memoized, a missing handler included. Errors importing the handlers module are raised.
+    """
 
     # Import the module using importlib
     module = importlib.import_module("app.webhooks.handlers")
-    handler = module.webhook_handler
+    if (handler := getattr(module, "webhook_handler", None)) is None:
+        return None
 
     if (annotation := inspect.signature(handler).parameters.get("payload").annotation) != inspect._empty:
         payload_model = annotation
@@ -111,3 +127,10 @@ def get_webhook_handler():
         config_model = None
 
     return handler, payload_model, config_model
+
+
+def reload_webhook_handler():
+    # Useful in development, to reload the handlers without restarting the service
+    get_webhook_handler.cache_clear()
+    importlib.reload(importlib.import_module("app.webhooks.handlers"))
+    return get_webhook_handler()
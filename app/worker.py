@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import signal
+
+import aiohttp
+import click
+from gcloud.aio import pubsub
+from prometheus_client import start_http_server
+
+from app import settings
+from app.services.action_runner import execute_action, action_pools, _portal, flush_error_events
+from app.services.tracing import configure_tracing, shutdown_tracing
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _extend_ack_deadline(subscriber_client, subscription: str, ack_id: str, ack_deadline: int):
+    # Keep the lease on the message while the action is running, so it's not redelivered.
+    # Extended right away, the message may have waited in the queue for most of its deadline.
+    while True:
+        try:
+            await subscriber_client.modify_ack_deadline(subscription, [ack_id], ack_deadline)
+        except Exception as e:
+            logger.warning(f"Error extending the ack deadline of message {ack_id}: {type(e).__name__}: {e}")
+        await asyncio.sleep(ack_deadline / 2)
+
+
+async def _get_ack_deadline(subscriber_client, subscription: str) -> int:
+    try:
+        subscription_details = await subscriber_client.get_subscription(subscription)
+        return int(subscription_details["ackDeadlineSeconds"])
+    except Exception as e:
+        logger.warning(f"Error getting the ack deadline of {subscription}: {type(e).__name__}: {e}. Using 60s.")
+        return 60
+
+
+async def _shutdown():
+    # Same as the shutdown hook of the API (see app/main.py)
+    await action_pools.stop()  # Let the queued actions (e.g. lease re-runs) finish
+    await flush_error_events()
+    if _portal.created:  # The Gundi client is created on first use
+        await _portal.close()
+
+
+def get_message_handler(subscriber_client, subscription: str, ack_deadline: int):
+
+    async def handle_message(message: pubsub.SubscriberMessage):
+        try:
+            command = json.loads(message.data.decode("utf-8").strip())
+        except (AttributeError, UnicodeDecodeError, json.JSONDecodeError) as e:
+            # Acked and discarded, it would fail on every redelivery
+            logger.error(f"Discarding invalid command message {message.message_id}: {e}")
+            return
+        logger.debug(f"Command received: {command}")
+        lease_extender = asyncio.create_task(
+            _extend_ack_deadline(subscriber_client, subscription, message.ack_id, ack_deadline)
+        )
+        try:
+            # Errors are handled and published by execute_action, the message is acked anyway as in push mode
+            await execute_action(
+                integration_id=command.get("integration_id"),
+                action_id=command.get("action_id"),
+                config_overrides=command.get("config_overrides"),
+                trace_context=message.attributes,
+            )
+        finally:
+            lease_extender.cancel()
+
+    return handle_message
+
+
+async def run_worker(subscription_name: str, concurrency: int, max_messages: int, ack_deadline: int = None):
+    """
+    Consumes action commands from a Pub/Sub subscription using streaming pull.
+    The ack deadline of the messages is extended while their action runs, by the subscription's ack deadline unless set.
+    Set PUBSUB_EMULATOR_HOST to use it with the local Pub/Sub emulator.
+    """
+    subscription = f"projects/{settings.GCP_PROJECT_ID}/subscriptions/{subscription_name}"
+    # Stop gracefully on SIGTERM (e.g. when the container is stopped), as on Ctrl+C
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        async with aiohttp.ClientSession() as session:
+            subscriber_client = pubsub.SubscriberClient(session=session)
+            ack_deadline = ack_deadline or await _get_ack_deadline(subscriber_client, subscription)
+            logger.info(
+                f"Starting worker for {subscription}. Concurrency: {concurrency}, max messages: {max_messages}, ack deadline: {ack_deadline}s"
+            )
+            await pubsub.subscribe(
+                subscription,
+                get_message_handler(subscriber_client, subscription, ack_deadline),
+                subscriber_client,
+                num_producers=1,
+                max_messages_per_producer=max_messages,  # Flow control
+                num_tasks_per_consumer=concurrency,
+            )
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        await _shutdown()
+
+
+@click.command()
+@click.option('--subscription', default=settings.INTEGRATION_COMMANDS_SUBSCRIPTION, help='Name of the commands subscription')
+@click.option('--concurrency', default=settings.PUBSUB_WORKER_CONCURRENCY, help='Max number of actions executed at the same time')
+@click.option('--max-messages', default=settings.PUBSUB_WORKER_MAX_MESSAGES, help='Max number of messages pulled and not yet acked')
+@click.option('--ack-deadline', default=settings.PUBSUB_WORKER_ACK_DEADLINE, help="Ack deadline in seconds, extended while an action runs. Defaults to the subscription's")
+@click.option('--metrics-port', default=settings.PUBSUB_WORKER_METRICS_PORT, type=int, help='Port to serve Prometheus metrics on (disabled by default)')
+def start_worker(subscription, concurrency, max_messages, ack_deadline, metrics_port):
+    if not subscription:
+        raise click.BadParameter("Set INTEGRATION_COMMANDS_SUBSCRIPTION in the environment or use --subscription.")
+    if metrics_port:  # The worker doesn't run the API, so metrics are served in a separate thread
+        start_http_server(metrics_port)
+    configure_tracing()
+    try:
+        asyncio.run(
+            run_worker(
+                subscription_name=subscription,
+                concurrency=concurrency,
+                max_messages=max_messages,
+                ack_deadline=ack_deadline
+            )
+        )
+    finally:
+        shutdown_tracing()
+
+
+# Main
+if __name__ == "__main__":
+    start_worker()
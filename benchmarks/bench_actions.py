@@ -0,0 +1,25 @@
+from app.actions.client import DigitAnimalResponse
+from app.actions.handlers import transform
+from app.services.utils import generate_batches
+
+
+def bench_parse_devices_response(benchmark, devices_payload):
+    response = benchmark(DigitAnimalResponse.parse_obj, devices_payload)
+
+    assert len(response.data.devices) == len(devices_payload["data"]["devices"])
+
+
+def bench_transform_devices(benchmark, devices_payload):
+    devices = DigitAnimalResponse.parse_obj(devices_payload).data.devices
+
+    observations = benchmark(lambda: [transform(device) for device in devices])
+
+    assert len(observations) == len(devices)
+
+
+def bench_generate_batches(benchmark):
+    observations = [{"source": f"collar-{i}"} for i in range(10000)]
+
+    batches = benchmark(lambda: list(generate_batches(observations, 200)))
+
+    assert len(batches) == 50
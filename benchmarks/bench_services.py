@@ -0,0 +1,42 @@
+from collections import OrderedDict
+
+from app.services.utils import DyntamicFactory, StructHexString, jq_transform_many
+from app.services.webhooks import get_dynamic_payload_model
+from app.webhooks.core import GenericJsonPayload
+
+
+def bench_decode_hex_string(benchmark, hex_format):
+    hex_string = benchmark(StructHexString.validate, "6881631900003c20020000c3", {"hex_format": hex_format}, None)
+
+    assert hex_string.unpacked_data["interval"] == 60
+
+
+def bench_decode_hex_strings_in_batch(benchmark, hex_format, hex_strings):
+    decoded = benchmark(StructHexString.decode_many, hex_strings, hex_format)
+
+    assert len(decoded) == len(hex_strings)
+
+
+def bench_make_dynamic_model(benchmark, json_schema):
+    model_factory = DyntamicFactory(json_schema=json_schema, base_model=GenericJsonPayload, ref_template="definitions")
+
+    model = benchmark(model_factory.make)
+
+    assert "location" in model.__fields__
+
+
+def bench_get_cached_dynamic_model(benchmark, mocker, json_schema):
+    mocker.patch("app.services.webhooks._dynamic_models_cache", OrderedDict())
+
+    model = benchmark(get_dynamic_payload_model, json_schema=json_schema, base_model=GenericJsonPayload)
+
+    assert "location" in model.__fields__
+
+
+def bench_jq_transform_many(benchmark):
+    items = [{"device": f"d{i}", "lat": 1.0, "lon": 2.0} for i in range(1000)]
+    jq_filter = '{"source": .device, "location": {"lat": .lat, "lon": .lon}}'
+
+    observations = benchmark(jq_transform_many, jq_filter, items)
+
+    assert len(observations) == len(items)
@@ -0,0 +1,71 @@
+import pytest
+
+from benchmarks.fake_servers import build_devices_payload
+
+
+@pytest.fixture(params=[100, 1000])
+def devices_payload(request):
+    return build_devices_payload(devices=request.param)
+
+
+@pytest.fixture
+def hex_format():
+    return {
+        "byte_order": ">",
+        "fields": [
+            {"name": "start_bit", "format": "B", "output_type": "int"},
+            {"name": "v", "format": "I"},
+            {"name": "interval", "format": "H", "output_type": "int"},
+            {"name": "meter_state_1", "format": "B"},
+            {
+                "name": "meter_state_2",
+                "format": "B",
+                "bit_fields": [
+                    {"name": "meter_batter_alarm", "end_bit": 0, "start_bit": 0, "output_type": "bool"},
+                    {"name": "empty_pipe_alarm", "end_bit": 1, "start_bit": 1, "output_type": "bool"},
+                    {"name": "state_bits", "end_bit": 7, "start_bit": 1, "output_type": "int"},
+                ]
+            },
+            {"name": "r1", "format": "B", "output_type": "int"},
+            {"name": "r2", "format": "B", "output_type": "int"},
+            {"name": "crc", "format": "B", "output_type": "hex"},
+        ]
+    }
+
+
+@pytest.fixture
+def hex_strings():
+    return ["6881631900003c20020000c3"] * 1000
+
+
+@pytest.fixture
+def json_schema():
+    return {
+        "type": "object",
+        "title": "BenchmarkPayload",
+        "properties": {
+            "received_at": {"type": "string", "format": "date-time"},
+            "device": {
+                "type": "object",
+                "properties": {
+                    "device_id": {"type": "string"},
+                    "dev_eui": {"type": "string"},
+                    "application_ids": {
+                        "type": "object",
+                        "properties": {"application_id": {"type": "string"}},
+                    },
+                },
+            },
+            "location": {
+                "type": "object",
+                "properties": {
+                    "latitude": {"type": "number"},
+                    "longitude": {"type": "number"},
+                    "altitude": {"type": "integer"},
+                },
+                "required": ["latitude", "longitude"],
+            },
+            "battery": {"type": "number"},
+        },
+        "required": ["received_at", "device", "location"],
+    }
@@ -0,0 +1,181 @@
+"""
+End-to-end benchmark of the pull_observations action.
+DigitAnimal, Gundi and Pub/Sub are replaced by local fake servers (see fake_servers.py),
+and Redis by fakeredis (or a local Redis server with --redis local).
+
+Usage: python -m benchmarks.e2e --devices 100 --devices 10000 --runs 3
+"""
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+
+import click
+import httpx
+
+from benchmarks import fake_servers
+
+
+def configure_environment(base_url: str, redis_mode: str):
+    # Must run before importing the app, settings are read on import
+    os.environ.update({
+        "GUNDI_API_BASE_URL": f"{base_url}/gundi",
+        "SENSORS_API_BASE_URL": f"{base_url}/sensors",
+        "KEYCLOAK_ISSUER": f"{base_url}/auth",
+        "KEYCLOAK_CLIENT_ID": "benchmark",
+        "KEYCLOAK_CLIENT_SECRET": "benchmark",
+        "PUBSUB_EMULATOR_HOST": base_url.replace("http://", ""),
+        "GCP_PROJECT_ID": "benchmark",
+        "LOGGING_LEVEL": os.environ.get("LOGGING_LEVEL", "WARNING"),
+        # Measure the upstream calls on every run
+        "DIGITANIMAL_RESPONSE_CACHE_TTL": "0",
+        "DIGITANIMAL_RATE_LIMIT_PER_SECOND": "0",
+        "ACTION_LEASE_MODE": "disabled",  # fakeredis needs lupa for the release script
+    })
+    if redis_mode == "fake":
+        import fakeredis
+        import redis.asyncio
+        redis.asyncio.Redis = fakeredis.aioredis.FakeRedis
+
+
+class StageTimer:
+    """
+    Accumulates the time spent in some functions, by replacing them with timed wrappers.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def wrap(self, stage: str, obj, name: str):
+        func = getattr(obj, name)
+
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.durations[stage] += time.perf_counter() - start
+                self.calls[stage] += 1
+
+        setattr(obj, name, timed)
+
+    def reset(self):
+        self.durations.clear()
+        self.calls.clear()
+
+
+def instrument(timer: StageTimer):
+    from app.actions import client, handlers
+    from app.services import action_runner, activity_logger
+
+    timer.wrap("config_lookup", action_runner.config_manager, "get_integration_details")
+    timer.wrap("fetch_devices", client, "get_devices_observations")
+    timer.wrap("read_states", handlers.state_manager, "get_states")
+    timer.wrap("send_observations", handlers, "send_observations_to_gundi")
+    timer.wrap("save_states", handlers.state_manager, "set_states")
+    timer.wrap("publish_events", activity_logger, "publish_event")
+    timer.wrap("publish_events", action_runner, "publish_event")
+
+
+def get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+
+async def run_benchmark(base_url: str, devices: int, timer: StageTimer) -> dict:
+    from app.services.action_runner import execute_action, config_manager
+
+    async with httpx.AsyncClient(base_url=base_url) as fake_servers_client:
+        await fake_servers_client.post("/_reset", json={"devices": devices})
+        # Start with an empty cache so all the observations are new
+        await config_manager.db_client.flushall()
+        await execute_action(fake_servers.INTEGRATION_ID, "auth")  # Warm up the config cache and connections
+        await fake_servers_client.post("/_reset", json={"devices": devices})
+        timer.reset()
+        start = time.perf_counter()
+        result = await execute_action(fake_servers.INTEGRATION_ID, "pull_observations")
+        total_time = time.perf_counter() - start
+        upstream_requests = (await fake_servers_client.get("/_stats")).json()
+    if not isinstance(result, dict):  # Errors are returned as JSON responses
+        raise click.ClickException(f"The action failed: {result.body.decode()}")
+
+    stages = {stage: round(duration * 1000, 2) for stage, duration in timer.durations.items()}
+    stages["other"] = round(total_time * 1000 - sum(stages.values()), 2)  # Parsing, filtering and transformations
+    requests_count = sum(upstream_requests.values())
+    return {
+        "devices": devices,
+        "result": result,
+        "total_ms": round(total_time * 1000, 2),
+        "stages_ms": stages,
+        "observations_per_second": round(devices / total_time, 1),
+        "upstream_requests": upstream_requests,
+        "requests_per_second": round(requests_count / total_time, 1),
+        "peak_rss_mb": round(get_peak_rss_mb(), 1),
+    }
+
+
+async def run_benchmarks(base_url: str, devices: list, runs: int) -> list:
+    timer = StageTimer()
+    instrument(timer)
+    results = []
+    for devices_count in sorted(devices):  # Peak RSS only grows, so go from small to big
+        for _ in range(runs):
+            results.append(await run_benchmark(base_url, devices_count, timer))
+    return results
+
+
+def print_report(results: list):
+    stages = sorted({stage for result in results for stage in result["stages_ms"]})
+    header = ["devices", "total_ms", *stages, "obs/s", "req/s", "peak_rss_mb"]
+    click.echo(" | ".join(f"{column:>17}" for column in header))
+    for result in results:
+        row = [
+            result["devices"],
+            result["total_ms"],
+            *[result["stages_ms"].get(stage, 0) for stage in stages],
+            result["observations_per_second"],
+            result["requests_per_second"],
+            result["peak_rss_mb"],
+        ]
+        click.echo(" | ".join(f"{value:>17}" for value in row))
+
+
+@click.command()
+@click.option("--devices", "-d", type=int, multiple=True, default=[100, 1000, 10000], help="Devices returned by DigitAnimal")
+@click.option("--runs", type=int, default=1, help="Runs per number of devices")
+@click.option("--redis", "redis_mode", type=click.Choice(["fake", "local"]), default="fake",
+              help="Use fakeredis, or the Redis server set in REDIS_HOST/REDIS_PORT")
+@click.option("--port", type=int, default=8765, help="Port for the fake servers")
+@click.option("--output", type=click.Path(), default=None, help="Save the results in a JSON file")
+def main(devices, runs, redis_mode, port, output):
+    base_url = f"http://127.0.0.1:{port}"
+    configure_environment(base_url=base_url, redis_mode=redis_mode)
+    # The fake servers run in another process so they don't compete with the service for the CPU
+    servers = multiprocessing.Process(target=fake_servers.run, kwargs={"port": port}, daemon=True)
+    servers.start()
+    try:
+        for _ in range(50):  # Wait for the servers
+            try:
+                httpx.get(f"{base_url}/_stats")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        results = asyncio.run(run_benchmarks(base_url, devices, runs))
+        print_report(results)
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        servers.terminate()
+
+
+if __name__ == "__main__":
+    main()
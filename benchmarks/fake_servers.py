@@ -0,0 +1,171 @@
+"""
+Local stand-ins for the services used by the integration, served by a single app:
+- DigitAnimal API: GET /digitanimal/get_device_info.php
+- Gundi API & auth: /gundi/v2/integrations/..., POST /auth/protocol/openid-connect/token
+- Gundi Sensors API: POST /sensors/v2/observations/
+- GCP Pub/Sub (emulator API): POST /v1/projects/{project}/topics/{topic}:publish
+The number of devices returned by DigitAnimal is set with POST /_reset, and request counts are read from GET /_stats.
+"""
+import datetime
+import json
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+INTEGRATION_ID = "a6ba9b06-1a1e-4e4c-8ed7-4c2c5b9bd4f4"
+INTEGRATION_API_KEY = "benchmark-api-key"
+
+app = FastAPI()
+app.state.devices = 100
+app.state.responses = {}  # DigitAnimal responses by number of devices
+app.state.stats = Counter()
+
+
+def get_integration(base_url: str) -> dict:
+    return {
+        "id": INTEGRATION_ID,
+        "name": "DigitAnimal Benchmark",
+        "base_url": f"{base_url}digitanimal/",
+        "enabled": True,
+        "type": {
+            "id": "e7fa6a02-3a3c-4b5a-8b2d-5b3e8d2b5c7a",
+            "name": "DigitAnimal",
+            "value": "digitanimal",
+            "description": "Benchmark integration type",
+            "actions": [
+                {"id": "0b3c5c4a-7a1b-4c8e-9f3c-1d2e3f4a5b6c", "type": "auth", "name": "Authenticate", "value": "auth"},
+                {
+                    "id": "1c4d6d5b-8b2c-4d9f-a04d-2e3f4a5b6c7d",
+                    "type": "pull",
+                    "name": "Pull Observations",
+                    "value": "pull_observations",
+                },
+            ],
+        },
+        "owner": {"id": "a91b400b-482a-4546-8fcb-ee42b01deeb6", "name": "Benchmark Org", "description": ""},
+        "configurations": [
+            {
+                "id": "2d5e7e6c-9c3d-4ea0-b15e-3f4a5b6c7d8e",
+                "integration": INTEGRATION_ID,
+                "action": {"id": "0b3c5c4a-7a1b-4c8e-9f3c-1d2e3f4a5b6c", "type": "auth", "name": "Authenticate", "value": "auth"},
+                "data": {"username": "benchmark", "password": "benchmark"},
+            },
+            {
+                "id": "3e6f8f7d-ad4e-4fb1-826f-4a5b6c7d8e9f",
+                "integration": INTEGRATION_ID,
+                "action": {
+                    "id": "1c4d6d5b-8b2c-4d9f-a04d-2e3f4a5b6c7d",
+                    "type": "pull",
+                    "name": "Pull Observations",
+                    "value": "pull_observations",
+                },
+                "data": {"gmt_offset": 0},
+            },
+        ],
+        "webhook_configuration": None,
+        "additional": {},
+        "default_route": None,
+        "status": "healthy",
+        "status_details": "",
+    }
+
+
+def build_devices_payload(devices: int) -> dict:
+    device_time = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "success": True,
+        "message": "OK",
+        "data": {
+            "devices": [
+                {
+                    "DEVICE_COLLAR": f"collar-{i}",
+                    "LAT": 40.0 + (i % 1000) / 1000,
+                    "LNG": -3.0 - (i % 1000) / 1000,
+                    "DEVICE_TIME": device_time,
+                    "DEVICE_ALARM": False,
+                    "DEVICE_LOCATION": True,
+                    "DEVICE_TEMPERATURE": False,
+                    "RAW_TEMPERATURE": 21.5,
+                    "RAW_ACC_X": 0.1,
+                    "RAW_ACC_Y": 0.2,
+                    "RAW_ACC_Z": 0.3,
+                }
+                for i in range(devices)
+            ],
+            "history": [],
+        },
+    }
+
+
+def get_devices_response(devices: int) -> bytes:
+    if (response := app.state.responses.get(devices)) is None:
+        response = json.dumps(build_devices_payload(devices)).encode("utf-8")
+        app.state.responses = {devices: response}  # Keep only one response in memory
+    return response
+
+
+@app.middleware("http")
+async def count_requests(request: Request, call_next):
+    if not request.url.path.startswith("/_"):
+        app.state.stats[request.url.path.split("/")[1]] += 1
+    return await call_next(request)
+
+
+@app.post("/_reset")
+async def reset(request: Request):
+    data = await request.json()
+    app.state.devices = data.get("devices", app.state.devices)
+    app.state.stats.clear()
+    return {"devices": app.state.devices}
+
+
+@app.get("/_stats")
+async def stats():
+    return dict(app.state.stats)
+
+
+@app.get("/digitanimal/get_device_info.php")
+async def get_device_info():
+    return Response(content=get_devices_response(app.state.devices), media_type="application/json")
+
+
+@app.post("/auth/protocol/openid-connect/token")
+async def get_token():
+    return {
+        "access_token": "benchmark-token",
+        "refresh_token": "benchmark-refresh-token",
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "refresh_expires_in": 0,
+    }
+
+
+@app.get("/gundi/v2/integrations/{integration_id}/")
+async def get_integration_details(integration_id: str, request: Request):
+    return get_integration(base_url=str(request.base_url))
+
+
+@app.get("/gundi/v2/integrations/{integration_id}/api-key/")
+async def get_integration_api_key(integration_id: str):
+    return {"api_key": INTEGRATION_API_KEY}
+
+
+@app.post("/sensors/v2/observations/")
+async def post_observations(request: Request):
+    observations = await request.json()
+    return [{"object_id": str(i), "created_at": "2024-01-01T00:00:00Z"} for i in range(len(observations))]
+
+
+@app.post("/v1/projects/{project}/topics/{topic}")
+async def publish(project: str, topic: str, request: Request):
+    data = await request.json()
+    return {"messageIds": [str(i) for i in range(len(data.get("messages", [])))]}
+
+
+def run(host: str = "127.0.0.1", port: int = 8765):
+    uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    run()
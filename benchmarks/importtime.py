@@ -0,0 +1,31 @@
+"""
+Import time of the service, measured with `python -X importtime` in fresh interpreters.
+Run from the repository root:
+    python -m benchmarks.importtime --runs 5 --top 20 --output importtime.json
+The import time of app.main is most of the cold start of the service, before the lifespan hook runs.
+The measurement helpers live in app/services/importtime.py, as the startup tests use them too.
+"""
+import json
+
+import click
+
+from app.services.importtime import measure_import_time, format_report, APP_IMPORT_TIME_BUDGET_MS
+
+
+@click.command()
+@click.option("--module", default="app.main", show_default=True, help="Module to import.")
+@click.option("--runs", default=5, show_default=True, help="Imports in fresh interpreters, the median is reported.")
+@click.option("--top", default=20, show_default=True, help="Number of packages and modules listed.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Save the report as JSON.")
+def main(module, runs, top, output):
+    report = measure_import_time(module=module, runs=runs, top=top)
+    click.echo(format_report(report))
+    if output:
+        with open(output, "w") as f:
+            json.dump({key: value for key, value in report.items() if key != "imported"}, f, indent=2)
+    if report["app_self_ms"] > APP_IMPORT_TIME_BUDGET_MS:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()